@@ -1,8 +1,11 @@
-import google.generativeai as genai
+import hashlib
 import json
 import re
 import io
 import platform
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from PIL import Image
 from dotenv import load_dotenv
@@ -16,17 +19,65 @@ if platform.system() == "Windows":
         import pytesseract
         pytesseract.pytesseract.tesseract_cmd = tesseract_path
 
+# Warm the EasyOCR models at startup: "auto" only when Tesseract is unusable, "1" always, "0" never
+OCR_WARMUP = os.getenv("BUDGET_OCR_WARMUP", "auto")
+
+# Receipts OCR'd at once, per process. Tesseract runs as its own process per call,
+# so threads are enough to keep every core busy.
+OCR_WORKERS = int(os.getenv("BUDGET_OCR_WORKERS", os.cpu_count() or 4))
+# Concurrent EasyOCR inferences, per process: each one is memory-heavy and multi-threaded already
+EASYOCR_WORKERS = int(os.getenv("BUDGET_EASYOCR_WORKERS", 2))
+
+# OCR text sent to Gemini per request, in tokens (≈ 4 characters each). Bigger batches
+# share the prompt overhead; smaller ones stay well under the context and timeout limits.
+LLM_CHUNK_TOKENS = int(os.getenv("BUDGET_LLM_CHUNK_TOKENS", 6000))
+# Chunks of one analysis sent at once; the client's token bucket still paces them
+LLM_CONCURRENCY = int(os.getenv("BUDGET_LLM_CONCURRENCY", 3))
+CHARS_PER_TOKEN = 4
+
+# Structured output: Gemini answers this JSON and nothing else
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "transactions": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "ticket": {"type": "INTEGER"},
+                    "enseigne": {"type": "STRING"},
+                    "date": {"type": "STRING"},
+                    "montant": {"type": "NUMBER"},
+                    "type": {"type": "STRING", "enum": ["depense", "revenu"]},
+                    "categorie": {"type": "STRING"},
+                },
+                "required": ["enseigne", "date", "montant", "type", "categorie"],
+            },
+        },
+    },
+    "required": ["transactions"],
+}
+
+_easyocr_reader = None
+_easyocr_lock = threading.Lock()
+_easyocr_slots = threading.BoundedSemaphore(EASYOCR_WORKERS)
+_warmup_thread = None
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+
+class TransientAnalysisError(RuntimeError):
+    """An analysis failure worth retrying later (quota, network, server error)."""
+
+
+class NoTransactionsError(ValueError):
+    """Gemini read the text but found no transaction in it."""
+
 
 def _get_categories_for_prompt(user_id: int):
-    from database import get_all_categories
-    cats = get_all_categories(user_id)
-    cat_names = [c["nom"] for c in cats]
-    hints = []
-    for c in cats:
-        kw = c.get("mots_cles", "").strip()
-        if kw:
-            hints.append(f"  * {kw} → {c['nom']}")
-    return cat_names, hints
+    from categorizer import get_category_matcher
+    matcher = get_category_matcher(user_id)
+    return matcher.names, matcher.hints
 
 
 def _build_prompt(ocr_text: str, today_str: str, user_id: int) -> str:
@@ -54,18 +105,19 @@ RÈGLES :
 - Utilise les indices ET le contexte du nom.
 - Revenu (salaire, virement entrant) → type "revenu". Sinon → "depense".
 - EXCLURE 0.00€ et remboursements internes.
+- "ticket" = numéro N du bloc « --- Ticket N --- » d'où vient la transaction.
 
 JSON uniquement :
 {{
   "transactions": [
-    {{"enseigne": "Nom", "date": "YYYY-MM-DD", "montant": 0.00, "type": "depense ou revenu", "categorie": "exacte"}}
+    {{"ticket": 1, "enseigne": "Nom", "date": "YYYY-MM-DD", "montant": 0.00, "type": "depense ou revenu", "categorie": "exacte"}}
   ]
 }}
 
 Si date absente → {today_str}. Montant = décimal positif."""
 
 
-def configure_gemini():
+def _gemini_api_key() -> str:
     import streamlit as st
     api_key = None
     # 1) Streamlit Cloud secrets
@@ -78,37 +130,91 @@ def configure_gemini():
         api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("🔑 Clé API manquante. Ajoutez `GEMINI_API_KEY` dans Streamlit secrets ou `.env`")
-    genai.configure(api_key=api_key)
+    return api_key
 
 
-def ocr_extract_text(image_bytes: bytes) -> str:
+def get_easyocr_reader():
+    """Process-wide EasyOCR reader. Loading its models takes seconds, so it happens once."""
+    global _easyocr_reader
+    if _easyocr_reader is None:
+        with _easyocr_lock:
+            if _easyocr_reader is None:
+                import easyocr
+                _easyocr_reader = easyocr.Reader(["fr", "en"], gpu=False, verbose=False)
+    return _easyocr_reader
+
+
+def _tesseract_available() -> bool:
     try:
-        image = Image.open(io.BytesIO(image_bytes))
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
     except Exception:
-        raise ValueError("🖼️ Image illisible.")
+        return False
 
-    # 1) Try Tesseract (fast, local)
+
+def warm_up_ocr(background: bool = True):
+    """Load the EasyOCR reader ahead of the first receipt (see OCR_WARMUP). Safe to call on every rerun."""
+    global _warmup_thread
+    if _easyocr_reader is not None or _warmup_thread is not None:
+        return
+    if OCR_WARMUP == "0" or (OCR_WARMUP == "auto" and _tesseract_available()):
+        return
+
+    def load():
+        try:
+            get_easyocr_reader()
+        except Exception:
+            pass  # missing easyocr or models: the OCR call reports it
+
+    with _easyocr_lock:
+        if _warmup_thread is not None:
+            return
+        _warmup_thread = threading.Thread(target=load, name="easyocr-warmup", daemon=True)
+    if background:
+        _warmup_thread.start()
+    else:
+        _warmup_thread.run()
+
+
+def _easyocr_text(image) -> str:
+    import numpy as np
+    reader = get_easyocr_reader()
+    with _easyocr_slots:
+        results = reader.readtext(np.array(image), detail=0)
+    return "\n".join(results).strip()
+
+
+def _tesseract_text(image) -> str:
+    """Tesseract OCR, "" when it finds nothing or is not installed."""
     try:
         import pytesseract
         text = pytesseract.image_to_string(image, lang="fra+eng")
         if text.strip():
             return text.strip()
-        text = pytesseract.image_to_string(image, lang="eng")
-        if text.strip():
-            return text.strip()
+        return pytesseract.image_to_string(image, lang="eng").strip()
     except Exception:
-        pass
+        return ""
+
+
+def ocr_extract_text(image_bytes: bytes) -> str:
+    from preprocess import preprocess_image
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image = preprocess_image(image)
+    except Exception:
+        raise ValueError("🖼️ Image illisible.")
+
+    # 1) Try Tesseract (fast, local)
+    text = _tesseract_text(image)
+    if text:
+        return text
 
     # 2) Fallback: EasyOCR (pure Python, works on Streamlit Cloud)
     try:
-        import easyocr
-        import numpy as np
-        reader = easyocr.Reader(["fr", "en"], gpu=False, verbose=False)
-        img_array = np.array(image)
-        results = reader.readtext(img_array, detail=0)
-        text = "\n".join(results)
-        if text.strip():
-            return text.strip()
+        text = _easyocr_text(image)
+        if text:
+            return text
     except ImportError:
         raise RuntimeError("📦 Aucun OCR disponible. Installez `pytesseract` ou `easyocr`.")
     except Exception as e:
@@ -117,60 +223,279 @@ def ocr_extract_text(image_bytes: bytes) -> str:
     raise ValueError("🖼️ Aucun texte détecté dans l'image.")
 
 
-def ocr_extract_multiple(images: list[tuple[bytes, str]]) -> str:
-    all_texts = []
-    for i, (img_bytes, _) in enumerate(images, 1):
-        text = ocr_extract_text(img_bytes)
-        if text:
-            all_texts.append(f"--- Ticket {i} ---\n{text}")
-    if not all_texts:
-        raise ValueError("🖼️ Aucun texte extrait. Vérifiez la qualité des photos.")
-    return "\n\n".join(all_texts)
-
+def _get_ocr_pool() -> ThreadPoolExecutor:
+    global _ocr_pool
+    if _ocr_pool is None:
+        with _ocr_pool_lock:
+            if _ocr_pool is None:
+                _ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+    return _ocr_pool
 
-def analyze_receipts(images: list[tuple[bytes, str]], user_id: int) -> list[dict]:
-    configure_gemini()
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    today_str = date.today().strftime("%Y-%m-%d")
 
-    combined_text = ocr_extract_multiple(images)
-    if len(combined_text) < 10:
-        raise ValueError("📄 Texte trop court.")
+def _cached_ocr_text(image_bytes: bytes) -> str:
+    """ocr_extract_text through the analysis cache: the same photo is only OCR'd once."""
+    from database import get_cached_analysis, store_cached_analysis
+    from preprocess import preprocess_signature
+    # Pre-processing settings change the text, so they are part of the key
+    key = "ocr:" + hashlib.sha256(image_bytes + preprocess_signature().encode()).hexdigest()
+    text = get_cached_analysis(key)
+    if text is None:
+        text = ocr_extract_text(image_bytes)
+        store_cached_analysis(key, "ocr", text)
+    return text
 
-    prompt = _build_prompt(combined_text, today_str, user_id)
 
+def _ocr_or_error(image_bytes: bytes) -> tuple[str, str]:
     try:
-        response = model.generate_content(prompt)
+        return _cached_ocr_text(image_bytes), ""
     except Exception as e:
-        err = str(e)
-        if "429" in err:
-            raise RuntimeError("⏳ Quota Gemini atteint. Réessayez dans quelques minutes.")
-        if "403" in err:
-            raise RuntimeError("🔒 Accès refusé. Vérifiez votre clé API.")
-        if "404" in err:
-            raise RuntimeError("❌ Modèle introuvable.")
-        raise RuntimeError(f"❌ Erreur API : {err[:200]}")
+        return "", str(e)
 
-    return parse_response(response.text, today_str, user_id)
 
+def ocr_extract_tickets(images: list[tuple[bytes, str]], failures: list = None) -> list[tuple[int, str]]:
+    """OCR every image concurrently; returns (ticket number, text) in upload order, numbered from 1.
 
-def parse_response(text: str, default_date: str, user_id: int) -> list[dict]:
-    from database import get_category_names
-    valid_cats = get_category_names(user_id)
+    An image that fails is skipped; its (ticket number, message) goes to `failures` if given.
+    Raises only when no image yields text.
+    """
+    if len(images) == 1:
+        results = [_ocr_or_error(images[0][0])]
+    else:
+        results = list(_get_ocr_pool().map(_ocr_or_error, [img for img, _ in images]))
+
+    tickets, errors = [], []
+    for i, (text, error) in enumerate(results, 1):
+        if text:
+            tickets.append((i, text))
+        else:
+            errors.append((i, error or "🖼️ Aucun texte détecté dans l'image."))
+    if failures is not None:
+        failures.extend(errors)
+    if not tickets:
+        if len(images) > 1:
+            raise ValueError("🖼️ Aucun texte extrait. Vérifiez la qualité des photos.\n"
+                             + "\n".join(f"Ticket {i} : {msg}" for i, msg in errors))
+        raise ValueError(errors[0][1] if errors else "🖼️ Aucun texte extrait. Vérifiez la qualité des photos.")
+    return tickets
+
+
+def ocr_extract_multiple(images: list[tuple[bytes, str]], failures: list = None) -> str:
+    """OCR every image and join the texts as '--- Ticket i ---' blocks, in upload order."""
+    return "\n\n".join(f"--- Ticket {i} ---\n{text}" for i, text in ocr_extract_tickets(images, failures))
+
+
+def pack_tickets(tickets: list[tuple[int, str]], max_tokens: int = None) -> list[tuple[list[int], str]]:
+    """Pack '--- Ticket i ---' blocks, in order, into chunks of at most `max_tokens` OCR tokens.
+
+    Returns (ticket numbers, text) per chunk. A ticket too long for one chunk is cut on
+    line boundaries into parts that each get a chunk of their own; a single line longer
+    than a chunk is itself cut into chunk-sized pieces, so no text is dropped.
+    """
+    budget = max(1, max_tokens or LLM_CHUNK_TOKENS) * CHARS_PER_TOKEN
+    blocks = []
+    for i, text in tickets:
+        parts, part, size = [], [], 0
+        pieces = (line[j:j + budget] for line in text.splitlines() for j in range(0, len(line) or 1, budget))
+        for piece in pieces:
+            if part and size + len(piece) + 1 > budget:
+                parts.append("\n".join(part))
+                part, size = [], 0
+            part.append(piece)
+            size += len(piece) + 1
+        parts.append("\n".join(part))
+        for k, body in enumerate(parts, 1):
+            header = f"--- Ticket {i} ---" if len(parts) == 1 else f"--- Ticket {i} (partie {k}/{len(parts)}) ---"
+            blocks.append((i, f"{header}\n{body}"))
+
+    chunks, numbers, texts, size = [], [], [], 0
+    for i, block in blocks:
+        if texts and size + len(block) > budget:
+            chunks.append((numbers, "\n\n".join(texts)))
+            numbers, texts, size = [], [], 0
+        if i not in numbers:
+            numbers.append(i)
+        texts.append(block)
+        size += len(block) + 2
+    if texts:
+        chunks.append((numbers, "\n\n".join(texts)))
+    return chunks
+
+
+def _analysis_key(model_name: str, ocr_text: str, user_id: int) -> str:
+    """Cache key for a Gemini answer: same OCR text, same category set → same answer."""
+    cat_names, cat_hints = _get_categories_for_prompt(user_id)
+    payload = "\x00".join([model_name, ocr_text, "\n".join(cat_names), "\n".join(cat_hints)])
+    return "llm:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _api_error(e) -> Exception:
+    """Map a GeminiError the client gave up on to the error shown to the user."""
+    if e.status == 429:
+        return TransientAnalysisError("⏳ Quota Gemini atteint. Réessayez dans quelques minutes.")
+    if e.status in (401, 403):
+        return RuntimeError("🔒 Accès refusé. Vérifiez votre clé API.")
+    if e.status == 404:
+        return RuntimeError("❌ Modèle introuvable.")
+    if e.transient:
+        return TransientAnalysisError(f"❌ Erreur API : {str(e)[:200]}")
+    return RuntimeError(f"❌ Erreur API : {str(e)[:200]}")
+
+
+def _analyze_chunk(chunk_text: str, today_str: str, user_id: int) -> list[dict]:
+    from database import get_cached_analysis, store_cached_analysis
+    from gemini_client import GEMINI_MODELS, GeminiError, get_client
+
+    # The raw answer is cached and parsed again, so missing dates still default to today.
+    # Keyed per chunk: a retried job only pays again for the chunks that failed.
+    cache_key = _analysis_key(",".join(GEMINI_MODELS), chunk_text, user_id)
+    cached = get_cached_analysis(cache_key)
+    if cached is not None:
+        return parse_response(cached, today_str, user_id)
+
+    # The client already retried with backoff and went through the fallback models
+    try:
+        text, _model = get_client(_gemini_api_key()).generate(
+            _build_prompt(chunk_text, today_str, user_id), schema=RESPONSE_SCHEMA)
+    except GeminiError as e:
+        raise _api_error(e)
 
-    cleaned = text.strip()
-    cleaned = re.sub(r"^```json\s*", "", cleaned)
-    cleaned = re.sub(r"\s*```$", "", cleaned)
+    transactions = parse_response(text, today_str, user_id)
+    store_cached_analysis(cache_key, "llm", text)
+    return transactions
 
+
+def merge_chunk_results(results: list[list[dict]]) -> list[dict]:
+    """Concatenate the transactions of every chunk, dropping those another chunk already gave.
+
+    A ticket cut in parts is seen by several chunks, which may each report its total.
+    Identical lines within one chunk are kept: a receipt can list the same item twice.
+    """
+    from categorizer import normalize
+    seen = Counter()
+    merged = []
+    for transactions in results:
+        counts = Counter()
+        for t in transactions:
+            key = (t.get("ticket"), t["date"], normalize(t["enseigne"]), round(t["montant"], 2), t["type"])
+            counts[key] += 1
+            if counts[key] > seen[key]:
+                merged.append({k: v for k, v in t.items() if k != "ticket"})
+        seen |= counts
+    return merged
+
+
+def _local_transactions(tickets: list[tuple[int, str]], today_str: str,
+                        user_id: int) -> tuple[list[dict], list[tuple[int, str]]]:
+    """Split tickets into transactions read offline and tickets left for Gemini."""
+    from categorizer import get_category_matcher
+    from receipt_parser import LOCAL_PARSER, local_transaction
+    if not LOCAL_PARSER:
+        return [], tickets
+    matcher = get_category_matcher(user_id)
+    local, remaining = [], []
+    for i, text in tickets:
+        transaction = local_transaction(text, today_str, matcher)
+        if transaction is None:
+            remaining.append((i, text))
+        else:
+            local.append({**transaction, "ticket": i})
+    return local, remaining
+
+
+def analyze_receipts(images: list[tuple[bytes, str]], user_id: int, failures: list = None) -> list[dict]:
+    """OCR `images`, then extract their transactions, with Gemini only where needed.
+
+    Plain till receipts are read offline by receipt_parser. The others are packed
+    into chunks of up to LLM_CHUNK_TOKENS and sent concurrently. A chunk where Gemini
+    finds nothing adds its tickets to `failures`; any other error (quota, network, key,
+    unreadable answer) fails the whole analysis (chunks already answered stay cached for
+    the retry).
+    """
+    today_str = date.today().strftime("%Y-%m-%d")
+
+    tickets = ocr_extract_tickets(images, failures)
+    if sum(len(text) for _, text in tickets) < 10:
+        raise ValueError("📄 Texte trop court.")
+
+    local, tickets = _local_transactions(tickets, today_str, user_id)
+    if not tickets:
+        return merge_chunk_results([local])
+
+    chunks = pack_tickets(tickets)
+    if len(chunks) == 1:
+        outcomes = [_chunk_outcome(chunks[0][1], today_str, user_id)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, len(chunks)),
+                                thread_name_prefix="llm-chunk") as pool:
+            outcomes = list(pool.map(lambda c: _chunk_outcome(c[1], today_str, user_id), chunks))
+
+    results, empty = [local] if local else [], []
+    for (numbers, _text), (transactions, error) in zip(chunks, outcomes):
+        if isinstance(error, NoTransactionsError):
+            empty.extend((i, str(error)) for i in numbers)
+        elif error is not None:
+            raise error
+        else:
+            results.append(transactions)
+    if not results:
+        raise NoTransactionsError(empty[0][1] if len(chunks) == 1 else "📄 Aucune transaction détectée.")
+    if failures is not None:
+        failures.extend(empty)
+    return merge_chunk_results(results)
+
+
+def _chunk_outcome(chunk_text: str, today_str: str, user_id: int) -> tuple[list[dict], Exception]:
     try:
-        data = json.loads(cleaned)
-    except json.JSONDecodeError:
-        raise ValueError("🤖 Réponse IA invalide. Réessayez.")
-    if "transactions" not in data:
-        raise ValueError("🤖 Format inattendu. Réessayez.")
+        return _analyze_chunk(chunk_text, today_str, user_id), None
+    except Exception as e:
+        return None, e
+
+
+_DECODER = json.JSONDecoder()
+_SEPARATORS = re.compile(r"[\s,]*")
+_TRANSACTIONS_ARRAY = re.compile(r'"transactions"\s*:\s*\[')
+
+
+def iter_response_items(text: str):
+    """Yield the transaction objects of a Gemini answer one by one, as they are decoded.
+
+    Whatever surrounds the JSON (code fences, a sentence) is skipped. A truncated answer
+    still yields every item that was complete before the cut.
+    """
+    m = _TRANSACTIONS_ARRAY.search(text)
+    if m:
+        pos = m.end()
+    else:
+        start = re.search(r"[\[{]", text)
+        if start is None:
+            raise ValueError("🤖 Réponse IA invalide. Réessayez.")
+        if start.group() == "{":
+            raise ValueError("🤖 Format inattendu. Réessayez.")
+        pos = start.end()  # a bare list of transactions
+
+    decoded = 0
+    while True:
+        pos = _SEPARATORS.match(text, pos).end()
+        if pos >= len(text) or text[pos] == "]":
+            return
+        try:
+            item, pos = _DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            if not decoded:
+                raise ValueError("🤖 Réponse IA invalide. Réessayez.")
+            return
+        decoded += 1
+        if isinstance(item, dict):
+            yield item
+
+
+def parse_response(text: str, default_date: str, user_id: int) -> list[dict]:
+    from categorizer import get_category_matcher
+    matcher = get_category_matcher(user_id)
+    valid_cats = matcher.names
 
     transactions = []
-    for item in data["transactions"]:
+    for item in iter_response_items(text):
         montant = 0.0
         try:
             montant = float(item.get("montant", 0))
@@ -178,23 +503,32 @@ def parse_response(text: str, default_date: str, user_id: int) -> list[dict]:
             pass
         if montant <= 0:
             continue
-        cat = item.get("categorie", valid_cats[0] if valid_cats else "Autre")
+        enseigne = item.get("enseigne", "Inconnu")
+        # The user's own keywords win; Gemini's pick only covers unmatched lines
+        cat = matcher.match(enseigne) or item.get("categorie", valid_cats[0] if valid_cats else "Autre")
         if cat not in valid_cats:
-            cat = _find_closest_category(cat, valid_cats)
+            cat = _find_closest_category(cat, valid_cats, matcher)
         txn_type = item.get("type", "depense")
         if txn_type not in ("depense", "revenu"):
             txn_type = "depense"
+        ticket = item.get("ticket")
         transactions.append({
-            "enseigne": item.get("enseigne", "Inconnu"),
+            "enseigne": enseigne,
             "date": item.get("date", default_date) or default_date,
             "montant": montant, "categorie": cat, "type": txn_type,
+            "ticket": ticket if isinstance(ticket, int) else None,
         })
     if not transactions:
-        raise ValueError("📄 Aucune transaction détectée.")
+        raise NoTransactionsError("📄 Aucune transaction détectée.")
     return transactions
 
 
-def _find_closest_category(category: str, valid_cats: list[str]) -> str:
+def _find_closest_category(category: str, valid_cats: list[str], matcher=None) -> str:
+    if matcher is not None:
+        # e.g. Gemini answered "Restaurant", which is a keyword of "Loisirs & Sorties"
+        cat = matcher.match(category)
+        if cat:
+            return cat
     cl = category.lower()
     for cat in valid_cats:
         if cat.lower() in cl or cl in cat.lower():
@@ -1,11 +1,17 @@
 import streamlit as st
 from database import init_db
+from analyzer import warm_up_ocr
+from jobs import start_job_runner
+from scheduler import start_recurring_scheduler
 from auth import show_auth_page
 from styles import inject_css
 
 st.set_page_config(page_title="Budget Tracker", page_icon="🧾", layout="wide", initial_sidebar_state="collapsed")
 
 init_db()
+warm_up_ocr()
+start_job_runner()
+start_recurring_scheduler()
 inject_css()
 
 if not show_auth_page():
@@ -0,0 +1,64 @@
+"""Outils partagés par les benchmarks : base temporaire et données synthétiques."""
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+ENSEIGNES = ["Carrefour", "Lidl", "Monoprix", "SNCF", "Uber", "Pharmacie", "Fnac", "Amazon",
+             "Boulangerie", "Netflix", "EDF", "Free", "Zara", "Cinéma", "Kebab", "Salaire"]
+
+
+def use_temp_db() -> Path:
+    """Point database.DB_PATH at a fresh temporary file and create the schema."""
+    path = Path(tempfile.mkdtemp(prefix="budget_bench_")) / "budget.db"
+    database.DB_PATH = path
+    database.init_db()
+    return path
+
+
+def create_user(name: str = "bench") -> int:
+    uid = database.create_user(name, "x:y", name.capitalize())
+    database.seed_default_categories(uid)
+    return uid
+
+
+def seed_transactions(user_id: int, n: int, years: int = 3, seed: int = 42):
+    """Insert n random transactions spread over the last `years` years."""
+    rng = random.Random(seed)
+    cats = database.get_category_names(user_id)
+    start = date.today() - timedelta(days=365 * years)
+    now = datetime.now().isoformat()
+    rows = []
+    for _ in range(n):
+        d = start + timedelta(days=rng.randrange(365 * years))
+        ens = rng.choice(ENSEIGNES)
+        typ = "revenu" if ens == "Salaire" else "depense"
+        rows.append((user_id, d.isoformat(), ens, round(rng.uniform(1, 150), 2),
+                     rng.choice(cats), "", '[{"nom": "article", "prix": 1.0}]', typ, now))
+    with database.connection() as conn:
+        conn.executemany(
+            "INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, created_at) "
+            "VALUES (?,?,?,?,?,?,?,?,?)", rows)
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = min(int(round(p / 100 * (len(s) - 1))), len(s) - 1)
+    return s[k]
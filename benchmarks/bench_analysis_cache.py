@@ -0,0 +1,39 @@
+"""Cache d'analyse : premier scan de receipts/ contre scan répété (OCR, et Gemini si GEMINI_API_KEY est défini)."""
+import os
+from pathlib import Path
+
+from _common import Timer, create_user, use_temp_db
+
+import analyzer
+import database
+
+RECEIPTS = Path(__file__).resolve().parent.parent / "receipts"
+
+
+def scan(label: str, fn):
+    before = database.get_analysis_cache_stats()
+    with Timer() as t:
+        fn()
+    after = database.get_analysis_cache_stats()
+    print(f"  {label:<24} {t.elapsed * 1000:10.1f} ms   "
+          f"hits +{after['hits'] - before['hits']}, misses +{after['misses'] - before['misses']}")
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    uid = create_user()
+    files = sorted(RECEIPTS.glob("*.png")) + sorted(RECEIPTS.glob("*.jpg"))
+    images = [(p.read_bytes(), "image/png") for p in files]
+    print(f"{len(images)} ticket(s), dont {len(images) - len({img for img, _ in images})} doublon(s) d'octets\n")
+
+    scan("OCR, premier scan", lambda: analyzer.ocr_extract_multiple(images))
+    scan("OCR, scan répété", lambda: analyzer.ocr_extract_multiple(images))
+    if os.getenv("GEMINI_API_KEY"):
+        database.clear_analysis_cache("llm")
+        scan("OCR + Gemini, premier", lambda: analyzer.analyze_receipts(images, uid))
+        scan("OCR + Gemini, répété", lambda: analyzer.analyze_receipts(images, uid))
+    else:
+        print("  (GEMINI_API_KEY absent : étape Gemini ignorée)")
+
+    stats = database.get_analysis_cache_stats()
+    print(f"\nCache : {stats['entries']} entrée(s), {stats['bytes'] / 1024:.1f} Ko / {stats['max_bytes'] / 1e6:.0f} Mo")
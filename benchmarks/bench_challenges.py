@@ -0,0 +1,69 @@
+"""Classements des challenges : 50 challenges × 20 participants, boucle N+1 d'origine contre requête groupée."""
+import random
+from datetime import date, timedelta
+
+from _common import Timer, create_user, seed_transactions, use_temp_db
+
+import database
+
+CHALLENGES = 50
+PARTICIPANTS = 20
+TXNS_PER_USER = 1000
+REPEAT = 5
+
+
+def legacy_scores(conn, challenge_id: int) -> list[dict]:
+    """The former get_challenge_scores: participants, then one SUM per participant."""
+    ch = dict(conn.execute("SELECT * FROM challenges WHERE id = ?", (challenge_id,)).fetchone())
+    scores = []
+    for p in database.get_challenge_participants(challenge_id):
+        cat_filter = "AND categorie = ?" if ch["categorie"] else ""
+        params = [p["id"], ch["date_debut"], ch["date_fin"]] + ([ch["categorie"]] if ch["categorie"] else [])
+        total = conn.execute(
+            f"SELECT COALESCE(SUM(montant_total), 0) as s FROM transactions WHERE user_id=? AND date>=? AND date<=? "
+            f"AND type='depense' {cat_filter}", params).fetchone()["s"]
+        scores.append({**p, "total": total, "max": ch["montant_max"]})
+    scores.sort(key=lambda x: x["total"])
+    return scores
+
+
+def measure(label: str, fn) -> dict:
+    statements = []
+    with database.connection() as conn:
+        conn.set_trace_callback(statements.append)
+        with Timer() as t:
+            for _ in range(REPEAT):
+                result = fn(conn)
+        conn.set_trace_callback(None)
+    print(f"  {label:<44} {t.elapsed / REPEAT * 1000:8.1f} ms   {len(statements) // REPEAT:5d} requête(s) SQL")
+    return result
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    rng = random.Random(7)
+    users = [create_user(f"joueur{i}") for i in range(PARTICIPANTS)]
+    for i, uid in enumerate(users):
+        seed_transactions(uid, TXNS_PER_USER, years=1, seed=i)
+    me = users[0]
+    cats = database.get_category_names(me) + [None]
+    for i in range(CHALLENGES):
+        start = date.today() - timedelta(days=rng.randrange(300))
+        cid = database.create_challenge(me, f"Défi {i}", rng.choice(cats), rng.choice([100, 200, 500]),
+                                        start.isoformat(), (start + timedelta(days=rng.choice([7, 30, 90]))).isoformat())
+        for uid in users[1:]:
+            database.join_challenge(cid, uid)
+    challenges = database.get_active_challenges(me)
+    print(f"{len(challenges)} challenges × {PARTICIPANTS} participants, {TXNS_PER_USER} transactions par joueur\n")
+
+    before = measure("avant : une somme par participant (N+1)",
+                     lambda conn: {ch["id"]: legacy_scores(conn, ch["id"]) for ch in challenges})
+    per_challenge = measure("get_challenge_scores, un appel par challenge",
+                            lambda conn: {ch["id"]: database.get_challenge_scores(ch["id"]) for ch in challenges})
+    boards = measure("get_challenge_leaderboards (une requête)",
+                     lambda conn: database.get_challenge_leaderboards(me))
+
+    def totals(result):
+        return {cid: sorted((s["id"], round(s["total"], 2)) for s in scores) for cid, scores in result.items()}
+    same = totals(before) == totals(per_challenge) == totals(boards)
+    print(f"\nmêmes totaux dans les trois cas : {'oui' if same else 'NON'}")
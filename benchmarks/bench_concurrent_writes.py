@@ -0,0 +1,68 @@
+"""Stress test multi-processus : débit d'écriture et attente de verrou par profil de stockage.
+
+Chaque processus joue une session Streamlit qui enchaîne ajouts (Ajouter),
+application des récurrents (Dashboard) et suppressions groupées (Tableau).
+"""
+import multiprocessing as mp
+import sqlite3
+import sys
+import time
+from datetime import date
+
+from _common import percentile, use_temp_db
+
+import database
+
+PROCESSES = 8
+WRITES_PER_PROCESS = 150
+
+
+def _session(args):
+    db_path, profile, uid, worker = args
+    database.DB_PATH = db_path
+    database._storage = dict(database.STORAGE_PROFILES[profile])
+    today = date.today()
+    waits, errors = [], 0
+    inserted = []
+    for i in range(WRITES_PER_PROCESS):
+        start = time.perf_counter()
+        try:
+            if i % 10 == 9:
+                database.apply_recurring_for_month(uid, today.year, today.month)
+            elif i % 10 == 4 and inserted:
+                database.delete_transactions(inserted[:5])
+                del inserted[:5]
+            else:
+                inserted.append(database.insert_transaction(
+                    uid, today.isoformat(), f"Stress {worker}", 1.0 + i, "Alimentaire", "", []))
+        except sqlite3.OperationalError:
+            errors += 1
+        waits.append(time.perf_counter() - start)
+    return waits, errors
+
+
+def run(profile: str) -> None:
+    db_path = use_temp_db()
+    database.init_db(profile)
+    uid = database.create_user(f"stress_{profile}", "x:y", "Stress")
+    database.insert_recurring(uid, "Netflix", 13.49, "Loisirs & Sorties", "depense", "hebdomadaire", 0)
+    database.close_pool()
+
+    start = time.perf_counter()
+    with mp.Pool(PROCESSES) as pool:
+        results = pool.map(_session, [(db_path, profile, uid, w) for w in range(PROCESSES)])
+    elapsed = time.perf_counter() - start
+
+    waits = [w * 1000 for r in results for w in r[0]]
+    errors = sum(r[1] for r in results)
+    total = PROCESSES * WRITES_PER_PROCESS
+    print(f"  {profile:<7} {total / elapsed:8.0f} écritures/s   "
+          f"p50 {percentile(waits, 50):6.2f} ms   p95 {percentile(waits, 95):7.2f} ms   "
+          f"p99 {percentile(waits, 99):7.2f} ms   erreurs 'locked' {errors}")
+
+
+if __name__ == "__main__":
+    profiles = sys.argv[1:] or ["legacy", "wal"]
+    print(f"{PROCESSES} processus × {WRITES_PER_PROCESS} écritures")
+    for p in profiles:
+        run(p)
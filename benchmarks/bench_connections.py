@@ -0,0 +1,71 @@
+"""Connexions SQLite ouvertes et temps par rendu du Dashboard : sans pool, avec pool, avec pool + cache."""
+import sqlite3
+import threading
+from datetime import date
+
+from _common import Timer, create_user, seed_transactions, use_temp_db
+
+import database
+
+RERUNS = 50
+
+opened = 0
+_connect = sqlite3.connect
+
+
+def _counting_connect(*args, **kwargs):
+    global opened
+    opened += 1
+    return _connect(*args, **kwargs)
+
+
+def render_dashboard(uid: int):
+    """Same database calls as one rerun of pages/1_📊_Dashboard.py."""
+    today = date.today()
+    database.get_user_by_id(uid)
+    database.ensure_user_has_categories(uid)
+    database.get_user_by_id(uid)
+    database.get_friends(uid)
+    database.get_category_map(uid)
+    database.get_category_names(uid)
+    database.get_all_transactions(uid)
+    database.apply_recurring_for_month(uid, today.year, today.month)
+    database.get_transactions_by_month(uid, today.year, today.month)
+    database.get_smart_budget_info(uid, today.year, today.month)
+    database.export_transactions_csv(uid, today.year, today.month)
+    database.get_budgets(uid)
+    database.get_monthly_totals(uid)
+
+
+def run(pool_size: int, cache_ttl: float, uid: int) -> tuple[int, float]:
+    global opened
+    database.POOL_SIZE = pool_size
+    database.CACHE_TTL = cache_ttl
+    database.close_pool()
+    database.invalidate_cache()
+    opened = 0
+    with Timer() as t:
+        for _ in range(RERUNS):
+            # Streamlit runs every rerun on a fresh script thread
+            th = threading.Thread(target=render_dashboard, args=(uid,))
+            th.start()
+            th.join()
+    return opened, t.elapsed
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    uid = create_user()
+    seed_transactions(uid, 2_000)
+    sqlite3.connect = _counting_connect
+
+    print(f"{RERUNS} rendus du Dashboard")
+    runs = (("avant (sans pool)", 0, 0), ("pool", database.POOL_SIZE, 0),
+            ("pool + cache", database.POOL_SIZE, database.CACHE_TTL))
+    for label, size, ttl in runs:
+        before = database.get_cache_stats()
+        n, elapsed = run(size, ttl, uid)
+        after = database.get_cache_stats()
+        hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+        print(f"  {label:<18} {n:4d} connexions ({n / RERUNS:5.2f}/rendu)   {elapsed / RERUNS * 1000:7.2f} ms/rendu"
+              + (f"   cache {hits} hits / {misses} misses" if ttl else ""))
@@ -0,0 +1,56 @@
+"""Export CSV : concaténation en mémoire (avant) contre flux par blocs, sur 1M lignes."""
+import json
+import os
+import sys
+import tracemalloc
+
+from _common import Timer, create_user, seed_transactions, use_temp_db
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+
+def old_export(user_id: int) -> str:
+    """Export as it was before: every row as a dict with articles decoded, one big string."""
+    with database.connection() as conn:
+        txs = []
+        for r in conn.execute("SELECT * FROM transactions WHERE user_id = ? ORDER BY date DESC", (user_id,)):
+            d = dict(r)
+            d["articles"] = json.loads(d["articles"]) if d["articles"] else []
+            txs.append(d)
+    lines = ["Date,Enseigne,Montant,Catégorie,Sous-catégorie,Type,Tags"]
+    for t in txs:
+        ens = t["enseigne"].replace(",", ";")
+        lines.append(f'{t["date"]},{ens},{t["montant_total"]:.2f},{t["categorie"]},'
+                     f'{t.get("sous_categorie", "")},{t.get("type", "depense")},{t.get("tags", "")}')
+    return "\n".join(lines)
+
+
+def to_file(user_id: int, path: str) -> int:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.writelines(database.iter_transactions_csv(user_id))
+    return os.path.getsize(path)
+
+
+def measure(label: str, fn):
+    tracemalloc.start()
+    with Timer() as t:
+        fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  {label:<28} {t.elapsed:6.2f} s   pic mémoire {peak / 1e6:8.1f} Mo")
+
+
+if __name__ == "__main__":
+    db_path = use_temp_db()
+    uid = create_user()
+    with Timer() as t:
+        seed_transactions(uid, ROWS, years=10)
+    print(f"{ROWS:,} lignes (insertion {t.elapsed:.1f}s)\n")
+
+    out = str(db_path.with_suffix(".csv"))
+    measure("concaténation (avant)", lambda: old_export(uid))
+    measure("flux -> chaîne", lambda: database.export_transactions_csv(uid))
+    measure("flux -> fichier", lambda: to_file(uid, out))
+    print(f"\nFichier : {os.path.getsize(out) / 1e6:.1f} Mo")
@@ -0,0 +1,48 @@
+"""Client Gemini contre le faux serveur : reprises sur 429, bascule de modèle, seau à jetons et métriques."""
+import time
+from email.utils import formatdate
+
+from _common import Timer
+from gemini_stub import GeminiStub, error, ok
+
+import gemini_client
+from gemini_client import GeminiClient, GeminiError, TokenBucket
+
+MODELS = ["gemini-2.5-flash", "gemini-2.0-flash-lite"]
+
+
+def scenario(label: str, script: dict, calls: int = 1, rpm: float = 600, burst: int = 5, timeout: float = 60.0):
+    gemini_client.metrics.__init__()
+    with GeminiStub(script) as stub:
+        client = GeminiClient("stub-key", MODELS, base_url=stub.url, retries=3, timeout=timeout)
+        client.bucket = TokenBucket(rpm / 60, burst)
+        answered, failed = [], []
+        with Timer() as t:
+            for _ in range(calls):
+                try:
+                    answered.append(client.generate("Dis juste OK")[1])
+                except GeminiError as e:
+                    failed.append(e.status)
+    print(f"\n{label}  ({t.elapsed:.2f} s, {len(stub.requests)} requête(s) HTTP)")
+    print(f"  réponses : {answered or '-'}   échecs : {failed or '-'}")
+    for model, m in gemini_client.get_gemini_metrics().items():
+        p50 = f"{m['latency_p50'] * 1000:.0f} ms" if m["latency_p50"] is not None else "-"
+        print(f"  {model:<24} req {m['requests']:3d}  ok {m['ok']:3d}  429 {m['rate_limited']:3d} ({m['rate_429']:.0%})  "
+              f"bascules {m['fallbacks']}  p50 {p50}  jetons {m['prompt_tokens'] + m['output_tokens']}  "
+              f"attente seau {m['throttled_s']:.2f} s")
+
+
+if __name__ == "__main__":
+    gemini_client.GEMINI_RETRY_BASE_DELAY = 0.05
+    scenario("429 passager puis succès", {"gemini-2.5-flash": [error(429), error(429), ok()]})
+    scenario("Quota épuisé → modèle suivant", {"gemini-2.5-flash": [error(429)], "gemini-2.0-flash-lite": [ok()]})
+    scenario("Modèle inconnu (404) → modèle suivant", {"gemini-2.5-flash": [error(404)], "*": [ok()]})
+    scenario("Clé refusée (403) : échec immédiat", {"*": [error(403)]})
+    scenario("Retry-After respecté", {"gemini-2.5-flash": [error(503, retry_after=0.3), ok()]})
+    scenario("Retry-After en date HTTP", {"gemini-2.5-flash": [error(503, formatdate(time.time() + 1, usegmt=True)), ok()]})
+    scenario("Retry-After illisible → backoff", {"gemini-2.5-flash": [error(503, "bientôt"), ok()]})
+    scenario("Retry-After d'une heure plafonné au timeout (0.5 s)",
+             {"gemini-2.5-flash": [error(503, retry_after=3600), ok()]}, timeout=0.5)
+    scenario("Seau local vide : 429 local compté, puis modèle suivant", {"*": [ok()]}, calls=2, rpm=1, burst=1,
+             timeout=0.2)
+    scenario("Seau à jetons : 10 appels à 120/min, rafale 3", {"*": [ok(delay=0.01)]}, calls=10, rpm=120, burst=3)
@@ -0,0 +1,48 @@
+"""Import de relevé bancaire : débit (lignes/s) sur un CSV de 500k lignes, puis réimport (tout en doublon)."""
+import random
+import sys
+from datetime import date, timedelta
+
+from _common import ENSEIGNES, Timer, create_user, use_temp_db
+
+import importer
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+
+
+def write_statement(path, n: int, seed: int = 7):
+    """French bank style CSV: preamble, ';' separator, dd/mm/yyyy, decimal comma, debit/credit columns."""
+    rng = random.Random(seed)
+    day = date.today() - timedelta(days=n // 150)
+    with open(path, "w", encoding="cp1252", newline="") as f:
+        f.write("Compte courant;;;\nDate opération;Libellé;Débit;Crédit\n")
+        for i in range(n):
+            if i % 150 == 0:
+                day += timedelta(days=1)
+            ens = rng.choice(ENSEIGNES)
+            amount = f"{rng.uniform(1, 150):.2f}".replace(".", ",")
+            if ens == "Salaire":
+                f.write(f"{day:%d/%m/%Y};VIR {ens.upper()} {i};;{amount}\n")
+            else:
+                f.write(f"{day:%d/%m/%Y};CB {ens.upper()} {i % 97};-{amount};\n")
+
+
+def run(label: str, uid: int, path):
+    with open(path, "rb") as f, Timer() as t:
+        stats = importer.import_statement(uid, f)
+    print(f"  {label:<22} {t.elapsed:6.2f} s   {stats['parsed'] / t.elapsed:9,.0f} lignes/s   "
+          f"{stats['inserted']:,} importées, {stats['duplicates']:,} doublons, {stats['rejected']} rejetées")
+
+
+if __name__ == "__main__":
+    db_path = use_temp_db()
+    uid = create_user()
+    path = db_path.with_name("releve.csv")
+    write_statement(path, LINES)
+    print(f"Relevé de {LINES:,} lignes ({path.stat().st_size / 1e6:.1f} Mo)\n")
+
+    with open(path, "rb") as f, Timer() as t:
+        n = sum(1 for _ in importer.iter_statement(f))
+    print(f"  {'analyse seule':<22} {t.elapsed:6.2f} s   {n / t.elapsed:9,.0f} lignes/s")
+    run("import", uid, path)
+    run("réimport (doublons)", uid, path)
@@ -0,0 +1,31 @@
+"""Coût de init_db() par rerun Streamlit : bootstrap complet, contrôle de version, garde process."""
+from _common import Timer, use_temp_db
+
+import database
+
+RERUNS = 2_000
+
+
+def full_bootstrap():
+    """What every rerun paid before: all CREATE TABLE IF NOT EXISTS + PRAGMA table_info checks."""
+    with database.connection() as conn:
+        database._migrate_base_schema(conn)
+
+
+def version_check():
+    database._bootstrap_schema()
+
+
+def measure(fn) -> float:
+    with Timer() as t:
+        for _ in range(RERUNS):
+            fn()
+    return t.elapsed / RERUNS * 1_000_000
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    print(f"init_db() sur {RERUNS} reruns (µs/rerun)")
+    print(f"  bootstrap complet (avant)   {measure(full_bootstrap):8.1f}")
+    print(f"  contrôle user_version       {measure(version_check):8.1f}")
+    print(f"  init_db() déjà initialisé   {measure(database.init_db):8.1f}")
@@ -0,0 +1,51 @@
+"""Catégorisation par mots-clés : cas de non-régression (mots entiers) et débit du matcher compilé.
+
+Code de sortie 1 si un libellé de CASES n'obtient pas la catégorie attendue.
+"""
+import sys
+
+from _common import ENSEIGNES, Timer, create_user, use_temp_db
+
+from categorizer import get_category_matcher
+
+# Libellé → catégorie attendue avec les catégories par défaut (None : aucun mot-clé ne doit répondre)
+CASES = {
+    "CARREFOUR MARKET": "Alimentaire",
+    "CARREFOUR12 TOULOUSE": "Alimentaire",
+    "Boulangerie Paul": "Alimentaire",
+    "Bota Pub": "Loisirs & Sorties",
+    "Cher Burger": "Loisirs & Sorties",
+    "2 pizzas": "Loisirs & Sorties",
+    "SNCF Billet": "Transport",
+    "Ticket de bus": "Transport",
+    "Pharmacie des Carmes": "Santé",
+    "Free Mobile": "Logement & Factures",
+    "Cabaret Sauvage": None,
+    "Barclays": None,
+    "Clubhouse pharmacy": None,
+    "business class": None,
+    "Busy Bee": None,
+    "Freeport": None,
+    "Gazprom": None,
+    "GAZOLE": None,
+}
+LABELS = 200_000
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    matcher = get_category_matcher(create_user())
+
+    wrong = 0
+    for text, expected in CASES.items():
+        got = matcher.match(text)
+        wrong += got != expected
+        print(f"  {text:<24} {str(got):<20} {'ok' if got == expected else f'FAUX (attendu {expected})'}")
+    print(f"\n{len(CASES) - wrong}/{len(CASES)} cas corrects")
+
+    labels = [f"CB {ENSEIGNES[i % len(ENSEIGNES)]} {i % 97:02d}/01 TOULOUSE" for i in range(LABELS)]
+    with Timer() as t:
+        for label in labels:
+            matcher.match(label)
+    print(f"{LABELS / t.elapsed:,.0f} libellés/s".replace(",", " "))
+    sys.exit(1 if wrong else 0)
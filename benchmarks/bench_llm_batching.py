@@ -0,0 +1,59 @@
+"""Lots OCR → Gemini contre le faux serveur : un appel par ticket, un seul appel géant, lots bornés en jetons envoyés en parallèle."""
+import os
+
+from _common import ENSEIGNES, Timer, create_user, use_temp_db
+from gemini_stub import GeminiStub, ok
+
+import analyzer
+import database
+import gemini_client
+import receipt_parser
+
+TICKETS = 20
+LATENCY = 0.4          # secondes par requête simulée
+
+
+def ticket_text(i: int) -> str:
+    lines = [f"{ENSEIGNES[i % len(ENSEIGNES)].upper()}", "12 RUE DE LA PAIX 75002 PARIS", f"15/01/2026 12:{i:02d}"]
+    lines += [f"ARTICLE {k:02d}                 {k + 0.99:6.2f}" for k in range(1, 25)]
+    return "\n".join(lines + [f"TOTAL                      {i + 10.5:6.2f}", "CB SANS CONTACT", "MERCI DE VOTRE VISITE"])
+
+
+def answer(n: int) -> str:
+    items = ",".join(
+        f'{{"ticket": {i}, "enseigne": "{ENSEIGNES[i % len(ENSEIGNES)]}", "date": "2026-01-15", '
+        f'"montant": {i + 10.5}, "type": "depense", "categorie": "Alimentaire"}}' for i in range(1, n + 1))
+    return f'{{"transactions": [{items}]}}'
+
+
+def run(label: str, uid: int, chunk_tokens: int, concurrency: int):
+    analyzer.LLM_CHUNK_TOKENS = chunk_tokens
+    analyzer.LLM_CONCURRENCY = concurrency
+    database.clear_analysis_cache("llm")
+    chunks = analyzer.pack_tickets(analyzer.ocr_extract_tickets([]))
+    with GeminiStub({"*": [ok(answer(TICKETS), delay=LATENCY)]}) as stub:
+        gemini_client.GEMINI_API_BASE = stub.url
+        gemini_client._clients.clear()
+        with Timer() as t:
+            found = analyzer.analyze_receipts([], uid)
+    biggest = max(len(text) for _, text in chunks) // analyzer.CHARS_PER_TOKEN
+    print(f"  {label:<34} {len(stub.requests):3d} requête(s), plus gros lot ≈ {biggest:6d} jetons, "
+          f"{t.elapsed:6.2f} s, {len(found)} transaction(s) après fusion")
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    uid = create_user()
+    os.environ.setdefault("GEMINI_API_KEY", "stub-key")
+    # OCR hors mesure : les tickets synthétiques remplacent les photos
+    tickets = [(i, ticket_text(i)) for i in range(1, TICKETS + 1)]
+    analyzer.ocr_extract_tickets = lambda images, failures=None: tickets
+    # Ces tickets sont lisibles hors ligne : on mesure ici le chemin Gemini
+    receipt_parser.LOCAL_PARSER = False
+    gemini_client.get_bucket(os.environ["GEMINI_API_KEY"]).__init__(100.0, 100)
+
+    print(f"{TICKETS} tickets, latence simulée {LATENCY * 1000:.0f} ms par requête\n")
+    run("un appel par ticket, en série", uid, chunk_tokens=250, concurrency=1)
+    run("un seul appel géant", uid, chunk_tokens=10 ** 6, concurrency=1)
+    run("lots de 1500 jetons, en série", uid, chunk_tokens=1500, concurrency=1)
+    run("lots de 1500 jetons, 3 en parallèle", uid, chunk_tokens=1500, concurrency=3)
@@ -0,0 +1,63 @@
+"""Requête du mois : `date LIKE 'YYYY-MM%'` contre l'intervalle semi-ouvert, sur 1M lignes."""
+import json
+import sys
+from datetime import date
+
+from _common import Timer, create_user, seed_transactions, use_temp_db
+
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USERS = 10
+RUNS = 50
+
+OLD_SQL = "SELECT * FROM transactions WHERE user_id = ? AND date LIKE ? ORDER BY date DESC"
+NEW_SQL = "SELECT * FROM transactions WHERE user_id = ? AND date >= ? AND date < ? ORDER BY date DESC"
+
+
+def _row_to_dict(row) -> dict:
+    """Row conversion as it was before: one dict per row, articles JSON always decoded."""
+    d = dict(row)
+    d["articles"] = json.loads(d["articles"]) if d["articles"] else []
+    return d
+
+
+def explain(sql: str, params) -> str:
+    with database.connection() as conn:
+        return " | ".join(r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def timed(fn) -> float:
+    with Timer() as t:
+        for _ in range(RUNS):
+            fn()
+    return t.elapsed / RUNS * 1000
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    uids = [create_user(f"u{i}") for i in range(USERS)]
+    with Timer() as t:
+        for i, uid in enumerate(uids):
+            seed_transactions(uid, ROWS // USERS, seed=i)
+    print(f"{ROWS:,} lignes, {USERS} utilisateurs (insertion {t.elapsed:.1f}s)")
+
+    uid = uids[0]
+    today = date.today()
+    first, next_first = database.month_bounds(today.year, today.month)
+    like = f"{today.year}-{today.month:02d}%"
+
+    def old():
+        with database.connection() as conn:
+            return [_row_to_dict(r) for r in conn.execute(OLD_SQL, (uid, like))]
+
+    n = len(old())
+    assert n == len(database.get_transactions_by_month(uid, today.year, today.month))
+    print(f"{n} transactions dans le mois\n")
+    print(f"LIKE        : {explain(OLD_SQL, (uid, like))}")
+    print(f"intervalle  : {explain(NEW_SQL, (uid, first, next_first))}\n")
+
+    print(f"  LIKE (avant)                {timed(old):7.2f} ms")
+    print(f"  intervalle                  {timed(lambda: database.get_transactions_by_month(uid, today.year, today.month)):7.2f} ms")
+    print(f"  intervalle + projection     "
+          f"{timed(lambda: database.get_transactions_by_month(uid, today.year, today.month, columns=['date', 'montant_total', 'type'])):7.2f} ms")
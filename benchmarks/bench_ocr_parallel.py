@@ -0,0 +1,45 @@
+"""OCR multi-tickets : accélération selon le nombre de workers (8 tickets tirés de receipts/).
+
+Le cache d'analyse est court-circuité : chaque passe refait tout l'OCR, y compris
+pour les photos répétées, et la vraie base n'est jamais touchée.
+"""
+import os
+import sys
+from pathlib import Path
+
+from _common import Timer, use_temp_db
+
+import analyzer
+
+RECEIPTS = Path(__file__).resolve().parent.parent / "receipts"
+TICKETS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+
+def run(workers: int, images) -> tuple[float, list]:
+    if analyzer._ocr_pool is not None:
+        analyzer._ocr_pool.shutdown()
+        analyzer._ocr_pool = None
+    analyzer.OCR_WORKERS = workers
+    failures = []
+    with Timer() as t:
+        analyzer.ocr_extract_multiple(images, failures)
+    return t.elapsed, failures
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    # Measure the OCR itself, not analysis_cache hits
+    analyzer._cached_ocr_text = analyzer.ocr_extract_text
+    files = sorted(RECEIPTS.glob("*.png")) + sorted(RECEIPTS.glob("*.jpg"))
+    images = [(files[i % len(files)].read_bytes(), "image/png") for i in range(TICKETS)]
+    cores = os.cpu_count() or 1
+    print(f"{TICKETS} tickets, {cores} cœur(s)\n")
+
+    analyzer.ocr_extract_text(images[0][0])  # warm-up (EasyOCR models, Tesseract cache)
+    workers = sorted({1, 2, 4, cores, 2 * cores})
+    base = None
+    for w in workers:
+        elapsed, failures = run(w, images)
+        base = base or elapsed
+        print(f"  {w:>2} worker(s)   {elapsed:6.2f} s   x{base / elapsed:.2f}"
+              + (f"   {len(failures)} échec(s) : {failures[0][1]}" if failures else ""))
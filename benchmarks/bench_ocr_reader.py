@@ -0,0 +1,36 @@
+"""OCR EasyOCR : lecteur recréé à chaque image (avant) contre lecteur partagé préchauffé, sur receipts/."""
+import io
+from pathlib import Path
+
+from _common import Timer
+
+import analyzer
+from PIL import Image
+
+RECEIPTS = Path(__file__).resolve().parent.parent / "receipts"
+
+
+def ocr(image) -> float:
+    with Timer() as t:
+        analyzer._easyocr_text(image)
+    return t.elapsed
+
+
+if __name__ == "__main__":
+    images = [(p.name, Image.open(io.BytesIO(p.read_bytes()))) for p in sorted(RECEIPTS.glob("*.png")) + sorted(RECEIPTS.glob("*.jpg"))]
+    print(f"{len(images)} ticket(s) dans {RECEIPTS}\n")
+
+    with Timer() as t:
+        analyzer.get_easyocr_reader()
+    print(f"Chargement des modèles : {t.elapsed:.2f} s\n")
+
+    print(f"  {'ticket':<34} {'à froid':>9} {'à chaud':>9}")
+    cold_total = warm_total = 0.0
+    for name, image in images:
+        analyzer._easyocr_reader = None  # what every call used to pay
+        cold = ocr(image)
+        warm = ocr(image)
+        cold_total += cold
+        warm_total += warm
+        print(f"  {name:<34} {cold:8.2f}s {warm:8.2f}s")
+    print(f"\n  {'total':<34} {cold_total:8.2f}s {warm_total:8.2f}s   (x{cold_total / max(warm_total, 1e-9):.1f})")
@@ -0,0 +1,36 @@
+"""Pré-traitement avant OCR : latence Tesseract par image et taux de repli vers EasyOCR, avant/après, sur receipts/."""
+import io
+from pathlib import Path
+
+from _common import Timer
+
+import analyzer
+from PIL import Image
+from preprocess import preprocess_image
+
+RECEIPTS = Path(__file__).resolve().parent.parent / "receipts"
+
+
+def tesseract(image_bytes: bytes, **settings) -> tuple[float, float, str]:
+    """(pre-processing seconds, OCR seconds, text) for one image."""
+    with Timer() as prep:
+        image = preprocess_image(Image.open(io.BytesIO(image_bytes)), **settings)
+    with Timer() as ocr:
+        text = analyzer._tesseract_text(image)
+    return prep.elapsed, ocr.elapsed, text
+
+
+if __name__ == "__main__":
+    files = sorted(RECEIPTS.glob("*.png")) + sorted(RECEIPTS.glob("*.jpg"))
+    runs = {"brut (avant)": {"enabled": False}, "pré-traité": {}, "pré-traité + binarisé": {"binarize": True}}
+
+    for label, settings in runs.items():
+        print(f"\n{label}")
+        fallbacks, total = 0, 0.0
+        for p in files:
+            prep, ocr, text = tesseract(p.read_bytes(), **settings)
+            fallbacks += not text
+            total += prep + ocr
+            print(f"  {p.name:<34} prép. {prep * 1000:7.1f} ms   OCR {ocr * 1000:8.1f} ms   "
+                  f"{len(text):5d} car.{'   → repli EasyOCR' if not text else ''}")
+        print(f"  moyenne {total / max(len(files), 1) * 1000:.0f} ms/image, repli EasyOCR {fallbacks}/{len(files)}")
@@ -0,0 +1,72 @@
+"""Parseur local de tickets : précision et latence sur les textes OCR étiquetés de receipts/fixtures/.
+
+labels.json donne pour chaque texte l'enseigne, la date, le montant et la catégorie attendus,
+ou {"escalate": true} quand le ticket doit partir vers Gemini (relevé à plusieurs lignes,
+remboursement, texte illisible, enseigne sans mot-clé de catégorie). Code de sortie 1 si
+une réponse locale est fausse ou si un ticket à escalader reste local.
+"""
+import json
+import sys
+from datetime import date
+from pathlib import Path
+
+from _common import Timer, create_user, use_temp_db
+
+from categorizer import get_category_matcher, normalize
+from receipt_parser import LOCAL_MIN_CONFIDENCE, extract_receipt, local_transaction
+
+FIXTURES = Path(__file__).resolve().parent.parent / "receipts" / "fixtures"
+REPEAT = 200
+TODAY = date(2026, 2, 15)
+
+
+def check(found: dict, label: dict) -> list[str]:
+    """Fields of a local answer that disagree with the label."""
+    wrong = []
+    if found["montant"] is None or abs(found["montant"] - label["montant"]) > 0.005:
+        wrong.append("montant")
+    if label["date"] and found["date"] != label["date"]:
+        wrong.append("date")
+    got, want = normalize(found["enseigne"] or ""), normalize(label["enseigne"])
+    if not got or (got not in want and want not in got):
+        wrong.append("enseigne")
+    if found["categorie"] != label["categorie"]:
+        wrong.append("categorie")
+    return wrong
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    matcher = get_category_matcher(create_user())
+    labels = json.loads((FIXTURES / "labels.json").read_text(encoding="utf-8"))
+
+    local = exact = escalated = missed = 0
+    total_time = 0.0
+    for name, label in labels.items():
+        text = (FIXTURES / name).read_text(encoding="utf-8")
+        with Timer() as t:
+            for _ in range(REPEAT):
+                found = extract_receipt(text, TODAY, matcher)
+        total_time += t.elapsed / REPEAT
+        is_local = local_transaction(text, TODAY.isoformat(), matcher) is not None
+        if not is_local:
+            escalated += 1
+            missed += not label.get("escalate")
+            verdict = "→ Gemini" + ("" if label.get("escalate") else "  (aurait pu rester local)")
+        elif label.get("escalate"):
+            local += 1
+            verdict = "ERREUR : aurait dû partir vers Gemini"
+        else:
+            local += 1
+            wrong = check(found, label)
+            exact += not wrong
+            verdict = "ok" if not wrong else "faux : " + ", ".join(wrong)
+        print(f"  {name:<26} conf. {found['confidence']:.2f}  {t.elapsed / REPEAT * 1e6:7.0f} µs  "
+              f"{str(found['montant']):>6}  {str(found['date']):<10}  {str(found['enseigne'])[:22]:<22}  {verdict}")
+
+    n = len(labels)
+    print(f"\n{n} tickets : {local} traités localement ({exact} exacts), {escalated} envoyés à Gemini "
+          f"(dont {missed} évitables)")
+    print(f"précision locale {exact / max(local, 1):.0%}, couverture {local / n:.0%}, "
+          f"latence moyenne {total_time / n * 1e6:.0f} µs/ticket (seuil de confiance {LOCAL_MIN_CONFIDENCE})")
+    sys.exit(0 if exact == local else 1)
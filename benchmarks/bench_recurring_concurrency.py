@@ -0,0 +1,114 @@
+"""Récurrents en parallèle : aucun doublon quand plusieurs sessions appliquent le même mois en même temps.
+
+Chaque scénario lance PROCESSES processus qui démarrent ensemble et appliquent
+ROUNDS fois les récurrents du mois en cours, puis compte les occurrences en
+double. Le premier rejoue l'ancien schéma (SELECT par date puis INSERT, sans
+clé d'occurrence) pour comparaison. Code de sortie 1 si un des autres chemins
+laisse un doublon (même contenu ou même (recurring_id, recurring_date)).
+"""
+import multiprocessing as mp
+import sys
+import time
+from datetime import date
+
+from _common import create_user, use_temp_db
+
+import database
+
+PROCESSES = 8
+ROUNDS = 20
+USERS = 3
+
+
+def _wait(start_at: float):
+    time.sleep(max(0.0, start_at - time.time()))
+
+
+def _occurrences(today: date) -> list[tuple[int, date]]:
+    with database.connection() as conn:
+        recurrings = [dict(r) for r in conn.execute("SELECT * FROM recurring")]
+    return [(rec["id"], d) for rec in recurrings for d in database.recurring_dates(rec, today.replace(day=1), today)]
+
+
+def _legacy(conn, rec: dict, day: str):
+    """What apply_recurring_for_month did per date: look, then insert in another statement."""
+    exists = conn.execute(
+        "SELECT id FROM transactions WHERE user_id=? AND date=? AND enseigne=? AND montant_total=? AND type=?",
+        (rec["user_id"], day, rec["enseigne"], rec["montant"], rec["type"])).fetchone()
+    time.sleep(0.001)  # a rerun of another session lands here
+    return exists
+
+
+def _session(args):
+    db_path, scenario, start_at = args
+    database.DB_PATH = db_path
+    today = date.today()
+    _wait(start_at)
+    for _ in range(ROUNDS):
+        if scenario == "legacy":
+            with database.connection() as conn:
+                recurrings = {r["id"]: dict(r) for r in conn.execute("SELECT * FROM recurring")}
+            for rec_id, d in _occurrences(today):
+                rec = recurrings[rec_id]
+                with database.connection() as conn:
+                    found = _legacy(conn, rec, d.isoformat())
+                if not found:
+                    database.insert_transaction(rec["user_id"], d.isoformat(), rec["enseigne"], rec["montant"],
+                                                rec["categorie"], "", [], rec["type"])
+        elif scenario == "month":
+            for uid in range(1, USERS + 1):
+                database.apply_recurring_for_month(uid, today.year, today.month)
+        elif scenario == "due":
+            with database.connection() as conn:
+                conn.execute("UPDATE recurring SET last_applied = NULL")
+            database.apply_due_recurring()
+        elif scenario == "deferred":
+            # Without the IMMEDIATE lock of retrying_write: only the unique index protects
+            with database.connection() as conn:
+                database._materialize_recurring(conn, _occurrences(today))
+
+
+def run(label: str, scenario: str) -> bool:
+    """Run one scenario; True when it left exactly the expected occurrences."""
+    db_path = use_temp_db()
+    for u in range(USERS):
+        uid = create_user(f"rec{u}")
+        database.insert_recurring(uid, "Loyer", 650.0, "Logement & Factures", "depense", "mensuel", 1)
+        database.insert_recurring(uid, "Piscine", 4.5, "Loisirs & Sorties", "depense", "hebdomadaire",
+                                  date.today().weekday())
+    expected = len(_occurrences(date.today()))
+    database.close_pool()
+
+    start_at = time.time() + 1.0
+    started = time.perf_counter()
+    with mp.Pool(PROCESSES) as pool:
+        pool.map(_session, [(db_path, scenario, start_at)] * PROCESSES)
+    elapsed = time.perf_counter() - started - 1.0
+
+    database.DB_PATH = db_path
+    with database.connection() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        duplicates = conn.execute(
+            """SELECT COALESCE(SUM(n - 1), 0) FROM (
+                   SELECT COUNT(*) AS n FROM transactions
+                   GROUP BY user_id, date, enseigne, montant_total, type HAVING n > 1)""").fetchone()[0]
+        duplicates += conn.execute(
+            """SELECT COALESCE(SUM(n - 1), 0) FROM (
+                   SELECT COUNT(*) AS n FROM transactions WHERE recurring_id IS NOT NULL
+                   GROUP BY recurring_id, recurring_date HAVING n > 1)""").fetchone()[0]
+    passed = rows == expected and not duplicates
+    print(f"  {label:<40} {rows:4d} lignes pour {expected:3d} attendues, {duplicates:4d} doublon(s), "
+          f"{elapsed:5.2f} s   {'OK' if passed else 'DOUBLONS'}")
+    return passed
+
+
+if __name__ == "__main__":
+    print(f"{PROCESSES} processus × {ROUNDS} passes, {USERS} utilisateurs × 2 récurrents\n")
+    run("ancien schéma (SELECT puis INSERT)", "legacy")
+    passed = all([
+        run("apply_recurring_for_month", "month"),
+        run("apply_due_recurring, watermark remis à 0", "due"),
+        run("INSERT … ON CONFLICT hors verrou", "deferred"),
+    ])
+    print("\naucun doublon avec la clé d'occurrence" if passed else "\nÉCHEC : doublons avec la clé d'occurrence")
+    sys.exit(0 if passed else 1)
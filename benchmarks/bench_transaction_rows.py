@@ -0,0 +1,43 @@
+"""Mémoire et latence du chargement de l'historique (100k lignes) : dicts vs Transaction paresseuse."""
+import json
+import tracemalloc
+
+from _common import Timer, create_user, seed_transactions, use_temp_db
+
+import database
+
+ROWS = 100_000
+
+
+def load_dicts(uid: int) -> list[dict]:
+    """What get_all_transactions did before: one dict per row, articles JSON always decoded."""
+    with database.connection() as conn:
+        rows = conn.execute("SELECT * FROM transactions WHERE user_id = ? ORDER BY date DESC", (uid,)).fetchall()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["articles"] = json.loads(d["articles"]) if d["articles"] else []
+        out.append(d)
+    return out
+
+
+def measure(label: str, fn):
+    fn()  # warm page cache
+    with Timer() as t:
+        fn()
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = sum(r["montant_total"] for r in result)  # what the pages actually read
+    print(f"  {label:<28} {t.elapsed * 1000:8.1f} ms   pic {peak / 1e6:7.1f} Mo   ({len(result)} lignes, {total:.0f}€)")
+
+
+if __name__ == "__main__":
+    use_temp_db()
+    uid = create_user()
+    seed_transactions(uid, ROWS)
+    print(f"Historique complet d'un utilisateur de {ROWS:,} transactions")
+    measure("dicts + json.loads (avant)", lambda: load_dicts(uid))
+    measure("Transaction (articles lazy)", lambda: database.get_all_transactions(uid))
+    measure("Transaction + SUMMARY_COLUMNS", lambda: database.get_all_transactions(uid, columns=database.SUMMARY_COLUMNS))
@@ -0,0 +1,97 @@
+"""Faux serveur Gemini (API REST generateContent) qui rejoue des réponses préparées.
+
+Chaque modèle a sa file de réponses {"status", "text" ou "body", "headers", "delay"} ;
+la dernière est répétée quand la file est vide. Pointer le client dessus avec
+GEMINI_API_BASE=http://127.0.0.1:<port>.
+
+    python benchmarks/gemini_stub.py scenario.json --port 8765
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OK_TEXT = '{"transactions": [{"enseigne": "Carrefour", "date": "2026-01-15", "montant": 42.5, "categorie": "Alimentaire", "type": "depense"}]}'
+
+
+def ok(text: str = OK_TEXT, delay: float = 0.0) -> dict:
+    return {"status": 200, "text": text, "delay": delay}
+
+
+def error(status: int, retry_after: float | str = None) -> dict:
+    """An error answer; `retry_after` in seconds, or any raw header value (an HTTP-date)."""
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+    return {"status": status, "body": {"error": {"code": status, "message": f"stub {status}"}}, "headers": headers}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        m = re.match(r"/v1beta/models/([^/:]+):generateContent", self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        prompt = json.loads(self.rfile.read(length) or b"{}")
+        if not m:
+            return self._send(404, {"error": {"code": 404, "message": "unknown route"}})
+        model = m.group(1)
+        stub = self.server.stub
+        with stub.lock:
+            stub.requests.append({"model": model, "time": time.monotonic(), "prompt": prompt})
+            queue = stub.script.get(model, stub.script.get("*", [error(404)]))
+            reply = queue.pop(0) if len(queue) > 1 else queue[0]
+        time.sleep(reply.get("delay", 0))
+        if reply["status"] != 200:
+            return self._send(reply["status"], reply.get("body", {}), reply.get("headers", {}))
+        text = reply["text"]
+        self._send(200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(json.dumps(prompt)) // 4, "candidatesTokenCount": len(text) // 4,
+                              "totalTokenCount": (len(json.dumps(prompt)) + len(text)) // 4},
+        })
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class GeminiStub:
+    """Stub server running in a background thread; `script` maps model name (or "*") to its replies."""
+
+    def __init__(self, script: dict[str, list[dict]], port: int = 0):
+        self.script = {model: list(replies) for model, replies in script.items()}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.stub = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", nargs="?", help="JSON {modèle: [réponses]} ; par défaut tout répond 200")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    script = json.load(open(args.scenario, encoding="utf-8")) if args.scenario else {"*": [ok()]}
+    with GeminiStub(script, args.port) as stub:
+        print(f"Stub Gemini sur {stub.url} (Ctrl+C pour arrêter)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,80 @@
+"""Local categorisation from each category's `mots_cles`.
+
+All of a user's keywords are compiled into one trie-shaped regex, so a label
+is scanned once whatever the number of keywords. The compiled matcher is
+cached per user in the database query cache ("categories" namespace) and is
+rebuilt when a category is added or deleted.
+"""
+import re
+import unicodedata
+
+from database import cached_query, get_all_categories
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents, so 'Électricité' matches 'electricite'."""
+    text = unicodedata.normalize("NFKD", text.strip().lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _trie_regex(words: list[str]) -> str:
+    """Regex alternation for `words` factored into a trie: 'bar|bus|burger' → 'b(?:ar|u(?:s|rger))'.
+
+    Optional branches are greedy, so the longest keyword at a position wins.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def render(node) -> str:
+        end = "" in node
+        branches = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end:
+            return f"(?:{body})?" if len(branches) == 1 and len(body) > 1 else body + "?"
+        return body
+
+    return render(trie)
+
+
+class KeywordMatcher:
+    """Immutable keyword → category matcher for one user's categories."""
+    __slots__ = ("names", "hints", "_categories", "_pattern", "_default", "_income")
+
+    def __init__(self, categories: list[dict]):
+        self.names = [c["nom"] for c in categories]
+        self.hints = []
+        self._categories = {}
+        for c in categories:
+            kws = [k.strip() for k in (c.get("mots_cles") or "").split(",") if k.strip()]
+            if kws:
+                self.hints.append(f"  * {', '.join(kws)} → {c['nom']}")
+            for kw in kws:
+                self._categories.setdefault(normalize(kw), c["nom"])
+        # Keywords must be whole words: 'bar' matches neither 'cabaret' nor 'barclays'. A plural 's'
+        # is allowed ('pizzas'), and so are digits glued to the end, as in card labels ('carrefour12').
+        self._pattern = (re.compile(r"(?<![a-z0-9])(" + _trie_regex(list(self._categories)) + r")s?(?![a-z])")
+                         if self._categories else None)
+        self._default = self.names[0] if self.names else "Autre"
+        self._income = "Revenu" if "Revenu" in self.names else self._default
+
+    def match(self, text: str) -> str | None:
+        """Category of the leftmost (then longest) keyword found in text, or None."""
+        if self._pattern is None or not text:
+            return None
+        m = self._pattern.search(normalize(text))
+        return self._categories[m.group(1)] if m else None
+
+    def categorize(self, text: str, txn_type: str = "depense") -> str:
+        """match() with a fallback: 'Revenu' for income, else the first category."""
+        return self.match(text) or (self._income if txn_type == "revenu" else self._default)
+
+
+@cached_query("categories", copy_result=False)
+def get_category_matcher(user_id: int) -> KeywordMatcher:
+    return KeywordMatcher(get_all_categories(user_id))
@@ -1,5 +1,18 @@
 import sqlite3
+import calendar
+import copy
+import csv
+import io
 import json
+import os
+import queue
+import random
+import threading
+import time
+import functools
+from collections import Counter
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime, date, timedelta
 
@@ -21,16 +34,213 @@ AVATAR_LIST = ["😎", "🦊", "🐱", "🐶", "🦁", "🐼", "🦄", "🐸", "
                "👤", "👩", "👨", "🧑", "👸", "🤴", "🧙", "🦸", "🧛", "🤖"]
 
 
+# Idle connections kept open between calls. 0 disables pooling (one connection per call).
+POOL_SIZE = 8
+
+# PRAGMA sets applied to the database file (journal_mode) and to every connection (the rest).
+# Pick one with BUDGET_DB_PROFILE or init_db(profile=...).
+STORAGE_PROFILES = {
+    "wal": {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000,
+            "mmap_size": 256 * 1024 * 1024, "cache_size": -16000},
+    "legacy": {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 5000,
+               "mmap_size": 0, "cache_size": -2000},
+}
+_storage = dict(STORAGE_PROFILES[os.getenv("BUDGET_DB_PROFILE", "wal")])
+
+# Retries for writes that still hit "database is locked" after busy_timeout
+WRITE_RETRIES = 5
+WRITE_RETRY_BASE_DELAY = 0.05
+
+_pool: queue.LifoQueue = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_pool_path: str | None = None
+_local = threading.local()
+
+
 def get_connection():
-    conn = sqlite3.connect(str(DB_PATH))
+    """Open a new standalone connection. Prefer `connection()`, which reuses pooled ones."""
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {int(_storage['busy_timeout'])}")
+    conn.execute(f"PRAGMA synchronous = {_storage['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(_storage['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(_storage['cache_size'])}")
     return conn
 
 
-def init_db():
-    conn = get_connection()
+def _acquire_connection() -> sqlite3.Connection:
+    global _pool_path
+    path = str(DB_PATH)
+    if _pool_path != path:
+        # DB_PATH was changed (tests, benchmarks): drop connections to the old file
+        with _pool_lock:
+            if _pool_path != path:
+                close_pool()
+                _pool_path = path
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return get_connection()
+
+
+def _release_connection(conn: sqlite3.Connection):
+    if _pool_path == str(DB_PATH) and _pool.qsize() < POOL_SIZE:
+        _pool.put(conn)
+    else:
+        conn.close()
+
+
+def close_pool():
+    """Close every idle pooled connection."""
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
+
 
+@contextmanager
+def connection(immediate: bool = False):
+    """Borrow a pooled connection for the current thread.
+
+    Nested calls on the same thread share the outer connection, so a page
+    render or a multi-step write runs on one connection and one transaction.
+    Commits when the outermost block exits, rolls back if it raises.
+    `immediate` takes the write lock up front (BEGIN IMMEDIATE) so a
+    read-then-write block waits in busy_timeout instead of failing mid-way.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    conn = _acquire_connection()
+    _local.conn = conn
+    _local.after_commit = []
+    try:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.conn = None
+        _release_connection(conn)
+        for callback in _local.after_commit:
+            callback()
+
+
+def _after_commit(callback):
+    """Run callback once the current transaction ends (now if none is open).
+
+    Only cache invalidations use it, so it runs after a rollback as well.
+    """
+    if getattr(_local, "conn", None) is not None:
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+
+# ─── Query cache ───
+# Small per-process cache for reads repeated within and across reruns (categories,
+# budgets, friends, users). Entries expire after CACHE_TTL seconds (0 disables the
+# cache) and are dropped when a matching write commits or rolls back. Reads inside
+# an open transaction bypass it. Other processes only see changes once the TTL expires.
+
+CACHE_TTL = 60.0
+
+_cache: dict[tuple, tuple[float, object]] = {}
+_cache_generation = 0  # bumped by every invalidation
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def cached_query(namespace: str, copy_result: bool = True):
+    """Cache a read whose first argument is the user id, keyed by (namespace, function, user_id, args).
+
+    Callers get a deep copy unless `copy_result` is False, for values that are never mutated.
+    """
+    clone = copy.deepcopy if copy_result else (lambda value: value)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(user_id, *args, **kwargs):
+            conn = getattr(_local, "conn", None)
+            if conn is not None and conn.in_transaction:
+                # May see uncommitted rows, or miss writes whose invalidation waits for the commit
+                return fn(user_id, *args, **kwargs)
+            key = (namespace, fn.__name__, user_id, args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            with _cache_lock:
+                entry = _cache.get(key)
+                if entry is not None and entry[0] > now:
+                    _cache_stats["hits"] += 1
+                    return clone(entry[1])
+                _cache_stats["misses"] += 1
+                generation = _cache_generation
+            value = fn(user_id, *args, **kwargs)
+            with _cache_lock:
+                # A write committed while we were reading: the value may predate it, don't store
+                if CACHE_TTL > 0 and generation == _cache_generation:
+                    _cache[key] = (now + CACHE_TTL, value)
+            return clone(value)
+        return wrapper
+    return decorator
+
+
+def invalidate_cache(namespace: str | None = None, user_id: int | None = None):
+    """Drop cached entries for a namespace (all if None), optionally for one user only."""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _cache_stats["invalidations"] += 1
+        for key in [k for k in _cache if (namespace is None or k[0] == namespace)
+                    and (user_id is None or k[2] == user_id)]:
+            del _cache[key]
+
+
+def _invalidate_on_commit(namespace: str, user_id: int | None = None):
+    _after_commit(lambda: invalidate_cache(namespace, user_id))
+
+
+def get_cache_stats() -> dict:
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_cache)}
+
+
+def _is_locked(exc: sqlite3.OperationalError) -> bool:
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def retrying_write(fn):
+    """Run a write function in its own IMMEDIATE transaction, retrying with jittered
+    exponential backoff while the database is locked by another session.
+    Nested inside an open connection() it just runs, the outer block owns the retry."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, "conn", None) is not None:
+            return fn(*args, **kwargs)
+        delay = WRITE_RETRY_BASE_DELAY
+        for attempt in range(WRITE_RETRIES):
+            try:
+                with connection(immediate=True):
+                    return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_locked(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(delay * (1 + random.random()))
+                delay *= 2
+    return wrapper
+
+
+# ─── Schema migrations ───
+# Each step runs once, in order, and bumps PRAGMA user_version. Append new steps, never edit old ones.
+
+def _migrate_base_schema(conn: sqlite3.Connection):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -188,146 +398,335 @@ def init_db():
     if "sous_categories" not in cat_cols:
         conn.execute("ALTER TABLE categories ADD COLUMN sous_categories TEXT NOT NULL DEFAULT ''")
 
-    conn.commit()
-    conn.close()
 
+def _migrate_indexes(conn: sqlite3.Connection):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions(user_id, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date ON transactions(user_id, type, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_cat_date ON transactions(user_id, categorie, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_debts_pair ON debts(from_user, to_user, settled)")
+
+
+# Materialised per-user sums of `transactions`, kept in sync by triggers: table -> key column -> SQL
+# expression over a transactions row ({r} is NEW, OLD or the table itself when backfilling).
+_AGGREGATES = {
+    "monthly_totals": {
+        "mois": "substr({r}.date, 1, 7)",
+        "categorie": "{r}.categorie",
+        "type": "{r}.type",
+    },
+    "enseigne_totals": {
+        "annee": "substr({r}.date, 1, 4)",
+        "enseigne": "{r}.enseigne",
+        "type": "{r}.type",
+    },
+    "weekday_totals": {
+        "annee": "substr({r}.date, 1, 4)",
+        "jour_semaine": "COALESCE((CAST(strftime('%w', {r}.date) AS INTEGER) + 6) % 7, -1)",  # 0 = lundi
+        "type": "{r}.type",
+    },
+}
+
+
+def _aggregate_add_sql(table: str, keys: dict, r: str) -> str:
+    cols = ", ".join(keys)
+    exprs = ", ".join(e.format(r=r) for e in keys.values())
+    return (f"INSERT INTO {table} (user_id, {cols}, total, nb) VALUES ({r}.user_id, {exprs}, {r}.montant_total, 1) "
+            f"ON CONFLICT(user_id, {cols}) DO UPDATE SET total = total + excluded.total, nb = nb + 1;")
+
+
+def _aggregate_sub_sql(table: str, keys: dict, r: str) -> str:
+    where = " AND ".join([f"user_id = {r}.user_id"] + [f"{k} = {e.format(r=r)}" for k, e in keys.items()])
+    return (f"UPDATE {table} SET total = total - {r}.montant_total, nb = nb - 1 WHERE {where}; "
+            f"DELETE FROM {table} WHERE {where} AND nb <= 0;")
+
+
+def _migrate_aggregates(conn: sqlite3.Connection):
+    for table, keys in _AGGREGATES.items():
+        key_cols = ", ".join(f"{k} {'INTEGER' if k == 'jour_semaine' else 'TEXT'} NOT NULL" for k in keys)
+        cols = ", ".join(keys)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                {key_cols},
+                total REAL NOT NULL DEFAULT 0,
+                nb INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, {cols})
+            )
+        """)
+        conn.execute(f"DELETE FROM {table}")
+        exprs = ", ".join(e.format(r="transactions") for e in keys.values())
+        conn.execute(f"""
+            INSERT INTO {table} (user_id, {cols}, total, nb)
+            SELECT user_id, {exprs}, SUM(montant_total), COUNT(*)
+            FROM transactions GROUP BY 1, {", ".join(str(i + 2) for i in range(len(keys)))}
+        """)
+        add_new, sub_old = _aggregate_add_sql(table, keys, "NEW"), _aggregate_sub_sql(table, keys, "OLD")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON transactions "
+                     f"BEGIN {add_new} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON transactions "
+                     f"BEGIN {sub_old} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_update "
+                     f"AFTER UPDATE OF user_id, date, enseigne, montant_total, categorie, type ON transactions "
+                     f"BEGIN {sub_old} {add_new} END")
+
+
+def _migrate_analysis_cache(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_lru ON analysis_cache(last_used)")
+
+
+def _migrate_analysis_jobs(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after REAL NOT NULL DEFAULT 0,
+            result TEXT,
+            failures TEXT,
+            error TEXT,
+            consumed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_user ON analysis_jobs(user_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status, run_after)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_job_images (
+            job_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            mime TEXT,
+            PRIMARY KEY (job_id, position),
+            FOREIGN KEY (job_id) REFERENCES analysis_jobs(id) ON DELETE CASCADE
+        )
+    """)
+
+
+def _migrate_recurring_watermark(conn: sqlite3.Connection):
+    # Last day whose occurrences were materialised; NULL until the scheduler first sees the recurrence
+    rec_cols = [r[1] for r in conn.execute("PRAGMA table_info(recurring)").fetchall()]
+    if "last_applied" not in rec_cols:
+        conn.execute("ALTER TABLE recurring ADD COLUMN last_applied TEXT")
 
+
+def _migrate_recurring_occurrences(conn: sqlite3.Connection):
+    # A materialised occurrence points back to its recurrence and scheduled day (which stays
+    # put if the user later edits `date`); the unique index makes inserting it twice a no-op.
+    tx_cols = [r[1] for r in conn.execute("PRAGMA table_info(transactions)").fetchall()]
+    if "recurring_id" not in tx_cols:
+        conn.execute("ALTER TABLE transactions ADD COLUMN recurring_id INTEGER")
+    if "recurring_date" not in tx_cols:
+        conn.execute("ALTER TABLE transactions ADD COLUMN recurring_date TEXT")
+    # Link rows the old render-time code created, matched on the identity it deduplicated on.
+    # Only the first of same-day duplicates is linked, the rest stay plain rows.
+    for rec in conn.execute("SELECT * FROM recurring").fetchall():
+        first = conn.execute(
+            "SELECT MIN(date) FROM transactions WHERE user_id = ? AND enseigne = ? AND montant_total = ? AND type = ?",
+            (rec["user_id"], rec["enseigne"], rec["montant"], rec["type"])).fetchone()[0]
+        if first is None:
+            continue
+        dates = [d.isoformat() for d in recurring_dates(dict(rec), date.fromisoformat(first[:10]), date.today())]
+        conn.execute(
+            """UPDATE transactions SET recurring_id = ?, recurring_date = date
+               WHERE id IN (
+                   SELECT MIN(id) FROM transactions
+                   WHERE user_id = ? AND enseigne = ? AND montant_total = ? AND type = ?
+                     AND recurring_id IS NULL AND date IN (SELECT value FROM json_each(?))
+                   GROUP BY date
+               )""",
+            (rec["id"], rec["user_id"], rec["enseigne"], rec["montant"], rec["type"], json.dumps(dates)))
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_recurring
+                    ON transactions(recurring_id, recurring_date) WHERE recurring_id IS NOT NULL""")
+
+
+MIGRATIONS = [
+    (1, _migrate_base_schema),
+    (2, _migrate_indexes),
+    (3, _migrate_aggregates),
+    (4, _migrate_analysis_cache),
+    (5, _migrate_analysis_jobs),
+    (6, _migrate_recurring_watermark),
+    (7, _migrate_recurring_occurrences),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+_init_lock = threading.Lock()
+_initialized_path: str | None = None
+
+
+def init_db(profile: str | dict | None = None):
+    """Create/migrate the schema. `profile` selects a STORAGE_PROFILES entry or a custom PRAGMA dict.
+
+    Every page calls this on each rerun, so the bootstrap runs once per process
+    and database file; later calls return without touching SQLite.
+    """
+    global _storage, _initialized_path
+    if profile is None and _initialized_path == str(DB_PATH):
+        return
+    with _init_lock:
+        if profile is not None:
+            _storage = dict(STORAGE_PROFILES[profile] if isinstance(profile, str) else profile)
+            close_pool()  # pooled connections carry the old per-connection PRAGMAs
+        elif _initialized_path == str(DB_PATH):
+            return
+        _bootstrap_schema()
+        _initialized_path = str(DB_PATH)
+
+
+def _bootstrap_schema():
+    with connection() as conn:
+        conn.execute(f"PRAGMA journal_mode = {_storage['journal_mode']}")
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+    # Re-read under the write lock: another process may have migrated meanwhile
+    with connection(immediate=True) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, migrate in MIGRATIONS:
+            if target > version:
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+
+@retrying_write
 def seed_default_categories(user_id: int):
-    conn = get_connection()
-    existing = conn.execute("SELECT COUNT(*) as c FROM categories WHERE user_id = ?", (user_id,)).fetchone()["c"]
-    if existing == 0:
-        for cat in DEFAULT_CATEGORIES:
-            conn.execute(
-                "INSERT INTO categories (user_id, nom, icon, color, mots_cles, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, cat["nom"], cat["icon"], cat["color"], cat["mots_cles"], datetime.now().isoformat())
-            )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        existing = conn.execute("SELECT COUNT(*) as c FROM categories WHERE user_id = ?", (user_id,)).fetchone()["c"]
+        if existing == 0:
+            for cat in DEFAULT_CATEGORIES:
+                conn.execute(
+                    "INSERT INTO categories (user_id, nom, icon, color, mots_cles, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, cat["nom"], cat["icon"], cat["color"], cat["mots_cles"], datetime.now().isoformat())
+                )
+            _invalidate_on_commit("categories", user_id)
 
 
 def ensure_user_has_categories(user_id: int):
     """Call this on each page load to fix the bug where users have no categories."""
-    conn = get_connection()
-    count = conn.execute("SELECT COUNT(*) as c FROM categories WHERE user_id = ?", (user_id,)).fetchone()["c"]
-    conn.close()
-    if count == 0:
+    if not get_all_categories(user_id):
         seed_default_categories(user_id)
 
 
 # ─── Users ───
 
+@retrying_write
 def create_user(username: str, password_hash: str, display_name: str, avatar: str = "👤") -> int:
-    conn = get_connection()
-    try:
+    with connection() as conn:
         cursor = conn.execute(
             "INSERT INTO users (username, password_hash, display_name, avatar, created_at) VALUES (?, ?, ?, ?, ?)",
             (username.lower().strip(), password_hash, display_name.strip(), avatar, datetime.now().isoformat())
         )
-        conn.commit()
-        uid = cursor.lastrowid
-    finally:
-        conn.close()
-    return uid
+        return cursor.lastrowid
 
 
 def get_user_by_username(username: str) -> dict | None:
-    conn = get_connection()
-    row = conn.execute("SELECT * FROM users WHERE username = ?", (username.lower().strip(),)).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM users WHERE username = ?", (username.lower().strip(),)).fetchone()
     return dict(row) if row else None
 
 
+@cached_query("users")
 def get_user_by_id(user_id: int) -> dict | None:
-    conn = get_connection()
-    row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
     return dict(row) if row else None
 
 
 def get_all_users() -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("SELECT id, username, display_name, avatar FROM users ORDER BY display_name").fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("SELECT id, username, display_name, avatar FROM users ORDER BY display_name").fetchall()
     return [dict(r) for r in rows]
 
 
 # ─── Friendships ───
 
+@retrying_write
 def send_friend_request(from_id: int, to_id: int) -> bool:
     if from_id == to_id:
         return False
     a, b = min(from_id, to_id), max(from_id, to_id)
-    conn = get_connection()
-    existing = conn.execute("SELECT * FROM friendships WHERE user_a = ? AND user_b = ?", (a, b)).fetchone()
-    if existing:
-        conn.close()
-        return False
-    conn.execute(
-        "INSERT INTO friendships (user_a, user_b, status, requested_by, created_at) VALUES (?, ?, 'pending', ?, ?)",
-        (a, b, from_id, datetime.now().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        existing = conn.execute("SELECT * FROM friendships WHERE user_a = ? AND user_b = ?", (a, b)).fetchone()
+        if existing:
+            return False
+        conn.execute(
+            "INSERT INTO friendships (user_a, user_b, status, requested_by, created_at) VALUES (?, ?, 'pending', ?, ?)",
+            (a, b, from_id, datetime.now().isoformat())
+        )
+        _invalidate_on_commit("friends")
     return True
 
 
+@retrying_write
 def accept_friend_request(friendship_id: int):
-    conn = get_connection()
-    conn.execute("UPDATE friendships SET status = 'accepted' WHERE id = ?", (friendship_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("UPDATE friendships SET status = 'accepted' WHERE id = ?", (friendship_id,))
+        _invalidate_on_commit("friends")
 
 
+@retrying_write
 def reject_friend_request(friendship_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM friendships WHERE id = ?", (friendship_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM friendships WHERE id = ?", (friendship_id,))
+        _invalidate_on_commit("friends")
 
 
+@retrying_write
 def remove_friend(friendship_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM friendships WHERE id = ?", (friendship_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM friendships WHERE id = ?", (friendship_id,))
+        _invalidate_on_commit("friends")
 
 
+@cached_query("friends")
 def get_friends(user_id: int) -> list[dict]:
     """Return accepted friends with their user info."""
-    conn = get_connection()
-    rows = conn.execute("""
-        SELECT f.id as friendship_id, u.id, u.username, u.display_name, u.avatar
-        FROM friendships f
-        JOIN users u ON (u.id = CASE WHEN f.user_a = ? THEN f.user_b ELSE f.user_a END)
-        WHERE (f.user_a = ? OR f.user_b = ?) AND f.status = 'accepted'
-    """, (user_id, user_id, user_id)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT f.id as friendship_id, u.id, u.username, u.display_name, u.avatar
+            FROM friendships f
+            JOIN users u ON (u.id = CASE WHEN f.user_a = ? THEN f.user_b ELSE f.user_a END)
+            WHERE (f.user_a = ? OR f.user_b = ?) AND f.status = 'accepted'
+        """, (user_id, user_id, user_id)).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_pending_requests_for_me(user_id: int) -> list[dict]:
     """Friend requests TO me that I haven't accepted."""
-    conn = get_connection()
-    rows = conn.execute("""
-        SELECT f.id as friendship_id, u.id as user_id, u.username, u.display_name, u.avatar
-        FROM friendships f
-        JOIN users u ON u.id = f.requested_by
-        WHERE ((f.user_a = ? OR f.user_b = ?) AND f.requested_by != ? AND f.status = 'pending')
-    """, (user_id, user_id, user_id)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT f.id as friendship_id, u.id as user_id, u.username, u.display_name, u.avatar
+            FROM friendships f
+            JOIN users u ON u.id = f.requested_by
+            WHERE ((f.user_a = ? OR f.user_b = ?) AND f.requested_by != ? AND f.status = 'pending')
+        """, (user_id, user_id, user_id)).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_pending_requests_from_me(user_id: int) -> list[dict]:
     """Friend requests I sent that are still pending."""
-    conn = get_connection()
-    rows = conn.execute("""
-        SELECT f.id as friendship_id, u.id as user_id, u.username, u.display_name, u.avatar
-        FROM friendships f
-        JOIN users u ON (u.id = CASE WHEN f.user_a = ? THEN f.user_b ELSE f.user_a END)
-        WHERE (f.user_a = ? OR f.user_b = ?) AND f.requested_by = ? AND f.status = 'pending'
-    """, (user_id, user_id, user_id, user_id)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT f.id as friendship_id, u.id as user_id, u.username, u.display_name, u.avatar
+            FROM friendships f
+            JOIN users u ON (u.id = CASE WHEN f.user_a = ? THEN f.user_b ELSE f.user_a END)
+            WHERE (f.user_a = ? OR f.user_b = ?) AND f.requested_by = ? AND f.status = 'pending'
+        """, (user_id, user_id, user_id, user_id)).fetchall()
     return [dict(r) for r in rows]
 
 
@@ -338,10 +737,10 @@ def get_friend_ids(user_id: int) -> list[int]:
 
 # ─── Categories (per user) ───
 
+@cached_query("categories")
 def get_all_categories(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("SELECT * FROM categories WHERE user_id = ? ORDER BY nom", (user_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("SELECT * FROM categories WHERE user_id = ? ORDER BY nom", (user_id,)).fetchall()
     return [dict(r) for r in rows]
 
 
@@ -354,462 +753,790 @@ def get_category_map(user_id: int) -> dict:
     return {c["nom"]: {"icon": c["icon"], "color": c["color"], "mots_cles": c["mots_cles"]} for c in cats}
 
 
-def insert_category(user_id: int, nom: str, icon: str, color: str, mots_cles: str) -> int:
-    conn = get_connection()
-    cursor = conn.execute(
-        "INSERT INTO categories (user_id, nom, icon, color, mots_cles, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (user_id, nom, icon, color, mots_cles, datetime.now().isoformat())
-    )
-    conn.commit()
-    cid = cursor.lastrowid
-    conn.close()
-    return cid
+@retrying_write
+def insert_category(user_id: int, nom: str, icon: str, color: str, mots_cles: str,
+                    sous_categories: str = "") -> int:
+    with connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO categories (user_id, nom, icon, color, mots_cles, sous_categories, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, nom, icon, color, mots_cles, sous_categories, datetime.now().isoformat())
+        )
+        _invalidate_on_commit("categories", user_id)
+        return cursor.lastrowid
 
 
+@retrying_write
 def delete_category(cat_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT user_id FROM categories WHERE id = ?", (cat_id,)).fetchone()
+        conn.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
+        if row:
+            _invalidate_on_commit("categories", row["user_id"])
 
 
 # ─── Transactions (per user) ───
 
+_UNDECODED = object()
+# Keys every row has even when the query did not select them, as plain dict rows always had
+_ROW_DEFAULTS = {"articles": None, "type": "depense"}
+
+
+class Transaction(Mapping):
+    """Read-only, dict-like transaction row.
+
+    Holds the raw row tuple plus a column index shared by every row of the
+    query, instead of one dict per row. `articles` JSON is decoded on first
+    access only, since most pages never read it. `articles` (a list) and
+    `type` are always there, defaulted when the query did not select them.
+    """
+    __slots__ = ("_values", "_index", "_articles")
+
+    def __init__(self, values: tuple, index: dict):
+        self._values = values
+        self._index = index
+        self._articles = _UNDECODED
+
+    def __getitem__(self, key):
+        i = self._index[key]
+        if key == "articles":
+            if self._articles is _UNDECODED:
+                self._articles = _decode_articles(None if i is None else self._values[i])
+            return self._articles
+        return _ROW_DEFAULTS[key] if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f"Transaction({dict(self)!r})"
+
+
+def _decode_articles(raw: str | None) -> list:
+    if not raw:
+        return []
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return []
+
+
+def _fetch_transactions(conn: sqlite3.Connection, sql: str, params) -> list[Transaction]:
+    cur = conn.cursor()
+    cur.row_factory = None  # plain tuples, the column index is built once per query
+    cur.execute(sql, params)
+    index = {d[0]: i for i, d in enumerate(cur.description)}
+    for key in _ROW_DEFAULTS:
+        index.setdefault(key, None)
+    return [Transaction(values, index) for values in cur.fetchall()]
+
+
+@retrying_write
 def insert_transaction(user_id: int, date: str, enseigne: str, montant_total: float,
                        categorie: str, chemin_image: str, articles: list,
                        txn_type: str = "depense", added_by: int | None = None) -> int:
-    conn = get_connection()
-    cursor = conn.execute(
-        """INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, added_by, created_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (user_id, date, enseigne, montant_total, categorie, chemin_image,
-         json.dumps(articles, ensure_ascii=False), txn_type, added_by, datetime.now().isoformat())
-    )
-    conn.commit()
-    tid = cursor.lastrowid
-    conn.close()
-    return tid
-
+    with connection() as conn:
+        cursor = conn.execute(
+            """INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, added_by, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, date, enseigne, montant_total, categorie, chemin_image,
+             json.dumps(articles, ensure_ascii=False), txn_type, added_by, datetime.now().isoformat())
+        )
+        return cursor.lastrowid
 
-def get_transactions_by_month(user_id: int, year: int, month: int) -> list[dict]:
-    month_str = f"{year}-{month:02d}"
-    conn = get_connection()
-    rows = conn.execute(
-        "SELECT * FROM transactions WHERE user_id = ? AND date LIKE ? ORDER BY date DESC",
-        (user_id, f"{month_str}%")
-    ).fetchall()
-    conn.close()
-    return [_row_to_dict(r) for r in rows]
 
+@retrying_write
+def insert_transactions_bulk(rows: list[dict], skip_existing: bool = False) -> list[int | None]:
+    """Insert many transactions in one transaction (one commit/fsync) and return their ids in order.
 
-def get_all_transactions(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("SELECT * FROM transactions WHERE user_id = ? ORDER BY date DESC", (user_id,)).fetchall()
-    conn.close()
-    return [_row_to_dict(r) for r in rows]
+    Each row takes the insert_transaction fields: user_id, date, enseigne, montant_total,
+    categorie and optionally chemin_image, articles, type, added_by, tags, sous_categorie, comment,
+    recurring_id and recurring_date. With `skip_existing`, a recurring occurrence that is
+    already there (re-applied since it was deleted) is skipped and its id is None.
+    """
+    if not rows:
+        return []
+    now = datetime.now().isoformat()
+    params = [
+        (r["user_id"], r["date"], r["enseigne"], r["montant_total"], r["categorie"], r.get("chemin_image", ""),
+         json.dumps(r.get("articles", []), ensure_ascii=False), r.get("type", "depense"), r.get("added_by"),
+         r.get("tags", ""), r.get("sous_categorie", ""), r.get("comment", ""), now,
+         r.get("recurring_id"), r.get("recurring_date"))
+        for r in rows
+    ]
+    sql = """INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, added_by, tags, sous_categorie, comment, created_at, recurring_id, recurring_date)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    with connection() as conn:
+        if skip_existing:
+            # Row by row: skipped rows leave gaps, so ids cannot be derived from the last one
+            cursors = [conn.execute(sql + " ON CONFLICT DO NOTHING", p) for p in params]
+            return [c.lastrowid if c.rowcount else None for c in cursors]
+        conn.executemany(sql, params)
+        # AUTOINCREMENT ids are consecutive while we hold the write lock
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last_id - len(params) + 1, last_id + 1))
+
+
+def get_transactions_by_month(user_id: int, year: int, month: int,
+                              columns: list[str] | None = None) -> list[Transaction]:
+    return get_transactions_in_period(user_id, *month_bounds(year, month), columns=columns)
+
+
+def get_all_transactions(user_id: int, columns: list[str] | None = None) -> list[Transaction]:
+    with connection() as conn:
+        return _fetch_transactions(
+            conn, f"SELECT {_select_columns(columns)} FROM transactions WHERE user_id = ? ORDER BY date DESC", (user_id,))
+
+
+def get_active_years(user_id: int) -> list[str]:
+    """Years that have at least one transaction, oldest first.
+    Skip-scans the (user_id, date) index: one MIN() lookup per year, never the rows themselves."""
+    with connection() as conn:
+        rows = conn.execute("""
+            WITH RECURSIVE years(y) AS (
+                SELECT substr(MIN(date), 1, 4) FROM transactions WHERE user_id = ?
+                UNION ALL
+                SELECT (SELECT substr(MIN(date), 1, 4) FROM transactions
+                        WHERE user_id = ? AND date >= printf('%04d-01-01', y + 1))
+                FROM years WHERE y IS NOT NULL
+            )
+            SELECT y FROM years WHERE y IS NOT NULL
+        """, (user_id, user_id)).fetchall()
+    return [r["y"] for r in rows]
 
 
 def get_monthly_totals(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("""
-        SELECT substr(date, 1, 7) as mois,
-               SUM(CASE WHEN type = 'depense' THEN montant_total ELSE 0 END) as depenses,
-               SUM(CASE WHEN type = 'revenu' THEN montant_total ELSE 0 END) as revenus
-        FROM transactions WHERE user_id = ?
-        GROUP BY mois ORDER BY mois
-    """, (user_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT mois,
+                   SUM(CASE WHEN type = 'depense' THEN total ELSE 0 END) as depenses,
+                   SUM(CASE WHEN type = 'revenu' THEN total ELSE 0 END) as revenus
+            FROM monthly_totals WHERE user_id = ?
+            GROUP BY mois ORDER BY mois
+        """, (user_id,)).fetchall()
     return [{"mois": r["mois"], "depenses": r["depenses"], "revenus": r["revenus"]} for r in rows]
 
 
+@retrying_write
 def delete_transaction(transaction_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+
+
+@retrying_write
+def delete_transactions(transaction_ids: list[int]):
+    with connection() as conn:
+        conn.executemany("DELETE FROM transactions WHERE id = ?", [(tid,) for tid in transaction_ids])
 
 
 def get_unique_enseignes(user_id: int) -> list[str]:
-    conn = get_connection()
-    rows = conn.execute(
-        "SELECT DISTINCT enseigne FROM transactions WHERE user_id = ? ORDER BY enseigne",
-        (user_id,)
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT enseigne FROM transactions WHERE user_id = ? ORDER BY enseigne",
+            (user_id,)
+        ).fetchall()
     return [r["enseigne"] for r in rows]
 
 
+@retrying_write
 def duplicate_transaction(txn_id: int) -> int | None:
-    conn = get_connection()
-    row = conn.execute("SELECT * FROM transactions WHERE id = ?", (txn_id,)).fetchone()
-    if not row:
-        conn.close()
-        return None
-    t = dict(row)
-    cursor = conn.execute(
-        """INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, added_by, tags, sous_categorie, comment, created_at)
-           VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-        (t["user_id"], date.today().strftime("%Y-%m-%d"), t["enseigne"], t["montant_total"],
-         t["categorie"], t.get("chemin_image", ""), t.get("articles", "[]") if isinstance(t.get("articles"), str) else json.dumps(t.get("articles", [])),
-         t.get("type", "depense"), t.get("added_by"), t.get("tags", ""), t.get("sous_categorie", ""),
-         t.get("comment", ""), datetime.now().isoformat())
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
-    return new_id
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM transactions WHERE id = ?", (txn_id,)).fetchone()
+        if not row:
+            return None
+        t = dict(row)
+        cursor = conn.execute(
+            """INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, added_by, tags, sous_categorie, comment, created_at)
+               VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+            (t["user_id"], date.today().strftime("%Y-%m-%d"), t["enseigne"], t["montant_total"],
+             t["categorie"], t.get("chemin_image", ""), t.get("articles", "[]") if isinstance(t.get("articles"), str) else json.dumps(t.get("articles", [])),
+             t.get("type", "depense"), t.get("added_by"), t.get("tags", ""), t.get("sous_categorie", ""),
+             t.get("comment", ""), datetime.now().isoformat())
+        )
+        return cursor.lastrowid
 
 
+@retrying_write
 def update_user_preference(user_id: int, key: str, value: str):
-    conn = get_connection()
-    conn.execute(f"UPDATE users SET {key} = ? WHERE id = ?", (value, user_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(f"UPDATE users SET {key} = ? WHERE id = ?", (value, user_id))
+        _invalidate_on_commit("users", user_id)
+        _invalidate_on_commit("friends")  # friend lists embed display_name/avatar
 
 
 # ─── Recurring (per user) ───
 
+@retrying_write
 def insert_recurring(user_id: int, enseigne: str, montant: float, categorie: str,
                      txn_type: str, frequence: str, jour: int) -> int:
-    conn = get_connection()
-    cursor = conn.execute(
-        """INSERT INTO recurring (user_id, enseigne, montant, categorie, type, frequence, jour, actif, created_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)""",
-        (user_id, enseigne, montant, categorie, txn_type, frequence, jour, datetime.now().isoformat())
-    )
-    conn.commit()
-    rid = cursor.lastrowid
-    conn.close()
-    return rid
+    with connection() as conn:
+        cursor = conn.execute(
+            """INSERT INTO recurring (user_id, enseigne, montant, categorie, type, frequence, jour, actif, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)""",
+            (user_id, enseigne, montant, categorie, txn_type, frequence, jour, datetime.now().isoformat())
+        )
+        return cursor.lastrowid
 
 
 def get_all_recurring(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("SELECT * FROM recurring WHERE user_id = ? AND actif = 1 ORDER BY id", (user_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("SELECT * FROM recurring WHERE user_id = ? AND actif = 1 ORDER BY id", (user_id,)).fetchall()
     return [dict(r) for r in rows]
 
 
+@retrying_write
 def delete_recurring(recurring_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM recurring WHERE id = ?", (recurring_id,))
-    conn.commit()
-    conn.close()
-
-
-def apply_recurring_for_month(user_id: int, year: int, month: int):
-    import calendar
-    recurrings = get_all_recurring(user_id)
-    if not recurrings:
+    with connection() as conn:
+        conn.execute("DELETE FROM recurring WHERE id = ?", (recurring_id,))
+
+
+def recurring_dates(rec: dict, start: date, end: date) -> list[date]:
+    """Occurrences of a recurrence from start to end, both included, without walking every day."""
+    dates = []
+    if rec["frequence"] == "mensuel":
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            d = date(year, month, min(rec["jour"], calendar.monthrange(year, month)[1]))
+            if start <= d <= end:
+                dates.append(d)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    elif rec["frequence"] == "hebdomadaire":
+        d = start + timedelta(days=(rec["jour"] - start.weekday()) % 7)
+        while d <= end:
+            dates.append(d)
+            d += timedelta(days=7)
+    return dates
+
+
+def _materialize_recurring(conn: sqlite3.Connection, occurrences: list[tuple[int, date]]) -> int:
+    """Insert the (recurrence id, day) occurrences that are not there yet, all in one statement.
+
+    The unique (recurring_id, recurring_date) index turns an occurrence inserted by a
+    concurrent session into a no-op. A plain row with the same identity on that day
+    (entered by hand, or linked before the recurrence existed) also counts as done.
+    """
+    if not occurrences:
         return 0
-    conn = get_connection()
-    count = 0
-    _, last_day = calendar.monthrange(year, month)
-    for rec in recurrings:
-        dates = []
-        if rec["frequence"] == "mensuel":
-            d = date(year, month, min(rec["jour"], last_day))
-            if d <= date.today(): dates.append(d)
-        elif rec["frequence"] == "hebdomadaire":
-            d = date(year, month, 1)
-            while d.month == month:
-                if d.weekday() == rec["jour"] and d <= date.today(): dates.append(d)
-                d += timedelta(days=1)
-        for d in dates:
-            ds = d.strftime("%Y-%m-%d")
-            ex = conn.execute(
-                "SELECT id FROM transactions WHERE user_id=? AND date=? AND enseigne=? AND montant_total=? AND type=?",
-                (user_id, ds, rec["enseigne"], rec["montant"], rec["type"])
-            ).fetchone()
-            if not ex:
-                conn.execute(
-                    "INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type, created_at) VALUES (?,?,?,?,?,'','[]',?,?)",
-                    (user_id, ds, rec["enseigne"], rec["montant"], rec["categorie"], rec["type"], datetime.now().isoformat())
-                )
-                count += 1
-    conn.commit()
-    conn.close()
+    cursor = conn.execute(
+        """INSERT INTO transactions (user_id, date, enseigne, montant_total, categorie, chemin_image, articles, type,
+                                     created_at, recurring_id, recurring_date)
+           SELECT r.user_id, o.day, r.enseigne, r.montant, r.categorie, '', '[]', r.type, ?, r.id, o.day
+           FROM (SELECT json_extract(value, '$[0]') AS rec_id, json_extract(value, '$[1]') AS day
+                 FROM json_each(?)) AS o
+           JOIN recurring r ON r.id = o.rec_id
+           WHERE NOT EXISTS (
+               SELECT 1 FROM transactions t
+               WHERE t.user_id = r.user_id AND t.date = o.day AND t.enseigne = r.enseigne
+                 AND t.montant_total = r.montant AND t.type = r.type AND t.recurring_id IS NULL
+           )
+           ON CONFLICT DO NOTHING""",
+        (datetime.now().isoformat(), json.dumps([[rec_id, d.isoformat()] for rec_id, d in occurrences]))
+    )
+    return cursor.rowcount
+
+
+@retrying_write
+def apply_due_recurring(user_id: int | None = None, today: date | None = None) -> int:
+    """Materialise every occurrence due up to today, for one user or all, and return how many were added.
+
+    Each recurrence resumes after its last_applied watermark; one never applied yet
+    starts at the first of the current month.
+    """
+    today = today or date.today()
+    sql = "SELECT * FROM recurring WHERE actif = 1 AND (last_applied IS NULL OR last_applied < ?)"
+    params = [today.isoformat()]
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params.append(user_id)
+    with connection() as conn:
+        recurrings = [dict(r) for r in conn.execute(sql, params).fetchall()]
+        occurrences = []
+        for rec in recurrings:
+            start = (date.fromisoformat(rec["last_applied"]) + timedelta(days=1) if rec["last_applied"]
+                     else today.replace(day=1))
+            occurrences += [(rec["id"], d) for d in recurring_dates(rec, start, today)]
+        count = _materialize_recurring(conn, occurrences)
+        conn.executemany("UPDATE recurring SET last_applied = ? WHERE id = ?",
+                         [(today.isoformat(), rec["id"]) for rec in recurrings])
     return count
 
 
-def _row_to_dict(row: sqlite3.Row) -> dict:
-    d = dict(row)
-    if d.get("articles"):
-        try: d["articles"] = json.loads(d["articles"])
-        except json.JSONDecodeError: d["articles"] = []
-    else:
-        d["articles"] = []
-    if "type" not in d: d["type"] = "depense"
-    return d
+@retrying_write
+def apply_recurring_for_month(user_id: int, year: int, month: int) -> int:
+    """Materialise one month's occurrences up to today, whatever the watermarks say."""
+    start = date(year, month, 1)
+    end = min(date(year, month, calendar.monthrange(year, month)[1]), date.today())
+    with connection() as conn:
+        return _materialize_recurring(conn, [(rec["id"], d) for rec in get_all_recurring(user_id)
+                                             for d in recurring_dates(rec, start, end)])
 
 
 # ─── Budgets ───
 
+@retrying_write
 def set_budget(user_id: int, categorie: str, montant_max: float):
-    conn = get_connection()
-    conn.execute(
-        "INSERT INTO budgets (user_id, categorie, montant_max, created_at) VALUES (?, ?, ?, ?) "
-        "ON CONFLICT(user_id, categorie) DO UPDATE SET montant_max = ?",
-        (user_id, categorie, montant_max, datetime.now().isoformat(), montant_max)
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            "INSERT INTO budgets (user_id, categorie, montant_max, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, categorie) DO UPDATE SET montant_max = ?",
+            (user_id, categorie, montant_max, datetime.now().isoformat(), montant_max)
+        )
+        _invalidate_on_commit("budgets", user_id)
 
 
+@cached_query("budgets")
 def get_budgets(user_id: int) -> dict:
-    conn = get_connection()
-    rows = conn.execute("SELECT categorie, montant_max FROM budgets WHERE user_id = ?", (user_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("SELECT categorie, montant_max FROM budgets WHERE user_id = ?", (user_id,)).fetchall()
     return {r["categorie"]: r["montant_max"] for r in rows}
 
 
+@retrying_write
 def delete_budget(user_id: int, categorie: str):
-    conn = get_connection()
-    conn.execute("DELETE FROM budgets WHERE user_id = ? AND categorie = ?", (user_id, categorie))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM budgets WHERE user_id = ? AND categorie = ?", (user_id, categorie))
+        _invalidate_on_commit("budgets", user_id)
 
 
 # ─── Edit Transaction ───
 
+@retrying_write
 def update_transaction(txn_id: int, date: str, enseigne: str, montant_total: float,
                        categorie: str, txn_type: str, tags: str = "", sous_categorie: str = ""):
-    conn = get_connection()
-    conn.execute(
-        """UPDATE transactions SET date=?, enseigne=?, montant_total=?, categorie=?, type=?, tags=?, sous_categorie=?
-           WHERE id=?""",
-        (date, enseigne, montant_total, categorie, txn_type, tags, sous_categorie, txn_id)
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            """UPDATE transactions SET date=?, enseigne=?, montant_total=?, categorie=?, type=?, tags=?, sous_categorie=?
+               WHERE id=?""",
+            (date, enseigne, montant_total, categorie, txn_type, tags, sous_categorie, txn_id)
+        )
 
 
-def get_transaction_by_id(txn_id: int) -> dict | None:
-    conn = get_connection()
-    row = conn.execute("SELECT * FROM transactions WHERE id = ?", (txn_id,)).fetchone()
-    conn.close()
-    return _row_to_dict(row) if row else None
+def get_transaction_by_id(txn_id: int) -> Transaction | None:
+    with connection() as conn:
+        rows = _fetch_transactions(conn, "SELECT * FROM transactions WHERE id = ?", (txn_id,))
+    return rows[0] if rows else None
 
 
 # ─── Search ───
 
-def search_transactions(user_id: int, query: str, limit: int = 100) -> list[dict]:
-    conn = get_connection()
+def search_transactions(user_id: int, query: str, limit: int = 100,
+                        columns: list[str] | None = None) -> list[Transaction]:
     q = f"%{query}%"
-    rows = conn.execute(
-        """SELECT * FROM transactions WHERE user_id = ?
-           AND (enseigne LIKE ? OR categorie LIKE ? OR tags LIKE ? OR sous_categorie LIKE ?)
-           ORDER BY date DESC LIMIT ?""",
-        (user_id, q, q, q, q, limit)
-    ).fetchall()
-    conn.close()
-    return [_row_to_dict(r) for r in rows]
+    with connection() as conn:
+        return _fetch_transactions(
+            conn,
+            f"""SELECT {_select_columns(columns)} FROM transactions WHERE user_id = ?
+                AND (enseigne LIKE ? OR categorie LIKE ? OR tags LIKE ? OR sous_categorie LIKE ?)
+                ORDER BY date DESC LIMIT ?""",
+            (user_id, q, q, q, q, limit)
+        )
 
 
 # ─── Multi-month ───
 
-def get_transactions_by_range(user_id: int, date_from: str, date_to: str) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute(
-        "SELECT * FROM transactions WHERE user_id = ? AND date >= ? AND date <= ? ORDER BY date DESC",
-        (user_id, date_from, date_to)
-    ).fetchall()
-    conn.close()
-    return [_row_to_dict(r) for r in rows]
+TRANSACTION_COLUMNS = ("id", "user_id", "date", "enseigne", "montant_total", "categorie", "chemin_image",
+                       "articles", "type", "added_by", "created_at", "tags", "sous_categorie", "comment")
+# Everything the list views display; leaves out the receipt payload (articles JSON, image path)
+SUMMARY_COLUMNS = tuple(c for c in TRANSACTION_COLUMNS if c not in ("articles", "chemin_image"))
+
+
+def month_bounds(year: int, month: int) -> tuple[str, str]:
+    """First day of the month and first day of the next one, for half-open date ranges."""
+    ny, nm = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year}-{month:02d}-01", f"{ny}-{nm:02d}-01"
+
+
+def _select_columns(columns: list[str] | None) -> str:
+    if not columns:
+        return "*"
+    unknown = set(columns) - set(TRANSACTION_COLUMNS)
+    if unknown:
+        raise ValueError(f"Colonnes inconnues : {', '.join(sorted(unknown))}")
+    return ", ".join(columns)
+
+
+def get_transactions_in_period(user_id: int, date_from: str, date_before: str,
+                               columns: list[str] | None = None) -> list[Transaction]:
+    """Transactions with date_from <= date < date_before, newest first.
+    `columns` restricts the SELECT (e.g. skip `articles` when only amounts are needed)."""
+    with connection() as conn:
+        return _fetch_transactions(
+            conn,
+            f"SELECT {_select_columns(columns)} FROM transactions WHERE user_id = ? AND date >= ? AND date < ? ORDER BY date DESC",
+            (user_id, date_from, date_before)
+        )
+
+
+def get_transactions_by_range(user_id: int, date_from: str, date_to: str,
+                              columns: list[str] | None = None) -> list[Transaction]:
+    """Inclusive range on both ends."""
+    day_after = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+    return get_transactions_in_period(user_id, date_from, day_after, columns=columns)
+
+
+# ─── Aggregates ───
+# Read from the trigger-maintained *_totals tables: cost grows with months/enseignes, not transactions.
+
+def get_category_totals(user_id: int, mois_from: str | None = None, mois_to: str | None = None,
+                        txn_type: str = "depense") -> dict:
+    """{categorie: total} over the inclusive 'YYYY-MM' range (whole history if omitted)."""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT categorie, SUM(total) as total FROM monthly_totals
+            WHERE user_id = ? AND type = ? AND mois >= ? AND mois <= ?
+            GROUP BY categorie
+        """, (user_id, txn_type, mois_from or "0000-00", mois_to or "9999-99")).fetchall()
+    return {r["categorie"]: r["total"] for r in rows}
+
+
+def get_category_monthly_totals(user_id: int, year: str | None = None, txn_type: str = "depense") -> list[dict]:
+    """Rows of {mois, categorie, total}, optionally for one year."""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT mois, categorie, total FROM monthly_totals
+            WHERE user_id = ? AND type = ? AND mois >= ? AND mois <= ?
+            ORDER BY mois
+        """, (user_id, txn_type, f"{year}-01" if year else "0000-00", f"{year}-12" if year else "9999-99")).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_enseigne_totals(user_id: int, year: str | None = None, txn_type: str = "depense",
+                        limit: int | None = None) -> list[dict]:
+    """Rows of {enseigne, total, nb}, biggest total first."""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT enseigne, SUM(total) as total, SUM(nb) as nb FROM enseigne_totals
+            WHERE user_id = ? AND type = ? AND (? IS NULL OR annee = ?)
+            GROUP BY enseigne ORDER BY total DESC LIMIT ?
+        """, (user_id, txn_type, year, year, limit if limit is not None else -1)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_weekday_totals(user_id: int, year: str | None = None, txn_type: str = "depense") -> dict:
+    """{jour_semaine (0 = lundi): {"total", "nb"}}."""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT jour_semaine, SUM(total) as total, SUM(nb) as nb FROM weekday_totals
+            WHERE user_id = ? AND type = ? AND (? IS NULL OR annee = ?) AND jour_semaine >= 0
+            GROUP BY jour_semaine
+        """, (user_id, txn_type, year, year)).fetchall()
+    return {r["jour_semaine"]: {"total": r["total"], "nb": r["nb"]} for r in rows}
+
+
+def get_activity_summary(user_id: int) -> dict:
+    """Lifetime counters used by the Badges page."""
+    with connection() as conn:
+        m = conn.execute("""
+            SELECT COALESCE(SUM(nb), 0) as nb,
+                   COALESCE(SUM(CASE WHEN type = 'depense' THEN total END), 0) as depenses,
+                   COALESCE(SUM(CASE WHEN type = 'revenu' THEN total END), 0) as revenus,
+                   COUNT(DISTINCT categorie) as categories,
+                   COUNT(DISTINCT mois) as mois
+            FROM monthly_totals WHERE user_id = ?
+        """, (user_id,)).fetchone()
+        enseignes = conn.execute(
+            "SELECT COUNT(DISTINCT enseigne) as c FROM enseigne_totals WHERE user_id = ?", (user_id,)
+        ).fetchone()["c"]
+    return {"total_txn": m["nb"], "total_dep": m["depenses"], "total_rev": m["revenus"],
+            "unique_cats": m["categories"], "months_active": m["mois"], "unique_enseignes": enseignes}
 
 
 # ─── Export ───
 
-def export_transactions_csv(user_id: int, year: int = None, month: int = None) -> str:
+EXPORT_CHUNK_ROWS = 5000
+
+
+def _iter_batches(sql: str, params, chunk_rows: int) -> Iterator[list[tuple]]:
+    """Run one SELECT and yield its rows as plain tuples, `chunk_rows` at a time.
+
+    Uses its own pooled connection rather than connection(): a half-consumed
+    generator must not leave its cursor bound to the thread's shared connection.
+    The rows come from a single statement, so they form a consistent snapshot.
+    """
+    conn = _acquire_connection()
+    cur = conn.cursor()
+    cur.row_factory = None
+    try:
+        cur.execute(sql, params)
+        while rows := cur.fetchmany(chunk_rows):
+            yield rows
+    finally:
+        cur.close()
+        _release_connection(conn)
+
+
+def iter_transactions_since(user_id: int, after_id: int = 0, columns=None,
+                            chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[list[tuple]]:
+    """Stream a user's transactions with id > after_id, ordered by date, in batches of tuples."""
+    return _iter_batches(
+        f"SELECT {_select_columns(columns)} FROM transactions WHERE user_id = ? AND id > ? ORDER BY date, id",
+        (user_id, after_id), chunk_rows)
+
+
+CSV_HEADER = ["Date", "Enseigne", "Montant", "Catégorie", "Sous-catégorie", "Type", "Tags"]
+
+
+def iter_transactions_csv(user_id: int, year: int = None, month: int = None,
+                          chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[str]:
+    """Stream a CSV export, one chunk of up to `chunk_rows` lines at a time.
+
+    Memory stays flat whatever the history size; feed it to a file with
+    `f.writelines(...)` or join it for an in-memory download.
+    """
+    sql = "SELECT date, enseigne, montant_total, categorie, sous_categorie, type, tags FROM transactions WHERE user_id = ?"
+    params = [user_id]
     if year and month:
-        txs = get_transactions_by_month(user_id, year, month)
-    else:
-        txs = get_all_transactions(user_id)
-    lines = ["Date,Enseigne,Montant,Catégorie,Sous-catégorie,Type,Tags"]
-    for t in txs:
-        tags = t.get("tags", "")
-        sc = t.get("sous_categorie", "")
-        ens = t["enseigne"].replace(",", ";")
-        lines.append(f'{t["date"]},{ens},{t["montant_total"]:.2f},{t["categorie"]},{sc},{t.get("type","depense")},{tags}')
-    return "\n".join(lines)
+        sql += " AND date >= ? AND date < ?"
+        params += month_bounds(year, month)
+    sql += " ORDER BY date DESC"
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+    yield buf.getvalue()
+
+    for rows in _iter_batches(sql, params, chunk_rows):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(
+            (d, ens, f"{mt:.2f}", cat, sc or "", typ or "depense", tags or "")
+            for d, ens, mt, cat, sc, typ, tags in rows
+        )
+        yield buf.getvalue()
+
+
+def export_transactions_csv(user_id: int, year: int = None, month: int = None) -> str:
+    return "".join(iter_transactions_csv(user_id, year, month))
+
+
+# ─── Import ───
+
+def transaction_identity(txn_date: str, enseigne: str, montant: float, txn_type: str) -> tuple:
+    """Key under which two transactions count as the same entry (see apply_recurring_for_month).
+
+    The amount is in integer cents, so stored and imported rows compare the same way.
+    """
+    return (txn_date, enseigne, round(montant * 100), txn_type)
+
+
+@retrying_write
+def insert_transactions_dedup(user_id: int, rows: list[dict], exclude: Counter = None) -> list[dict]:
+    """Bulk insert the rows of `rows` that are not already stored; return the inserted ones.
+
+    Matching is by transaction_identity and counts occurrences, so two identical
+    coffees on the same day in a statement are kept while re-importing the same
+    statement inserts nothing. `exclude` holds identities inserted earlier in the
+    same import, so they are not mistaken for pre-existing rows.
+    """
+    if not rows:
+        return []
+    dates = sorted({r["date"] for r in rows})
+    with connection() as conn:
+        # Keyed in Python: SQL ROUND() and round() can disagree on half cents
+        existing = Counter(
+            transaction_identity(d, ens, mt, typ) for d, ens, mt, typ in conn.execute(
+                """SELECT date, enseigne, montant_total, type FROM transactions
+                   WHERE user_id = ? AND date IN (SELECT value FROM json_each(?))""",
+                (user_id, json.dumps(dates)))
+        )
+        if exclude:
+            for key in existing:
+                existing[key] -= exclude.get(key, 0)
+        fresh = []
+        for r in rows:
+            key = transaction_identity(r["date"], r["enseigne"], r["montant_total"], r.get("type", "depense"))
+            if existing[key] > 0:
+                existing[key] -= 1
+            else:
+                fresh.append(r)
+        insert_transactions_bulk(fresh)
+    return fresh
 
 
 # ─── Debts ───
 
+@retrying_write
 def create_debt(from_user: int, to_user: int, montant: float, description: str, transaction_id: int = None):
-    conn = get_connection()
-    conn.execute(
-        "INSERT INTO debts (from_user, to_user, montant, description, settled, transaction_id, created_at) VALUES (?,?,?,?,0,?,?)",
-        (from_user, to_user, montant, description, transaction_id, datetime.now().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute(
+            "INSERT INTO debts (from_user, to_user, montant, description, settled, transaction_id, created_at) VALUES (?,?,?,?,0,?,?)",
+            (from_user, to_user, montant, description, transaction_id, datetime.now().isoformat())
+        )
 
 
+@retrying_write
 def settle_debt(debt_id: int):
-    conn = get_connection()
-    conn.execute("UPDATE debts SET settled = 1 WHERE id = ?", (debt_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("UPDATE debts SET settled = 1 WHERE id = ?", (debt_id,))
 
 
 def get_debts_between(user_a: int, user_b: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute(
-        """SELECT * FROM debts WHERE
-           ((from_user = ? AND to_user = ?) OR (from_user = ? AND to_user = ?))
-           ORDER BY created_at DESC""",
-        (user_a, user_b, user_b, user_a)
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """SELECT * FROM debts WHERE
+               ((from_user = ? AND to_user = ?) OR (from_user = ? AND to_user = ?))
+               ORDER BY created_at DESC""",
+            (user_a, user_b, user_b, user_a)
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_debt_balance(user_id: int, friend_id: int) -> float:
     """Positive = friend owes user, Negative = user owes friend."""
-    conn = get_connection()
-    owed_to_me = conn.execute(
-        "SELECT COALESCE(SUM(montant), 0) as s FROM debts WHERE from_user = ? AND to_user = ? AND settled = 0",
-        (friend_id, user_id)
-    ).fetchone()["s"]
-    i_owe = conn.execute(
-        "SELECT COALESCE(SUM(montant), 0) as s FROM debts WHERE from_user = ? AND to_user = ? AND settled = 0",
-        (user_id, friend_id)
-    ).fetchone()["s"]
-    conn.close()
+    with connection() as conn:
+        owed_to_me = conn.execute(
+            "SELECT COALESCE(SUM(montant), 0) as s FROM debts WHERE from_user = ? AND to_user = ? AND settled = 0",
+            (friend_id, user_id)
+        ).fetchone()["s"]
+        i_owe = conn.execute(
+            "SELECT COALESCE(SUM(montant), 0) as s FROM debts WHERE from_user = ? AND to_user = ? AND settled = 0",
+            (user_id, friend_id)
+        ).fetchone()["s"]
     return owed_to_me - i_owe
 
 
 def get_all_unsettled_debts(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute(
-        "SELECT * FROM debts WHERE (from_user = ? OR to_user = ?) AND settled = 0 ORDER BY created_at DESC",
-        (user_id, user_id)
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM debts WHERE (from_user = ? OR to_user = ?) AND settled = 0 ORDER BY created_at DESC",
+            (user_id, user_id)
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 # ─── Challenges ───
 
+@retrying_write
 def create_challenge(creator_id: int, title: str, categorie: str, montant_max: float,
                      date_debut: str, date_fin: str) -> int:
-    conn = get_connection()
-    cursor = conn.execute(
-        "INSERT INTO challenges (creator_id, title, categorie, montant_max, date_debut, date_fin, actif, created_at) VALUES (?,?,?,?,?,?,1,?)",
-        (creator_id, title, categorie, montant_max, date_debut, date_fin, datetime.now().isoformat())
-    )
-    conn.commit()
-    cid = cursor.lastrowid
-    conn.execute("INSERT INTO challenge_participants (challenge_id, user_id) VALUES (?, ?)", (cid, creator_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO challenges (creator_id, title, categorie, montant_max, date_debut, date_fin, actif, created_at) VALUES (?,?,?,?,?,?,1,?)",
+            (creator_id, title, categorie, montant_max, date_debut, date_fin, datetime.now().isoformat())
+        )
+        cid = cursor.lastrowid
+        conn.execute("INSERT INTO challenge_participants (challenge_id, user_id) VALUES (?, ?)", (cid, creator_id))
     return cid
 
 
+@retrying_write
 def join_challenge(challenge_id: int, user_id: int):
-    conn = get_connection()
-    conn.execute("INSERT OR IGNORE INTO challenge_participants (challenge_id, user_id) VALUES (?, ?)",
-                 (challenge_id, user_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO challenge_participants (challenge_id, user_id) VALUES (?, ?)",
+                     (challenge_id, user_id))
 
 
 def get_active_challenges(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("""
-        SELECT c.* FROM challenges c
-        JOIN challenge_participants cp ON cp.challenge_id = c.id
-        WHERE cp.user_id = ? AND c.actif = 1
-        ORDER BY c.date_fin
-    """, (user_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT c.* FROM challenges c
+            JOIN challenge_participants cp ON cp.challenge_id = c.id
+            WHERE cp.user_id = ? AND c.actif = 1
+            ORDER BY c.date_fin
+        """, (user_id,)).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_challenge_participants(challenge_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("""
-        SELECT u.id, u.username, u.display_name, u.avatar FROM challenge_participants cp
-        JOIN users u ON u.id = cp.user_id
-        WHERE cp.challenge_id = ?
-    """, (challenge_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT u.id, u.username, u.display_name, u.avatar FROM challenge_participants cp
+            JOIN users u ON u.id = cp.user_id
+            WHERE cp.challenge_id = ?
+        """, (challenge_id,)).fetchall()
     return [dict(r) for r in rows]
 
 
-def get_challenge_scores(challenge_id: int) -> list[dict]:
-    conn = get_connection()
-    ch = conn.execute("SELECT * FROM challenges WHERE id = ?", (challenge_id,)).fetchone()
-    if not ch:
-        conn.close()
-        return []
-    ch = dict(ch)
-    participants = get_challenge_participants(challenge_id)
-    scores = []
-    for p in participants:
-        cat_filter = "AND categorie = ?" if ch["categorie"] else ""
-        params = [p["id"], ch["date_debut"], ch["date_fin"]]
-        if ch["categorie"]:
-            params.append(ch["categorie"])
-        total = conn.execute(
-            f"SELECT COALESCE(SUM(montant_total), 0) as s FROM transactions WHERE user_id=? AND date>=? AND date<=? AND type='depense' {cat_filter}",
-            params
-        ).fetchone()["s"]
-        scores.append({**p, "total": total, "max": ch["montant_max"]})
-    conn.close()
-    scores.sort(key=lambda x: x["total"])
+def _challenge_scores(conn: sqlite3.Connection, where: str, params: tuple) -> dict[int, list[dict]]:
+    """Spending of every participant of the challenges matching `where` (over alias c), in one
+    query: challenge id -> participants sorted by total, lowest first."""
+    # Per-participant sums as correlated subqueries rather than LEFT JOIN + GROUP BY: each
+    # one is an index range sum, on (user_id, type, date) or on (user_id, categorie, date)
+    # for a one-category challenge, with no joined rows to aggregate afterwards.
+    rows = conn.execute(f"""
+        SELECT c.id AS challenge_id, c.montant_max, u.id, u.username, u.display_name, u.avatar,
+               CASE WHEN COALESCE(c.categorie, '') = '' THEN (
+                   SELECT COALESCE(SUM(t.montant_total), 0) FROM transactions t
+                   WHERE t.user_id = cp.user_id AND t.type = 'depense'
+                     AND t.date >= c.date_debut AND t.date <= c.date_fin)
+               ELSE (
+                   SELECT COALESCE(SUM(t.montant_total), 0) FROM transactions t
+                   WHERE t.user_id = cp.user_id AND t.categorie = c.categorie
+                     AND t.date >= c.date_debut AND t.date <= c.date_fin AND t.type = 'depense')
+               END AS total
+        FROM challenges c
+        JOIN challenge_participants cp ON cp.challenge_id = c.id
+        JOIN users u ON u.id = cp.user_id
+        WHERE {where}
+        ORDER BY c.id, total, cp.id
+    """, params).fetchall()
+    scores = {}
+    for r in rows:
+        scores.setdefault(r["challenge_id"], []).append({
+            "id": r["id"], "username": r["username"], "display_name": r["display_name"], "avatar": r["avatar"],
+            "total": r["total"], "max": r["montant_max"],
+        })
     return scores
 
 
+def get_challenge_scores(challenge_id: int) -> list[dict]:
+    with connection() as conn:
+        return _challenge_scores(conn, "c.id = ?", (challenge_id,)).get(challenge_id, [])
+
+
+def get_challenge_leaderboards(user_id: int) -> dict[int, list[dict]]:
+    """Scores of every active challenge user_id takes part in, keyed by challenge id (see get_challenge_scores)."""
+    with connection() as conn:
+        return _challenge_scores(conn, """c.actif = 1 AND c.id IN (
+            SELECT challenge_id FROM challenge_participants WHERE user_id = ?)""", (user_id,))
+
+
+@retrying_write
 def delete_challenge(challenge_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM challenge_participants WHERE challenge_id = ?", (challenge_id,))
-    conn.execute("DELETE FROM challenges WHERE id = ?", (challenge_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM challenge_participants WHERE challenge_id = ?", (challenge_id,))
+        conn.execute("DELETE FROM challenges WHERE id = ?", (challenge_id,))
 
 
 # ─── Savings Goals ───
 
+@retrying_write
 def create_savings_goal(user_id: int, title: str, target_amount: float) -> int:
-    conn = get_connection()
-    cursor = conn.execute(
-        "INSERT INTO savings_goals (user_id, title, target_amount, current_amount, created_at) VALUES (?,?,?,0,?)",
-        (user_id, title, target_amount, datetime.now().isoformat())
-    )
-    conn.commit()
-    gid = cursor.lastrowid
-    conn.close()
-    return gid
+    with connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO savings_goals (user_id, title, target_amount, current_amount, created_at) VALUES (?,?,?,0,?)",
+            (user_id, title, target_amount, datetime.now().isoformat())
+        )
+        return cursor.lastrowid
 
 
+@retrying_write
 def update_savings_goal(goal_id: int, current_amount: float):
-    conn = get_connection()
-    conn.execute("UPDATE savings_goals SET current_amount = ? WHERE id = ?", (current_amount, goal_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("UPDATE savings_goals SET current_amount = ? WHERE id = ?", (current_amount, goal_id))
 
 
 def get_savings_goals(user_id: int) -> list[dict]:
-    conn = get_connection()
-    rows = conn.execute("SELECT * FROM savings_goals WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("SELECT * FROM savings_goals WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
     return [dict(r) for r in rows]
 
 
+@retrying_write
 def delete_savings_goal(goal_id: int):
-    conn = get_connection()
-    conn.execute("DELETE FROM savings_goals WHERE id = ?", (goal_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM savings_goals WHERE id = ?", (goal_id,))
 
 
 # ─── Smart Budget ───
 
 def get_smart_budget_info(user_id: int, year: int, month: int) -> dict:
     """Calculate daily allowance based on total budget, days passed, and spending so far."""
-    import calendar
     budgets = get_budgets(user_id)
     total_budget = sum(budgets.values())
     if total_budget <= 0:
@@ -827,7 +1554,7 @@ def get_smart_budget_info(user_id: int, year: int, month: int) -> dict:
     days_elapsed = day_of_month
 
     # Get spending so far this month
-    txs = get_transactions_by_month(user_id, year, month)
+    txs = get_transactions_by_month(user_id, year, month, columns=["date", "montant_total", "type"])
     spent = sum(t["montant_total"] for t in txs if t.get("type", "depense") == "depense")
 
     remaining = total_budget - spent
@@ -867,3 +1594,217 @@ def get_smart_budget_info(user_id: int, year: int, month: int) -> dict:
         "message": message,
     }
 
+
+# ─── Analysis cache ───
+# Content-addressed results of the receipt pipeline (OCR text per image hash, Gemini
+# answer per OCR text + categories), shared by all users and kept across restarts.
+# Least recently used entries are evicted beyond ANALYSIS_CACHE_MAX_BYTES.
+
+ANALYSIS_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+_analysis_stats = {"hits": 0, "misses": 0, "stores": 0}
+_analysis_stats_lock = threading.Lock()
+
+
+def _count_analysis(event: str):
+    with _analysis_stats_lock:
+        _analysis_stats[event] += 1
+
+
+def get_cached_analysis(key: str) -> str | None:
+    with connection() as conn:
+        row = conn.execute("SELECT value FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+    _count_analysis("hits" if row else "misses")
+    if row is None:
+        return None
+    _touch_cached_analysis(key)
+    return row["value"]
+
+
+@retrying_write
+def _touch_cached_analysis(key: str):
+    with connection() as conn:
+        conn.execute("UPDATE analysis_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+
+
+@retrying_write
+def store_cached_analysis(key: str, kind: str, value: str):
+    size = len(value.encode("utf-8"))
+    with connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_cache (key, kind, value, size, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+            (key, kind, value, size, datetime.now().isoformat(), time.time())
+        )
+        # Keep the most recently used entries that fit in the budget
+        conn.execute("""
+            DELETE FROM analysis_cache WHERE key IN (
+                SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running FROM analysis_cache)
+                WHERE running > ?)
+        """, (ANALYSIS_CACHE_MAX_BYTES,))
+    _count_analysis("stores")
+
+
+def get_analysis_cache_stats() -> dict:
+    """Process counters (hits, misses, stores) plus what the table holds per kind."""
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT kind, COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes, COALESCE(SUM(hits), 0) AS hits "
+            "FROM analysis_cache GROUP BY kind"
+        ).fetchall()
+    with _analysis_stats_lock:
+        stats = dict(_analysis_stats)
+    stats["kinds"] = {r["kind"]: {"entries": r["entries"], "bytes": r["bytes"], "hits": r["hits"]} for r in rows}
+    stats["entries"] = sum(k["entries"] for k in stats["kinds"].values())
+    stats["bytes"] = sum(k["bytes"] for k in stats["kinds"].values())
+    stats["max_bytes"] = ANALYSIS_CACHE_MAX_BYTES
+    return stats
+
+
+@retrying_write
+def clear_analysis_cache(kind: str = None):
+    with connection() as conn:
+        if kind:
+            conn.execute("DELETE FROM analysis_cache WHERE kind = ?", (kind,))
+        else:
+            conn.execute("DELETE FROM analysis_cache")
+
+
+# ─── Analysis jobs ───
+# Receipt analyses run in the background (see jobs.py). A job moves
+# pending → running → done | failed, or to cancelled at any point before it ends;
+# a retryable failure puts it back to pending with a later run_after.
+# Images are kept only until the job ends.
+
+JOB_ACTIVE = ("pending", "running")
+
+
+def _job_row(row) -> dict | None:
+    if row is None:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["failures"] = json.loads(job["failures"]) if job["failures"] else []
+    return job
+
+
+@retrying_write
+def create_analysis_job(user_id: int, images: list[tuple[bytes, str]], max_attempts: int = 3) -> int:
+    with connection() as conn:
+        cur = conn.execute(
+            "INSERT INTO analysis_jobs (user_id, max_attempts, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (user_id, max_attempts, datetime.now().isoformat(), time.time())
+        )
+        job_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO analysis_job_images (job_id, position, data, mime) VALUES (?, ?, ?, ?)",
+            [(job_id, i, data, mime) for i, (data, mime) in enumerate(images)]
+        )
+    return job_id
+
+
+@retrying_write
+def claim_analysis_job(job_id: int) -> bool:
+    """Move a due pending job to running; False if it was cancelled, taken or is not due yet."""
+    now = time.time()
+    with connection() as conn:
+        cur = conn.execute(
+            "UPDATE analysis_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ? AND status = 'pending' AND run_after <= ?",
+            (now, job_id, now)
+        )
+    return cur.rowcount == 1
+
+
+def get_analysis_job(job_id: int) -> dict | None:
+    with connection() as conn:
+        return _job_row(conn.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def get_analysis_job_images(job_id: int) -> list[tuple[bytes, str]]:
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT data, mime FROM analysis_job_images WHERE job_id = ? ORDER BY position", (job_id,)
+        ).fetchall()
+    return [(r["data"], r["mime"]) for r in rows]
+
+
+def get_latest_analysis_job(user_id: int) -> dict | None:
+    """The user's most recent job that is still running or whose result was not picked up yet."""
+    with connection() as conn:
+        return _job_row(conn.execute(
+            "SELECT * FROM analysis_jobs WHERE user_id = ? AND consumed = 0 ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone())
+
+
+def _end_analysis_job(conn: sqlite3.Connection, job_id: int, status: str, **fields):
+    sets = ", ".join(f"{k} = ?" for k in fields)
+    cur = conn.execute(
+        f"UPDATE analysis_jobs SET status = ?, updated_at = ?{', ' + sets if sets else ''} "
+        f"WHERE id = ? AND status = 'running'",
+        (status, time.time(), *fields.values(), job_id)
+    )
+    if cur.rowcount:
+        conn.execute("DELETE FROM analysis_job_images WHERE job_id = ?", (job_id,))
+    return cur.rowcount == 1
+
+
+@retrying_write
+def finish_analysis_job(job_id: int, result: list[dict], failures: list) -> bool:
+    """Store the result; False if the job was cancelled meanwhile (the result is dropped)."""
+    with connection() as conn:
+        return _end_analysis_job(conn, job_id, "done", result=json.dumps(result, ensure_ascii=False),
+                                 failures=json.dumps(failures, ensure_ascii=False), error=None)
+
+
+@retrying_write
+def fail_analysis_job(job_id: int, error: str, retry_in: float = None) -> bool:
+    """Record an error; with retry_in (seconds), put the job back in the queue instead of failing it."""
+    with connection() as conn:
+        if retry_in is not None:
+            cur = conn.execute(
+                "UPDATE analysis_jobs SET status = 'pending', error = ?, run_after = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running'",
+                (error, time.time() + retry_in, time.time(), job_id)
+            )
+            return cur.rowcount == 1
+        return _end_analysis_job(conn, job_id, "failed", error=error)
+
+
+@retrying_write
+def cancel_analysis_job(job_id: int, user_id: int) -> bool:
+    with connection() as conn:
+        cur = conn.execute(
+            "UPDATE analysis_jobs SET status = 'cancelled', consumed = 1, updated_at = ? "
+            "WHERE id = ? AND user_id = ? AND status IN ('pending', 'running')",
+            (time.time(), job_id, user_id)
+        )
+        if cur.rowcount:
+            conn.execute("DELETE FROM analysis_job_images WHERE job_id = ?", (job_id,))
+    return cur.rowcount == 1
+
+
+@retrying_write
+def mark_analysis_job_consumed(job_id: int):
+    with connection() as conn:
+        conn.execute("UPDATE analysis_jobs SET consumed = 1 WHERE id = ?", (job_id,))
+
+
+@retrying_write
+def recover_analysis_jobs(stale_after: float, keep_days: int = 7) -> list[tuple[int, float]]:
+    """Requeue jobs left running by a dead process and purge old ones.
+
+    Returns (job_id, seconds until due) for every pending job.
+    """
+    now = time.time()
+    with connection() as conn:
+        conn.execute(
+            "UPDATE analysis_jobs SET status = 'pending', run_after = 0 WHERE status = 'running' AND updated_at < ?",
+            (now - stale_after,)
+        )
+        conn.execute(
+            "DELETE FROM analysis_jobs WHERE status NOT IN ('pending', 'running') AND updated_at < ?",
+            (now - keep_days * 86400,)
+        )
+        rows = conn.execute("SELECT id, run_after FROM analysis_jobs WHERE status = 'pending' ORDER BY id").fetchall()
+    return [(r["id"], max(r["run_after"] - now, 0)) for r in rows]
@@ -0,0 +1,157 @@
+"""Columnar export of transactions for offline analysis (Parquet, Arrow IPC, NDJSON).
+
+Files are partitioned Hive-style as `<out>/user_id=<id>/mois=<YYYY-MM>/part-<first>-<last>.<ext>`,
+where first/last are the smallest and largest transaction ids in the part. Every
+run only adds new part files, and `_watermark.json` in the output directory
+records, per user, the last exported id and created_at. Ids come from
+AUTOINCREMENT and are never reused, so `id > last_id` selects exactly the rows
+added since the previous run. Rows edited or deleted after export are not
+re-shipped.
+
+    python exporter.py exports/ --format parquet          # incremental
+    python exporter.py exports/ --format ndjson --full    # everything again
+"""
+import argparse
+import json
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+from database import TRANSACTION_COLUMNS, get_all_users, init_db, iter_transactions_since
+
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow", "ndjson": ".ndjson"}
+WATERMARK_FILE = "_watermark.json"
+
+# articles is shipped as its raw JSON text, chemin_image is a local path and stays behind
+EXPORT_COLUMNS = tuple(c for c in TRANSACTION_COLUMNS if c != "chemin_image")
+_ID = EXPORT_COLUMNS.index("id")
+_DATE = EXPORT_COLUMNS.index("date")
+_CREATED_AT = EXPORT_COLUMNS.index("created_at")
+
+
+def _arrow_schema():
+    import pyarrow as pa
+    types = {"id": pa.int64(), "user_id": pa.int64(), "added_by": pa.int64(),
+             "date": pa.date32(), "montant_total": pa.float64()}
+    return pa.schema([(c, types.get(c, pa.string())) for c in EXPORT_COLUMNS])
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _write_part(path: Path, fmt: str, rows: list[tuple]):
+    """Write one partition file atomically (temp file + rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "ndjson":
+        with open(tmp, "w", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(dict(zip(EXPORT_COLUMNS, r)), ensure_ascii=False) + "\n")
+    else:
+        import pyarrow as pa
+        schema = _arrow_schema()
+        columns = [list(col) for col in zip(*rows)]
+        columns[_DATE] = [_parse_date(d) for d in columns[_DATE]]
+        table = pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            with pa.ipc.new_file(tmp, schema) as writer:
+                writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def load_watermarks(out_dir) -> dict:
+    path = Path(out_dir) / WATERMARK_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8")).get("users", {})
+
+
+def _save_watermarks(out_dir: Path, users: dict):
+    path = out_dir / WATERMARK_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"updated_at": datetime.now().isoformat(), "users": users}, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def export_user(user_id: int, out_dir, fmt: str = "parquet", after_id: int = 0) -> dict:
+    """Export one user's transactions with id > after_id, one part file per month.
+
+    Returns {"rows", "files", "last_id", "last_created_at"}; last_id stays at
+    after_id when there is nothing new.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt} (attendu : {', '.join(EXPORT_FORMATS)})")
+    out_dir = Path(out_dir)
+    stats = {"rows": 0, "files": [], "last_id": after_id, "last_created_at": None}
+    part, part_month = [], None
+
+    def flush():
+        ids = [r[_ID] for r in part]
+        path = (out_dir / f"user_id={user_id}" / f"mois={part_month}"
+                / f"part-{min(ids):010d}-{max(ids):010d}{EXPORT_FORMATS[fmt]}")
+        _write_part(path, fmt, part)
+        stats["rows"] += len(part)
+        stats["files"].append(str(path))
+        stats["last_id"] = max(stats["last_id"], max(ids))
+        created = max((r[_CREATED_AT] or "" for r in part), default="")
+        if created > (stats["last_created_at"] or ""):
+            stats["last_created_at"] = created
+
+    # Rows arrive ordered by date, so each month is contiguous and only one is held in memory
+    for batch in iter_transactions_since(user_id, after_id, columns=EXPORT_COLUMNS):
+        for row in batch:
+            month = (row[_DATE] or "")[:7] or "inconnu"
+            if month != part_month and part:
+                flush()
+                part = []
+            part_month = month
+            part.append(row)
+    if part:
+        flush()
+    return stats
+
+
+def export_all(out_dir, fmt: str = "parquet", user_ids: list[int] = None, full: bool = False) -> dict:
+    """Export every user (or `user_ids`), incrementally from the stored watermarks unless `full`.
+
+    A user's watermark is saved right after their files are written, so an
+    interrupted run resumes where it stopped.
+    """
+    init_db()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    watermarks = load_watermarks(out_dir)
+    if user_ids is None:
+        user_ids = [u["id"] for u in get_all_users()]
+
+    summary = {"rows": 0, "files": 0, "users": {}}
+    for uid in user_ids:
+        prev = {} if full else watermarks.get(str(uid), {})
+        stats = export_user(uid, out_dir, fmt, after_id=prev.get("last_id", 0))
+        summary["users"][uid] = stats["rows"]
+        summary["rows"] += stats["rows"]
+        summary["files"] += len(stats["files"])
+        if stats["rows"]:
+            watermarks[str(uid)] = {"last_id": stats["last_id"],
+                                    "last_created_at": stats["last_created_at"] or prev.get("last_created_at")}
+            _save_watermarks(out_dir, watermarks)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export colonnaire des transactions (Parquet / Arrow / NDJSON).")
+    parser.add_argument("out_dir", help="Dossier de sortie (partitionné par utilisateur et par mois)")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="parquet")
+    parser.add_argument("--user", type=int, action="append", dest="users", help="Limiter à cet utilisateur (répétable)")
+    parser.add_argument("--full", action="store_true", help="Ignorer les watermarks et tout réexporter (dans un dossier vide)")
+    args = parser.parse_args()
+
+    result = export_all(args.out_dir, args.format, args.users, args.full)
+    print(f"{result['rows']} transaction(s) exportée(s) dans {result['files']} fichier(s)")
@@ -0,0 +1,277 @@
+"""Gemini client: per-key token bucket, retries with jittered backoff, model fallback, metrics.
+
+Requests go through the google-generativeai SDK, or straight to the REST API
+when GEMINI_API_BASE is set (e.g. http://127.0.0.1:8765 for the stub server
+in benchmarks/gemini_stub.py). A model that keeps answering 429/5xx, or that
+does not exist (404), hands over to the next one in GEMINI_MODELS. Invalid
+requests and key problems (400/403) fail at once.
+"""
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+GEMINI_MODELS = [m.strip() for m in os.getenv(
+    "GEMINI_MODELS", "gemini-2.5-flash,gemini-2.0-flash-lite,gemini-1.5-flash").split(",") if m.strip()]
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", 10))          # requests per minute allowed per API key
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 3))
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", 3))     # attempts per model on 429/5xx/network errors
+GEMINI_RETRY_BASE_DELAY = 1.0
+GEMINI_TIMEOUT = 60.0
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "")
+
+_TRANSIENT = {0, 429, 500, 502, 503, 504}  # 0: no HTTP answer (network, timeout)
+
+# The SDK keeps one API key per process: configured once, not on every request
+_sdk_key = None
+_sdk_lock = threading.Lock()
+
+
+class GeminiError(RuntimeError):
+    """A failed Gemini call; `status` is the HTTP status, 0 when the server never answered."""
+
+    def __init__(self, message: str, status: int = 0, model: str = "", retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.model = model
+        self.retry_after = retry_after
+
+    @property
+    def transient(self) -> bool:
+        return self.status in _TRANSIENT
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout: float = None) -> float:
+        """Take one token, sleeping until one is available. Returns the seconds waited."""
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                wait = (1 - self.tokens) / self.rate
+            if timeout is not None and now - start + wait > timeout:
+                raise GeminiError("⏳ Quota Gemini local épuisé.", status=429)
+            time.sleep(wait)
+
+    def drain(self):
+        """The server said 429: stop everyone sharing this key for a while."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+
+    def record(self, model: str, latency: float, error: "GeminiError" = None, prompt_tokens: int = 0,
+               output_tokens: int = 0, waited: float = 0.0):
+        with self.lock:
+            m = self.models.setdefault(model, {
+                "requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "fallbacks": 0,
+                "prompt_tokens": 0, "output_tokens": 0, "throttled_s": 0.0, "latencies": deque(maxlen=500),
+            })
+            m["requests"] += 1
+            m["throttled_s"] += waited
+            if error is None:
+                m["ok"] += 1
+                m["latencies"].append(latency)
+                m["prompt_tokens"] += prompt_tokens
+                m["output_tokens"] += output_tokens
+            else:
+                m["errors"] += 1
+                m["rate_limited"] += error.status == 429
+
+    def fallback(self, model: str):
+        with self.lock:
+            if model in self.models:
+                self.models[model]["fallbacks"] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            out = {}
+            for name, m in self.models.items():
+                lat = sorted(m["latencies"])
+                out[name] = {k: v for k, v in m.items() if k != "latencies"}
+                out[name]["rate_429"] = m["rate_limited"] / m["requests"] if m["requests"] else 0.0
+                out[name]["latency_p50"] = lat[len(lat) // 2] if lat else None
+                out[name]["latency_p95"] = lat[min(int(len(lat) * 0.95), len(lat) - 1)] if lat else None
+            return out
+
+
+def _sdk_configure(api_key: str):
+    global _sdk_key
+    with _sdk_lock:
+        if _sdk_key != api_key:
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+            _sdk_key = api_key
+
+
+def _sdk_generate(model: str, prompt: str, timeout: float, schema: dict = None) -> tuple[str, int, int]:
+    import google.generativeai as genai
+    config = {"response_mime_type": "application/json", "response_schema": schema} if schema else None
+    try:
+        response = genai.GenerativeModel(model).generate_content(
+            prompt, generation_config=config, request_options={"timeout": timeout})
+    except Exception as e:
+        code = getattr(e, "code", None)
+        status = code if isinstance(code, int) else next((s for s in (429, 403, 404, 400, 500, 503) if str(s) in str(e)), 0)
+        raise GeminiError(str(e)[:300], status=status, model=model)
+    try:
+        text = response.text
+    except ValueError as e:  # blocked or empty candidate
+        raise GeminiError(str(e)[:300], status=200, model=model)
+    usage = getattr(response, "usage_metadata", None)
+    return text, getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+
+def _parse_retry_after(value: str) -> float | None:
+    """Seconds to wait from a Retry-After header: delay-seconds or an HTTP-date. None if unreadable."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _rest_generate(base_url: str, api_key: str, model: str, prompt: str, timeout: float,
+                   schema: dict = None) -> tuple[str, int, int]:
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    if schema:
+        payload["generationConfig"] = {"responseMimeType": "application/json", "responseSchema": schema}
+    body = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(
+        f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent", data=body, method="POST",
+        headers={"Content-Type": "application/json", "x-goog-api-key": api_key},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            data = json.loads(resp.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        raise GeminiError(e.read().decode("utf-8", "replace")[:300] or e.reason, status=e.code, model=model,
+                          retry_after=_parse_retry_after(e.headers.get("Retry-After")))
+    except (urllib.error.URLError, TimeoutError, OSError) as e:
+        raise GeminiError(str(e)[:300], status=0, model=model)
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError):
+        raise GeminiError("Réponse Gemini sans contenu.", status=200, model=model)
+    usage = data.get("usageMetadata", {})
+    return ("".join(p.get("text", "") for p in parts), usage.get("promptTokenCount", 0),
+            usage.get("candidatesTokenCount", 0))
+
+
+class GeminiClient:
+    def __init__(self, api_key: str, models: list[str] = None, base_url: str = None,
+                 retries: int = GEMINI_RETRIES, timeout: float = GEMINI_TIMEOUT):
+        self.api_key = api_key
+        self.models = list(models or GEMINI_MODELS)
+        self.base_url = GEMINI_API_BASE if base_url is None else base_url
+        self.retries = retries
+        self.timeout = timeout
+        self.bucket = get_bucket(api_key)
+        if not self.base_url:
+            _sdk_configure(api_key)
+
+    def _call(self, model: str, prompt: str, schema: dict = None) -> tuple[str, int, int]:
+        if self.base_url:
+            return _rest_generate(self.base_url, self.api_key, model, prompt, self.timeout, schema)
+        return _sdk_generate(model, prompt, self.timeout, schema)
+
+    def generate(self, prompt: str, schema: dict = None) -> tuple[str, str]:
+        """Return (text, model that answered). Raises GeminiError once every model gave up.
+
+        With `schema` (OpenAPI subset, as the Gemini API takes it) the model must answer
+        JSON matching it.
+        """
+        last = None
+        for model in self.models:
+            delay = GEMINI_RETRY_BASE_DELAY
+            for attempt in range(self.retries):
+                waited, start = 0.0, time.perf_counter()
+                try:
+                    # A local 429 (bucket still empty after `timeout`) is handled like the server's
+                    waited = self.bucket.acquire(timeout=self.timeout)
+                    start = time.perf_counter()
+                    text, prompt_tokens, output_tokens = self._call(model, prompt, schema)
+                except GeminiError as e:
+                    metrics.record(model, time.perf_counter() - start, e, waited=waited)
+                    last = e
+                    if e.status == 429:
+                        self.bucket.drain()
+                    if not e.transient or attempt == self.retries - 1:
+                        break
+                    # The server's Retry-After wins, but never beyond our own timeout
+                    time.sleep(min(e.retry_after, self.timeout) if e.retry_after is not None
+                               else delay * (1 + random.random()))
+                    delay *= 2
+                    continue
+                metrics.record(model, time.perf_counter() - start, None, prompt_tokens, output_tokens, waited)
+                return text, model
+            # 400/403 would fail the same way on every model
+            if last is not None and last.status in (400, 401, 403):
+                raise last
+            metrics.fallback(model)
+        raise last or GeminiError("Aucun modèle Gemini configuré.")
+
+
+metrics = _Metrics()
+_buckets: dict[str, TokenBucket] = {}
+_clients: dict[str, GeminiClient] = {}
+_registry_lock = threading.Lock()
+
+
+def get_bucket(api_key: str) -> TokenBucket:
+    with _registry_lock:
+        if api_key not in _buckets:
+            _buckets[api_key] = TokenBucket(GEMINI_RPM / 60.0, GEMINI_BURST)
+        return _buckets[api_key]
+
+
+def get_client(api_key: str) -> GeminiClient:
+    """Process-wide client for this key (shares its token bucket with every other caller)."""
+    client = _clients.get(api_key)
+    if client is None:
+        client = GeminiClient(api_key)
+        with _registry_lock:
+            client = _clients.setdefault(api_key, client)
+    return client
+
+
+def get_gemini_metrics() -> dict:
+    """Per-model counters: requests, ok, errors, rate_limited, rate_429, fallbacks,
+    prompt/output tokens, seconds throttled by the bucket, latency p50/p95."""
+    return metrics.snapshot()
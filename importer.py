@@ -0,0 +1,248 @@
+"""Streaming import of bank statements (CSV, OFX, QIF).
+
+Statements are parsed line by line, categorised locally with the user's
+keyword matcher (categorizer.py), deduplicated against existing rows and
+written in batches of IMPORT_BATCH_SIZE, so memory stays flat on multi-year
+exports.
+
+    stats = import_statement(uid, open("releve.csv", "rb"), on_progress=print)
+"""
+import codecs
+import csv
+import io
+import re
+import time
+from collections import Counter
+from datetime import date, datetime
+from itertools import chain, islice
+
+from categorizer import get_category_matcher, normalize
+from database import insert_transactions_dedup, transaction_identity
+
+IMPORT_BATCH_SIZE = 5000
+STATEMENT_FORMATS = ("csv", "ofx", "qif")
+
+# CSV header names after normalize() (lowercase, no accents) for each field we need
+_CSV_DATE = ("date operation", "date de l'operation", "date", "date comptable", "booking date", "transaction date")
+_CSV_LABEL = ("libelle", "libelle operation", "label", "description", "intitule", "enseigne", "nom", "payee", "detail")
+_CSV_AMOUNT = ("montant", "montant (eur)", "montant eur", "amount", "somme")
+_CSV_DEBIT = ("debit", "debit (eur)", "debit eur")
+_CSV_CREDIT = ("credit", "credit (eur)", "credit eur")
+
+
+class _FrenchCsv(csv.excel):
+    delimiter = ";"
+
+
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)")
+
+
+# ─── Field parsing ───
+
+def parse_amount(raw: str) -> float:
+    """'1 234,56 €', '-12.50', '1.234,56', '(8,00)' → float. Raises ValueError."""
+    s = raw.strip().replace("\xa0", "").replace(" ", "").replace("€", "").replace("EUR", "")
+    negative = s.startswith("(") and s.endswith(")")
+    s = s.strip("()")
+    if "," in s and "." in s:
+        # the right-most separator is the decimal one
+        s = s.replace(".", "").replace(",", ".") if s.rfind(",") > s.rfind(".") else s.replace(",", "")
+    else:
+        s = s.replace(",", ".")
+    value = float(s)
+    return -value if negative else value
+
+
+def parse_date(raw: str, day_first: bool = True) -> str:
+    """Bank date formats → 'YYYY-MM-DD'. Raises ValueError."""
+    s = raw.strip().replace("'", "/").replace(" ", "")
+    if len(s) >= 8 and s[:8].isdigit():
+        return datetime.strptime(s[:8], "%Y%m%d").strftime("%Y-%m-%d")  # OFX 20240105[120000]
+    if len(s) >= 10 and s[4] == "-":
+        y, m, d = (int(p) for p in s[:10].split("-"))
+    else:
+        parts = re.split(r"[/.\-]", s)
+        if len(parts) != 3:
+            raise ValueError(f"Date illisible : {raw}")
+        d, m, y = (int(p) for p in parts) if day_first else (int(parts[1]), int(parts[0]), int(parts[2]))
+        if y < 100:
+            y += 2000
+    # date() rejects 31/02 and month 31 (a US statement read day-first)
+    return date(y, m, d).isoformat()
+
+
+def _clean_label(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _entry(date_raw: str, label: str, amount: float, day_first: bool) -> dict | None:
+    label = _clean_label(label)
+    if not amount or not label:
+        return None
+    return {"date": parse_date(date_raw, day_first), "enseigne": label,
+            "montant": abs(amount), "type": "revenu" if amount > 0 else "depense"}
+
+
+# ─── Parsers: each yields {date, enseigne, montant, type}, or None for an unreadable entry ───
+
+def _pick(headers: list[str], names: tuple) -> int | None:
+    for name in names:
+        if name in headers:
+            return headers.index(name)
+    return None
+
+
+def parse_csv(lines, day_first: bool = True):
+    lines = iter(lines)
+    head = list(islice(lines, 30))
+    try:
+        dialect = csv.Sniffer().sniff("".join(head[:10]), delimiters=";,\t|")
+    except csv.Error:
+        dialect = _FrenchCsv
+    reader = csv.reader(chain(head, lines), dialect)
+
+    # Banks often put account details above the header row
+    for row in reader:
+        headers = [normalize(h) for h in row]
+        i_date, i_label = _pick(headers, _CSV_DATE), _pick(headers, _CSV_LABEL)
+        i_amount, i_debit, i_credit = _pick(headers, _CSV_AMOUNT), _pick(headers, _CSV_DEBIT), _pick(headers, _CSV_CREDIT)
+        if i_date is not None and i_label is not None and (i_amount is not None or i_debit is not None or i_credit is not None):
+            break
+        if reader.line_num > 30:
+            row = None
+            break
+    else:
+        row = None
+    if row is None:
+        raise ValueError("📄 En-tête CSV introuvable (colonnes Date, Libellé et Montant attendues).")
+
+    for row in reader:
+        if not any(row):
+            continue
+        try:
+            if i_amount is not None:
+                amount = parse_amount(row[i_amount])
+            else:
+                debit = row[i_debit].strip() if i_debit is not None else ""
+                credit = row[i_credit].strip() if i_credit is not None else ""
+                amount = (parse_amount(credit) if credit else 0.0) - (abs(parse_amount(debit)) if debit else 0.0)
+            yield _entry(row[i_date], row[i_label], amount, day_first)
+        except (ValueError, IndexError):
+            yield None
+
+
+def parse_ofx(lines, day_first: bool = True):
+    """OFX 1.x (SGML, unclosed tags) and 2.x (XML)."""
+    txn = None
+    for line in lines:
+        for m in _OFX_TAG.finditer(line):
+            closing, tag, value = m.group(1), m.group(2).upper(), m.group(3).strip()
+            if tag == "STMTTRN":
+                if not closing:
+                    txn = {}
+                elif txn is not None:
+                    try:
+                        yield _entry(txn["DTPOSTED"], txn.get("NAME") or txn.get("MEMO", ""),
+                                     parse_amount(txn["TRNAMT"]), day_first)
+                    except (KeyError, ValueError):
+                        yield None
+                    txn = None
+            elif txn is not None and not closing and value:
+                txn[tag] = value
+
+
+def parse_qif(lines, day_first: bool = True):
+    txn = {}
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("!"):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == "^":
+            if txn:
+                try:
+                    yield _entry(txn["D"], txn.get("P") or txn.get("M", ""), parse_amount(txn.get("T") or txn["U"]), day_first)
+                except (KeyError, ValueError):
+                    yield None
+            txn = {}
+        elif code in "DTUPM":
+            txn[code] = value
+
+
+_PARSERS = {"csv": parse_csv, "ofx": parse_ofx, "qif": parse_qif}
+
+
+# ─── Import ───
+
+def open_statement(stream) -> io.TextIOBase:
+    """Wrap a binary upload/file as text, UTF-8 if it decodes, else Windows-1252 (common for French banks)."""
+    raw = stream if hasattr(stream, "peek") else io.BufferedReader(stream, buffer_size=64 * 1024)
+    head = raw.peek(64 * 1024)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp1252"
+    return io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="")
+
+
+def detect_format(head: str, filename: str = "") -> str:
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if ext in STATEMENT_FORMATS:
+        return ext
+    upper = head.lstrip()[:2000].upper()
+    if upper.startswith("OFXHEADER") or "<OFX>" in upper:
+        return "ofx"
+    if upper.startswith("!TYPE") or upper.startswith("!ACCOUNT"):
+        return "qif"
+    return "csv"
+
+
+def iter_statement(stream, fmt: str = None, filename: str = "", day_first: bool = True):
+    """Parse a binary statement stream; yields entries (None for unreadable ones)."""
+    text = open_statement(stream)
+    head = list(islice(text, 5))
+    if fmt is None:
+        fmt = detect_format("".join(head), filename)
+    if fmt not in _PARSERS:
+        raise ValueError(f"Format de relevé inconnu : {fmt}")
+    return _PARSERS[fmt](chain(head, text), day_first)
+
+
+def import_statement(user_id: int, stream, fmt: str = None, filename: str = "", day_first: bool = True,
+                     batch_size: int = IMPORT_BATCH_SIZE, on_progress=None, added_by: int = None) -> dict:
+    """Import a bank statement into user_id's transactions.
+
+    Each batch is deduplicated and written in one transaction. `on_progress(stats)`
+    is called after every batch with the running counters
+    {"parsed", "inserted", "duplicates", "rejected", "elapsed"}.
+    """
+    categorize = get_category_matcher(user_id).categorize
+    seen = Counter()
+    stats = {"parsed": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "elapsed": 0.0}
+    start = time.perf_counter()
+
+    def flush(batch):
+        inserted = insert_transactions_dedup(user_id, batch, exclude=seen)
+        for r in inserted:
+            seen[transaction_identity(r["date"], r["enseigne"], r["montant_total"], r["type"])] += 1
+        stats["inserted"] += len(inserted)
+        stats["duplicates"] += len(batch) - len(inserted)
+        stats["elapsed"] = time.perf_counter() - start
+        if on_progress:
+            on_progress(dict(stats))
+
+    batch = []
+    for entry in iter_statement(stream, fmt, filename, day_first):
+        stats["parsed"] += 1
+        if entry is None:
+            stats["rejected"] += 1
+            continue
+        batch.append({"user_id": user_id, "date": entry["date"], "enseigne": entry["enseigne"],
+                      "montant_total": entry["montant"], "type": entry["type"],
+                      "categorie": categorize(entry["enseigne"], entry["type"]), "added_by": added_by})
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+    return stats
@@ -0,0 +1,78 @@
+"""Background receipt analysis (OCR + Gemini) so the Ajouter page never blocks.
+
+Jobs live in the analysis_jobs table and run on a small per-process thread
+pool. Both OCR (Tesseract subprocesses, EasyOCR in native code) and the Gemini
+call spend their time outside the GIL, so threads are enough. The page submits
+a job, polls it, and finds it again after a browser refresh. Quota and network
+errors are retried with jittered exponential backoff. A cancelled job's result
+is dropped even if the analysis was already under way.
+"""
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import (
+    claim_analysis_job, create_analysis_job, fail_analysis_job, finish_analysis_job,
+    get_analysis_job, get_analysis_job_images, recover_analysis_jobs,
+)
+
+JOB_WORKERS = int(os.getenv("BUDGET_JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BASE_DELAY = 5.0
+# A job still "running" after this long belongs to a process that died: run it again
+JOB_STALE_SECONDS = 600
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def start_job_runner():
+    """Start the worker pool and resume jobs left over by a previous process. Idempotent."""
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="analysis-job")
+            for job_id, delay in recover_analysis_jobs(JOB_STALE_SECONDS):
+                _schedule(job_id, delay)
+    return _executor
+
+
+def _schedule(job_id: int, delay: float = 0.0):
+    if delay > 0:
+        timer = threading.Timer(delay, _schedule, (job_id,))
+        timer.daemon = True
+        timer.start()
+    else:
+        start_job_runner().submit(_run, job_id)
+
+
+def submit_analysis(user_id: int, images: list[tuple[bytes, str]], max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+    """Queue an analysis of `images` for user_id and return the job id."""
+    job_id = create_analysis_job(user_id, images, max_attempts)
+    _schedule(job_id)
+    return job_id
+
+
+def _run(job_id: int):
+    if not claim_analysis_job(job_id):
+        return  # cancelled, or another process took it
+    job = get_analysis_job(job_id)
+    failures = []
+    try:
+        from analyzer import TransientAnalysisError, analyze_receipts
+        try:
+            result = analyze_receipts(get_analysis_job_images(job_id), job["user_id"], failures)
+        except TransientAnalysisError as e:
+            if job["attempts"] >= job["max_attempts"]:
+                raise
+            delay = JOB_RETRY_BASE_DELAY * 2 ** (job["attempts"] - 1) * (1 + random.random())
+            if fail_analysis_job(job_id, str(e), retry_in=delay):
+                _schedule(job_id, delay)
+            return
+    except Exception as e:
+        fail_analysis_job(job_id, str(e) or type(e).__name__)
+        return
+    finish_analysis_job(job_id, result, failures)
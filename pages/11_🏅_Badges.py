@@ -1,6 +1,6 @@
 import streamlit as st
 from database import (
-    init_db, get_all_transactions, get_budgets, get_friends,
+    init_db, get_activity_summary, get_budgets, get_friends,
     get_savings_goals, ensure_user_has_categories,
 )
 from auth import require_auth, get_current_user_id, get_current_user
@@ -18,17 +18,17 @@ ensure_user_has_categories(uid)
 st.markdown("# 🏅 Succès & Badges")
 
 # ─── Calculate user stats ───
-all_tx = get_all_transactions(uid)
+summary = get_activity_summary(uid)
 budgets = get_budgets(uid)
 friends = get_friends(uid)
 goals = get_savings_goals(uid)
 
-total_txn = len(all_tx)
-total_dep = sum(t["montant_total"] for t in all_tx if t.get("type", "depense") == "depense")
-total_rev = sum(t["montant_total"] for t in all_tx if t.get("type") == "revenu")
-unique_enseignes = len(set(t["enseigne"] for t in all_tx))
-unique_cats = len(set(t["categorie"] for t in all_tx))
-months_active = len(set(t["date"][:7] for t in all_tx))
+total_txn = summary["total_txn"]
+total_dep = summary["total_dep"]
+total_rev = summary["total_rev"]
+unique_enseignes = summary["unique_enseignes"]
+unique_cats = summary["unique_cats"]
+months_active = summary["months_active"]
 
 # ─── Badge definitions ───
 BADGES = [
@@ -44,10 +44,7 @@ avatar_cols = st.columns(10)
 for i, av in enumerate(AVATAR_LIST):
     with avatar_cols[i % 10]:
         if st.button(av, key=f"av_pref_{i}"):
-            from database import get_connection
-            conn = get_connection()
-            conn.execute("UPDATE users SET avatar = ? WHERE id = ?", (av, uid))
-            conn.commit(); conn.close()
+            update_user_preference(uid, "avatar", av)
             st.session_state["user_avatar"] = av
             st.rerun()
 
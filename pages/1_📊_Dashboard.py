@@ -3,20 +3,22 @@ from datetime import datetime, date
 from collections import defaultdict
 
 from database import (
-    init_db, get_all_transactions, get_transactions_by_month,
-    get_transactions_by_range, get_monthly_totals,
-    delete_transaction, apply_recurring_for_month,
+    init_db, get_all_transactions, get_transactions_by_month, get_active_years,
+    get_transactions_in_period, month_bounds, get_monthly_totals, get_category_totals,
+    delete_transaction, delete_transactions, insert_transactions_bulk,
     get_category_map, get_category_names, get_friends,
     get_user_by_id, ensure_user_has_categories,
     get_budgets, export_transactions_csv, update_transaction,
     get_transaction_by_id, duplicate_transaction, get_smart_budget_info,
-    get_unique_enseignes, update_user_preference,
+    get_unique_enseignes, update_user_preference, SUMMARY_COLUMNS,
 )
 from auth import require_auth, get_current_user_id, get_current_user, logout
+from scheduler import start_recurring_scheduler
 from styles import inject_css
 
 st.set_page_config(page_title="Dashboard — Budget", page_icon="📊", layout="wide", initial_sidebar_state="collapsed")
 init_db()
+start_recurring_scheduler()
 require_auth()
 inject_css()
 
@@ -37,23 +39,44 @@ def format_date_fr(ds):
         return ds
 
 
+UNDO_FIELDS = ("user_id", "date", "enseigne", "montant_total", "categorie", "chemin_image",
+               "articles", "type", "added_by", "tags", "sous_categorie", "comment", "recurring_id", "recurring_date")
+
+
+def delete_with_undo(txn_ids):
+    # The listed rows are projected, so keep the full rows for a faithful restore
+    rows = [get_transaction_by_id(i) for i in txn_ids]
+    st.session_state["undo_txns"] = [{k: r[k] for k in UNDO_FIELDS} for r in rows if r]
+    st.session_state.pop("undo_shown", None)
+    if len(txn_ids) == 1:
+        delete_transaction(txn_ids[0])
+    else:
+        delete_transactions(txn_ids)
+
+
 # ─── Undo delete logic ───
-if "undo_txn" in st.session_state:
-    undo = st.session_state["undo_txn"]
+if "undo_txns" in st.session_state:
+    undo = st.session_state["undo_txns"]
     c_undo1, c_undo2 = st.columns([4, 1])
     with c_undo1:
-        st.warning(f"🗑️ Transaction « {undo['enseigne']} » supprimée")
+        if len(undo) == 1:
+            st.warning(f"🗑️ Transaction « {undo[0]['enseigne']} » supprimée")
+        else:
+            st.warning(f"🗑️ {len(undo)} transactions supprimées")
     with c_undo2:
         if st.button("↩️ Annuler", key="undo_btn"):
-            from database import insert_transaction
-            insert_transaction(undo["user_id"], undo["date"], undo["enseigne"],
-                               undo["montant_total"], undo["categorie"], "", [],
-                               undo.get("type", "depense"), added_by=undo.get("added_by"))
-            del st.session_state["undo_txn"]
-            st.success("↩️ Restaurée"); st.rerun()
+            # A deleted recurring occurrence may have been re-applied meanwhile: keep that one
+            skipped = insert_transactions_bulk(undo, skip_existing=True).count(None)
+            del st.session_state["undo_txns"]
+            st.session_state.pop("undo_shown", None)
+            if skipped:
+                st.toast(f"↩️ Restaurée(s) — {skipped} occurrence(s) récurrente(s) déjà recréée(s), ignorée(s)")
+            else:
+                st.toast("↩️ Restaurée(s)")
+            st.rerun()
     # Auto-clear after one render
     if "undo_shown" in st.session_state:
-        del st.session_state["undo_txn"]
+        del st.session_state["undo_txns"]
         del st.session_state["undo_shown"]
     else:
         st.session_state["undo_shown"] = True
@@ -90,47 +113,39 @@ if len(profile_map) > 1:
 view_cat_map = get_category_map(viewing_uid)
 view_cat_names = get_category_names(viewing_uid)
 now = datetime.now()
-all_tx = get_all_transactions(viewing_uid)
 
 # ─── Controls ───
 PERIODES = ["Mois", "Trimestre", "Semestre", "Année", "Tout"]
 c1, c2, c3, c4, c5 = st.columns([1, 1, 1, 1.5, 1.5])
-yrs = sorted(set(t["date"][:4] for t in all_tx if t.get("date") and len(t["date"]) >= 4)) or [str(now.year)]
+yrs = get_active_years(viewing_uid) or [str(now.year)]
 with c1: yr = st.selectbox("Année", yrs, index=len(yrs) - 1)
 with c2: mo = st.selectbox("Mois", range(1, 13), index=now.month - 1, format_func=lambda x: MOIS_FR[x].capitalize())
 with c3: periode = st.selectbox("Période", PERIODES, index=0)
 with c4: view = st.selectbox("Affichage", ["📋 Timeline", "📊 Tableau", "📦 Compact"])
 with c5: filt = st.multiselect("Filtre", view_cat_names, default=[], placeholder="Toutes")
 
-# Apply recurring
-if not viewing_readonly:
-    applied = apply_recurring_for_month(uid, int(yr), mo)
-    if applied > 0:
-        st.toast(f"🔁 {applied} récurrent(s) ajouté(s)")
-
 # Get transactions based on period
 if periode == "Mois":
-    txs = get_transactions_by_month(viewing_uid, int(yr), mo)
+    txs = get_transactions_by_month(viewing_uid, int(yr), mo, columns=SUMMARY_COLUMNS)
+    mois_range = (f"{yr}-{mo:02d}", f"{yr}-{mo:02d}")
 elif periode == "Trimestre":
     q_start = ((mo - 1) // 3) * 3 + 1
-    d_from = f"{yr}-{q_start:02d}-01"
-    q_end_m = q_start + 2
-    import calendar
-    _, ld = calendar.monthrange(int(yr), q_end_m)
-    d_to = f"{yr}-{q_end_m:02d}-{ld}"
-    txs = get_transactions_by_range(viewing_uid, d_from, d_to)
+    d_from, _ = month_bounds(int(yr), q_start)
+    _, d_before = month_bounds(int(yr), q_start + 2)
+    txs = get_transactions_in_period(viewing_uid, d_from, d_before, columns=SUMMARY_COLUMNS)
+    mois_range = (f"{yr}-{q_start:02d}", f"{yr}-{q_start + 2:02d}")
 elif periode == "Semestre":
     s = 1 if mo <= 6 else 7
-    d_from = f"{yr}-{s:02d}-01"
-    e = 6 if s == 1 else 12
-    import calendar
-    _, ld = calendar.monthrange(int(yr), e)
-    d_to = f"{yr}-{e:02d}-{ld}"
-    txs = get_transactions_by_range(viewing_uid, d_from, d_to)
+    d_from, _ = month_bounds(int(yr), s)
+    _, d_before = month_bounds(int(yr), s + 5)
+    txs = get_transactions_in_period(viewing_uid, d_from, d_before, columns=SUMMARY_COLUMNS)
+    mois_range = (f"{yr}-{s:02d}", f"{yr}-{s + 5:02d}")
 elif periode == "Année":
-    txs = get_transactions_by_range(viewing_uid, f"{yr}-01-01", f"{yr}-12-31")
+    txs = get_transactions_in_period(viewing_uid, f"{yr}-01-01", f"{int(yr) + 1}-01-01", columns=SUMMARY_COLUMNS)
+    mois_range = (f"{yr}-01", f"{yr}-12")
 else:
-    txs = all_tx
+    txs = get_all_transactions(viewing_uid, columns=SUMMARY_COLUMNS)
+    mois_range = (None, None)
 
 if filt:
     txs = [t for t in txs if t["categorie"] in filt]
@@ -187,10 +202,9 @@ col_side, col_main = st.columns([1, 2.5])
 
 with col_side:
     st.markdown("#### 📊 Répartition")
-    ct = defaultdict(float)
-    for t in txs:
-        if t.get("type", "depense") == "depense":
-            ct[t["categorie"]] += t["montant_total"]
+    ct = get_category_totals(viewing_uid, *mois_range)
+    if filt:
+        ct = {c: v for c, v in ct.items() if c in filt}
 
     budgets = get_budgets(viewing_uid)
 
@@ -262,13 +276,12 @@ with col_main:
                 bc1, bc2 = st.columns(2)
                 with bc1:
                     if st.button("💾 Sauvegarder", type="primary", use_container_width=True):
-                        from database import get_connection
-                        conn = get_connection()
-                        conn.execute(
-                            "UPDATE transactions SET date=?, enseigne=?, montant_total=?, categorie=?, type=?, tags=?, comment=? WHERE id=?",
-                            (e_date.strftime("%Y-%m-%d"), e_ens, e_mt, e_cat, e_type, e_tags, e_comment, txn["id"])
-                        )
-                        conn.commit(); conn.close()
+                        from database import connection
+                        with connection() as conn:
+                            conn.execute(
+                                "UPDATE transactions SET date=?, enseigne=?, montant_total=?, categorie=?, type=?, tags=?, comment=? WHERE id=?",
+                                (e_date.strftime("%Y-%m-%d"), e_ens, e_mt, e_cat, e_type, e_tags, e_comment, txn["id"])
+                            )
                         del st.session_state["edit_txn_id"]
                         st.success("✅ Modifiée"); st.rerun()
                 with bc2:
@@ -320,14 +333,7 @@ with col_main:
                             st.session_state["edit_txn_id"] = t["id"]; st.rerun()
                     with fc:
                         if st.button("🗑️", key=f"d{t['id']}"):
-                            # Undo: save to session before deleting
-                            st.session_state["undo_txn"] = {
-                                "user_id": t.get("user_id", uid), "date": t["date"],
-                                "enseigne": t["enseigne"], "montant_total": t["montant_total"],
-                                "categorie": t["categorie"], "type": t.get("type", "depense"),
-                                "added_by": t.get("added_by"),
-                            }
-                            delete_transaction(t["id"]); st.rerun()
+                            delete_with_undo([t["id"]]); st.rerun()
             st.markdown("")
 
     # ═══ TABLEAU ═══
@@ -354,7 +360,7 @@ with col_main:
             bc1, bc2 = st.columns(2)
             with bc1:
                 if st.button(f"🗑️ Supprimer ({len(sr)})", type="secondary"):
-                    for t in stx: delete_transaction(t["id"])
+                    delete_with_undo([t["id"] for t in stx])
                     st.rerun()
             with bc2:
                 if len(sr) == 1:
@@ -382,10 +388,4 @@ with col_main:
                     if st.button("✏️", key=f"ce{t['id']}"): st.session_state["edit_txn_id"] = t["id"]; st.rerun()
                 with c7:
                     if st.button("✕", key=f"cd{t['id']}"):
-                        st.session_state["undo_txn"] = {
-                            "user_id": t.get("user_id", uid), "date": t["date"],
-                            "enseigne": t["enseigne"], "montant_total": t["montant_total"],
-                            "categorie": t["categorie"], "type": t.get("type", "depense"),
-                            "added_by": t.get("added_by"),
-                        }
-                        delete_transaction(t["id"]); st.rerun()
+                        delete_with_undo([t["id"]]); st.rerun()
@@ -3,11 +3,13 @@ from datetime import date, timedelta
 import re
 
 from database import (
-    init_db, insert_transaction, get_category_names, get_all_categories,
+    init_db, insert_transaction, insert_transactions_bulk, get_category_names, get_all_categories,
     get_friends, get_user_by_id, ensure_user_has_categories, create_debt,
-    get_unique_enseignes,
+    get_unique_enseignes, get_analysis_job, get_latest_analysis_job, cancel_analysis_job,
+    mark_analysis_job_consumed, JOB_ACTIVE,
 )
-from analyzer import analyze_receipts
+from jobs import start_job_runner, submit_analysis
+from importer import import_statement
 from auth import require_auth, get_current_user_id, get_current_user
 from styles import inject_css
 
@@ -48,7 +50,7 @@ enseignes = get_unique_enseignes(uid)
 
 st.markdown(f"# ➕ Ajouter")
 
-tab_ia, tab_man, tab_rev, tab_split = st.tabs(["🤖 Analyse IA", "✍️ Dépense", "💰 Revenu", "✂️ Partagée"])
+tab_ia, tab_man, tab_rev, tab_split, tab_bank = st.tabs(["🤖 Analyse IA", "✍️ Dépense", "💰 Revenu", "✂️ Partagée", "🏦 Relevé"])
 
 # ═══ IA TAB ═══
 with tab_ia:
@@ -61,15 +63,52 @@ with tab_ia:
             with cols[i % 4]:
                 st.image(f, caption=f.name, use_container_width=True)
 
-        if st.button("🔍 Analyser avec l'IA", type="primary", use_container_width=True):
-            with st.spinner("OCR + analyse IA en cours..."):
-                try:
-                    images = [(f.getvalue(), f.type or "image/jpeg") for f in uploaded]
-                    txns = analyze_receipts(images, uid)
-                    st.session_state["ai_txns"] = txns
-                    st.success(f"✅ {len(txns)} transaction(s) détectée(s)")
-                except Exception as e:
-                    st.error(str(e))
+        if st.button("🔍 Analyser avec l'IA", type="primary", use_container_width=True, disabled="ai_job" in st.session_state):
+            images = [(f.getvalue(), f.type or "image/jpeg") for f in uploaded]
+            st.session_state.pop("ai_txns", None)
+            st.session_state["ai_job"] = submit_analysis(uid, images)
+
+    # Analysis runs in the background; a job survives a browser refresh
+    start_job_runner()
+    if "ai_job" not in st.session_state and "ai_txns" not in st.session_state:
+        pending = get_latest_analysis_job(uid)
+        if pending:
+            st.session_state["ai_job"] = pending["id"]
+
+    if "ai_job" in st.session_state:
+        job = get_analysis_job(st.session_state["ai_job"])
+        if job is None or job["status"] == "cancelled":
+            st.session_state.pop("ai_job")
+        elif job["status"] == "done":
+            st.session_state["ai_txns"] = job["result"]
+            st.session_state.pop("ai_job")
+            mark_analysis_job_consumed(job["id"])
+            st.success(f"✅ {len(job['result'])} transaction(s) détectée(s)")
+            for i, msg in job["failures"]:
+                st.warning(f"Ticket {i} ignoré : {msg}")
+        elif job["status"] == "failed":
+            st.session_state.pop("ai_job")
+            mark_analysis_job_consumed(job["id"])
+            st.error(job["error"])
+        else:
+            @st.fragment(run_every=2)
+            def ai_job_progress():
+                j = get_analysis_job(st.session_state.get("ai_job", job["id"]))
+                if j is None or j["status"] not in JOB_ACTIVE:
+                    st.rerun()  # finished: the full page picks up the result
+                retry = f" — tentative {j['attempts']}/{j['max_attempts']}" if j["attempts"] > 1 else ""
+                if j["status"] == "pending" and j["error"]:
+                    st.warning(f"⏳ Nouvel essai bientôt{retry} ({j['error']})")
+                elif j["status"] == "pending":
+                    st.info("⏳ Analyse en file d'attente…")
+                else:
+                    st.info(f"🔍 OCR + analyse IA en cours…{retry}")
+                if st.button("✖️ Annuler l'analyse", key="ai_cancel"):
+                    cancel_analysis_job(j["id"], uid)
+                    st.session_state.pop("ai_job", None)
+                    st.rerun()
+
+            ai_job_progress()
 
     if "ai_txns" in st.session_state:
         txns = st.session_state["ai_txns"]
@@ -104,10 +143,13 @@ with tab_ia:
             st.markdown("---")
 
         if st.button(f"💾 Enregistrer {len(edited)} transaction(s)", type="primary", use_container_width=True, disabled=not edited):
-            for t in edited:
-                added_by = uid if ai_target_uid != uid else None
-                insert_transaction(ai_target_uid, t["date"], t["enseigne"], t["montant"],
-                                   t["categorie"], "", [], t["type"], added_by=added_by)
+            added_by = uid if ai_target_uid != uid else None
+            insert_transactions_bulk([
+                {"user_id": ai_target_uid, "date": t["date"], "enseigne": t["enseigne"],
+                 "montant_total": t["montant"], "categorie": t["categorie"], "type": t["type"],
+                 "added_by": added_by, "tags": t["tags"], "comment": t["comment"]}
+                for t in edited
+            ])
             st.session_state.pop("ai_txns", None)
             st.success(f"✅ {len(edited)} transaction(s) enregistrée(s)")
             st.balloons()
@@ -244,3 +286,27 @@ with tab_split:
                     create_debt(sp_friend_id, uid, sp_other_share, f"Part de {sp_ens}", tid)
                 st.success(f"✅ Dépense enregistrée, dette de {sp_other_share:.2f}€ créée")
                 st.balloons()
+
+# ═══ RELEVÉ TAB ═══
+with tab_bank:
+    st.markdown("#### 🏦 Importer un relevé bancaire")
+    st.caption("CSV, OFX ou QIF exporté depuis votre banque. Les catégories viennent de vos mots-clés, les opérations déjà présentes sont ignorées.")
+
+    stmt = st.file_uploader("Relevé", type=["csv", "ofx", "qif", "txt"], key="bank_upload")
+    us_dates = st.checkbox("Dates au format américain (MM/JJ)", value=False, key="bank_us_dates")
+
+    if stmt and st.button("📥 Importer", type="primary", use_container_width=True, key="bank_import"):
+        progress = st.empty()
+
+        def show_progress(stats):
+            progress.caption(f"⏳ {stats['parsed']} lignes lues · {stats['inserted']} importées · {stats['duplicates']} doublons")
+
+        try:
+            res = import_statement(uid, stmt, filename=stmt.name, day_first=not us_dates, on_progress=show_progress)
+            progress.empty()
+            st.success(f"✅ {res['inserted']} transaction(s) importée(s) · {res['duplicates']} doublon(s) ignoré(s)")
+            if res["rejected"]:
+                st.warning(f"⚠️ {res['rejected']} ligne(s) illisible(s) ignorée(s)")
+        except ValueError as e:
+            progress.empty()
+            st.error(str(e))
@@ -1,6 +1,6 @@
 import streamlit as st
 from database import (
-    init_db, insert_recurring, get_all_recurring, delete_recurring,
+    init_db, insert_recurring, get_all_recurring, delete_recurring, apply_due_recurring,
     get_category_names, ensure_user_has_categories,
 )
 from auth import require_auth, get_current_user_id, get_current_user
@@ -51,7 +51,9 @@ if st.button("➕ Ajouter ce récurrent", type="primary", use_container_width=Tr
         st.warning("⚠️ Label et montant requis.")
     else:
         insert_recurring(uid, rce, rcm, rcc, rct_val, rcf_val, rcj)
-        st.success(f"✅ Récurrent '{rce}' ajouté")
+        # Occurrences already due this month show up now, not at the next daily run
+        applied = apply_due_recurring(uid)
+        st.success(f"✅ Récurrent '{rce}' ajouté" + (f" ({applied} occurrence(s) ce mois-ci)" if applied else ""))
         st.rerun()
 
 # ─── List ───
@@ -63,16 +63,7 @@ if st.button("➕ Créer cette catégorie", type="primary", use_container_width=
     elif nc_nom in cat_names:
         st.warning("⚠️ Cette catégorie existe déjà.")
     else:
-        # We store sous_categories in the categories table directly
-        from database import get_connection
-        conn = get_connection()
-        from datetime import datetime
-        conn.execute(
-            "INSERT INTO categories (user_id, nom, icon, color, mots_cles, sous_categories, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (uid, nc_nom, nc_icon, nc_color, nc_kw, nc_sub, datetime.now().isoformat())
-        )
-        conn.commit()
-        conn.close()
+        insert_category(uid, nc_nom, nc_icon, nc_color, nc_kw, nc_sub)
         st.success(f"✅ Catégorie '{nc_nom}' créée !")
         st.rerun()
 
@@ -5,7 +5,7 @@ from database import (
     send_friend_request, accept_friend_request, reject_friend_request, remove_friend,
     get_debt_balance, get_all_unsettled_debts, create_debt, settle_debt,
     create_challenge, join_challenge, get_active_challenges,
-    get_challenge_scores, get_challenge_participants, delete_challenge,
+    get_challenge_leaderboards, get_challenge_participants, delete_challenge,
     get_category_names,
 )
 from auth import require_auth, get_current_user_id, get_current_user
@@ -235,12 +235,13 @@ with tab_challenges:
     if not challenges:
         st.caption("Aucun challenge en cours.")
     else:
+        leaderboards = get_challenge_leaderboards(uid)
         for ch in challenges:
             with st.expander(f"🏆 {ch['title']} — #{ch['id']}", expanded=True):
                 cat_label = ch["categorie"] if ch["categorie"] else "Toutes catégories"
                 st.caption(f"📅 {ch['date_debut']} → {ch['date_fin']} · {cat_label} · Plafond: {ch['montant_max']:.0f}€")
 
-                scores = get_challenge_scores(ch["id"])
+                scores = leaderboards.get(ch["id"], [])
                 for i, s in enumerate(scores):
                     pct = min((s["total"] / s["max"] * 100), 100) if s["max"] > 0 else 0
                     over = s["total"] > s["max"]
@@ -4,7 +4,7 @@ from collections import defaultdict
 
 from database import (
     init_db, search_transactions, get_category_map,
-    get_user_by_id, ensure_user_has_categories,
+    get_user_by_id, ensure_user_has_categories, SUMMARY_COLUMNS,
 )
 from auth import require_auth, get_current_user_id, get_current_user
 from styles import inject_css
@@ -36,7 +36,7 @@ st.markdown("# 🔍 Recherche")
 query = st.text_input("Rechercher", placeholder="Carrefour, Netflix, #vacances…", key="search_q")
 
 if query and len(query) >= 2:
-    results = search_transactions(uid, query)
+    results = search_transactions(uid, query, columns=SUMMARY_COLUMNS)
     cat_map = get_category_map(uid)
 
     if not results:
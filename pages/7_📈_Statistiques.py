@@ -1,12 +1,12 @@
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
 from collections import defaultdict
 
 from database import (
-    init_db, get_all_transactions, get_monthly_totals,
+    init_db, get_active_years, get_monthly_totals,
     get_category_map, get_category_names, ensure_user_has_categories,
+    get_category_totals, get_category_monthly_totals, get_enseigne_totals, get_weekday_totals,
 )
 from auth import require_auth, get_current_user_id, get_current_user
 from styles import inject_css
@@ -25,21 +25,16 @@ JOURS_FR = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanc
 
 st.markdown("# 📈 Statistiques")
 
-all_tx = get_all_transactions(uid)
+yrs = get_active_years(uid)
 cat_map = get_category_map(uid)
 
-if not all_tx:
+if not yrs:
     st.info("Pas encore de données. Ajoutez des transactions pour voir vos statistiques.")
     st.stop()
 
-dep_tx = [t for t in all_tx if t.get("type", "depense") == "depense"]
-
 # ─── Period selector ───
-yrs = sorted(set(t["date"][:4] for t in all_tx))
 sel_yr = st.selectbox("Année", ["Toutes"] + yrs, index=0)
-
-if sel_yr != "Toutes":
-    dep_tx = [t for t in dep_tx if t["date"][:4] == sel_yr]
+year = sel_yr if sel_yr != "Toutes" else None
 
 # ═══ Monthly evolution chart ═══
 st.markdown("#### 📊 Évolution mensuelle")
@@ -71,9 +66,10 @@ c1, c2 = st.columns(2)
 
 with c1:
     st.markdown("#### 🎯 Top catégories")
-    cat_totals = defaultdict(float)
-    for t in dep_tx:
-        cat_totals[t["categorie"]] += t["montant_total"]
+    if year:
+        cat_totals = get_category_totals(uid, f"{year}-01", f"{year}-12")
+    else:
+        cat_totals = get_category_totals(uid)
 
     if cat_totals:
         cats = sorted(cat_totals.items(), key=lambda x: x[1], reverse=True)
@@ -96,16 +92,9 @@ with c1:
 
 with c2:
     st.markdown("#### 📅 Jour le plus dépensier")
-    day_totals = defaultdict(float)
-    day_counts = defaultdict(int)
-    for t in dep_tx:
-        try:
-            d = datetime.strptime(t["date"], "%Y-%m-%d")
-            wd = d.weekday()
-            day_totals[wd] += t["montant_total"]
-            day_counts[wd] += 1
-        except ValueError:
-            pass
+    weekday = get_weekday_totals(uid, year)
+    day_totals = {wd: v["total"] for wd, v in weekday.items()}
+    day_counts = {wd: v["nb"] for wd, v in weekday.items()}
 
     if day_totals:
         days = list(range(7))
@@ -127,10 +116,9 @@ with c2:
 
 # ═══ Category evolution over time ═══
 st.markdown("#### 📈 Évolution par catégorie")
-cat_monthly = defaultdict(lambda: defaultdict(float))
-for t in dep_tx:
-    m = t["date"][:7]
-    cat_monthly[t["categorie"]][m] = cat_monthly[t["categorie"]].get(m, 0) + t["montant_total"]
+cat_monthly = defaultdict(dict)
+for row in get_category_monthly_totals(uid, year):
+    cat_monthly[row["categorie"]][row["mois"]] = row["total"]
 
 if cat_monthly:
     all_months = sorted(set(m for cat in cat_monthly.values() for m in cat))
@@ -153,16 +141,11 @@ if cat_monthly:
 
 # ═══ Top enseignes ═══
 st.markdown("#### 🏪 Top enseignes")
-ens_totals = defaultdict(float)
-ens_counts = defaultdict(int)
-for t in dep_tx:
-    ens_totals[t["enseigne"]] += t["montant_total"]
-    ens_counts[t["enseigne"]] += 1
-
-if ens_totals:
-    top = sorted(ens_totals.items(), key=lambda x: x[1], reverse=True)[:15]
-    for i, (ens, total) in enumerate(top, 1):
-        count = ens_counts[ens]
+top = get_enseigne_totals(uid, year, limit=15)
+
+if top:
+    for i, row in enumerate(top, 1):
+        ens, total, count = row["enseigne"], row["total"], row["nb"]
         avg = total / count
         medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"#{i}"
         st.markdown(f"""<div class="glass" style="padding:0.5rem 0.8rem;margin-bottom:0.2rem">
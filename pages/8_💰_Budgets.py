@@ -46,7 +46,7 @@ st.markdown("---")
 now = datetime.now()
 st.markdown(f"#### 📊 État du mois — {now.strftime('%B %Y')}")
 
-txs = get_transactions_by_month(uid, now.year, now.month)
+txs = get_transactions_by_month(uid, now.year, now.month, columns=["categorie", "montant_total", "type"])
 cat_spent = defaultdict(float)
 for t in txs:
     if t.get("type", "depense") == "depense":
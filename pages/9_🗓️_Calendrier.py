@@ -32,7 +32,7 @@ with c1:
 with c2:
     mo = st.selectbox("Mois", range(1, 13), index=now.month - 1, format_func=lambda x: MOIS_FR[x], key="cal_mo")
 
-txs = get_transactions_by_month(uid, yr, mo)
+txs = get_transactions_by_month(uid, yr, mo, columns=["date", "montant_total", "type"])
 budgets = get_budgets(uid)
 total_budget = sum(budgets.values())
 cat_map = get_category_map(uid)
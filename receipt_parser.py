@@ -0,0 +1,180 @@
+"""Offline extraction of a till receipt's total, date and store from its OCR text.
+
+Covers the common French layout: store name at the top, a TOTAL / NET A PAYER
+line, a date somewhere. Each clue found adds to a confidence score. A receipt
+under LOCAL_MIN_CONFIDENCE (no total, conflicting totals, a refund, a bank
+screenshot listing several payments...), or whose store name matches no category
+keyword, is left to Gemini.
+"""
+import os
+import re
+from datetime import date, timedelta
+
+from categorizer import normalize
+
+LOCAL_PARSER = os.getenv("BUDGET_LOCAL_PARSER", "1") != "0"
+LOCAL_MIN_CONFIDENCE = float(os.getenv("BUDGET_LOCAL_MIN_CONFIDENCE", 0.8))
+
+# Score of each clue; a total is required, the rest only adds confidence
+WEIGHTS = {"total": 0.5, "confirmed": 0.2, "date": 0.1, "store": 0.1, "category": 0.1}
+# Receipts older than this are more likely a misread date
+MAX_AGE_DAYS = 730
+
+# Amounts are matched on accent-stripped lowercase text. No thousands separator:
+# "QTE 2 12,50" must not read as 212.50. Dates (12.01.26) are not amounts.
+_AMOUNT = re.compile(r"(?<![\d.,/])(-?\d{1,4})\s?[,.]\s?(\d{2})(?![\d]|[.,/]\d)")
+_AMOUNT_ONLY = re.compile(r"^\W*(?:eur\s*)?-?\d{1,4}\s?[,.]\s?\d{2}\s*(?:€|eur|e)?\W*$")
+# Highest priority first: "net a payer" beats "total" beats a bare "ttc"
+_TOTALS = [
+    re.compile(r"\b(?:net|reste|montant)\s+a\s+payer\b|\btotal\s+(?:ttc|a\s+payer|du|eur|euros?)\b|\ba\s+payer\b"),
+    re.compile(r"\btotal\b"),
+    re.compile(r"\bmontant\s+(?:ttc|du)\b|\bttc\b"),
+]
+_NOT_TOTAL = re.compile(r"sous[\s-]?total|\btotal\s+(?:ht|tva|remises?|economies?|articles?|points?)\b|"
+                        r"\bht\b|\btva\b|\bremise|\beconomi|\bfidelite|\bnb\b|\bnombre\b|\bpoints?\b|\bcumul")
+_PAYMENT = re.compile(r"\b(?:cb|carte|visa|mastercard|maestro|amex|especes|paiement|paye|regle|"
+                      r"sans\s+contact|debit|montant|ticket\s+restaurant|tr)\b")
+_REFUND = re.compile(r"\b(?:rembourse|remboursement|avoir|retour\s+marchandise|annulation)\b")
+
+_DATE_NUMERIC = re.compile(r"(?<!\d)(\d{1,2})\s?[/.\-]\s?(\d{1,2})\s?[/.\-]\s?(\d{4}|\d{2})(?!\d)")
+_DATE_ISO = re.compile(r"(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)")
+_MONTHS = {"janv": 1, "fevr": 2, "fev": 2, "mars": 3, "avr": 4, "mai": 5, "juin": 6,
+           "juil": 7, "aout": 8, "sept": 9, "oct": 10, "nov": 11, "dec": 12}
+_DATE_WORDS = re.compile(r"(?<!\d)(\d{1,2})\s+(" + "|".join(sorted(_MONTHS, key=len, reverse=True))
+                         + r")[a-z]*\.?\s+(\d{4})(?!\d)")
+
+# Header lines that are not the store's name
+_NOT_STORE = re.compile(
+    r"@|www|http|\.fr\b|\.com\b|\b\d{5}\b|\b\d{2}[ .]\d{2}[ .]\d{2}[ .]\d{2}\b|"
+    r"\b(?:rue|avenue|av|bd|boulevard|place|route|chemin|allee|quai|za|zi|zac|cedex|centre\s+commercial|cc)\b|"
+    r"\b(?:siret|siren|rcs|naf|ape|tva|tel|fax|bienvenue|merci|ticket|caisse|facture|duplicata|client|"
+    r"magasin\s+n|horaires|ouvert)\b")
+_LEGAL_FORMS = re.compile(r"\s+(?:s\.?a\.?s\.?u?|s\.?a\.?r\.?l\.?|s\.?a\.?|e\.?u\.?r\.?l\.?)$", re.IGNORECASE)
+HEADER_LINES = 6
+
+
+def _amounts(line: str) -> list[float]:
+    # OCR reads 0 as O inside prices: "23,4O"
+    line = re.sub(r"(?<=[\d,.])o|o(?=[,.]?\d)", "0", line)
+    return [float(f"{units}.{cents}") for units, cents in _AMOUNT.findall(line)]
+
+
+def _total_candidates(lines: list[str]) -> list[tuple[int, int, float]]:
+    """(priority, line index, amount) for every total line, the amount possibly on the next line."""
+    found = []
+    for i, line in enumerate(lines):
+        if _NOT_TOTAL.search(line):
+            continue
+        priority = next((p for p, rx in enumerate(_TOTALS) if rx.search(line)), None)
+        if priority is None:
+            continue
+        amounts = _amounts(line)
+        if not amounts and i + 1 < len(lines) and _AMOUNT_ONLY.match(lines[i + 1]):
+            amounts = _amounts(lines[i + 1])
+        if amounts:
+            found.append((priority, i, amounts[-1]))
+    return found
+
+
+def _find_date(lines: list[str], today: date) -> str | None:
+    oldest = today - timedelta(days=MAX_AGE_DAYS)
+    for line in lines:
+        candidates = [(int(d), int(m), int(y)) for d, m, y in _DATE_NUMERIC.findall(line)]
+        candidates += [(int(d), int(m), int(y)) for y, m, d in _DATE_ISO.findall(line)]
+        candidates += [(int(d), _MONTHS[m], int(y)) for d, m, y in _DATE_WORDS.findall(line)]
+        for d, m, y in candidates:
+            try:
+                value = date(y + 2000 if y < 100 else y, m, d)
+            except ValueError:
+                continue
+            if oldest <= value <= today:
+                return value.isoformat()
+    return None
+
+
+def _find_store(raw_lines: list[str], lines: list[str]) -> str | None:
+    """First plausible store name in the header, which ends at the first priced line."""
+    for raw, line in zip(raw_lines[:HEADER_LINES], lines[:HEADER_LINES]):
+        if _amounts(line):
+            break
+        letters = sum(c.isalpha() for c in line)
+        if letters < 3 or letters < len(line.replace(" ", "")) / 2 or _NOT_STORE.search(line):
+            continue
+        if _DATE_NUMERIC.search(line):
+            continue
+        return _clean_store(raw)
+    return None
+
+
+def _clean_store(raw: str) -> str:
+    # OCR reads O as 0 inside words: "M0NOPRIX"
+    name = re.sub(r"(?<=[A-Za-z])0|0(?=[A-Za-z])", "O", " ".join(raw.split()))
+    name = _LEGAL_FORMS.sub("", name.strip(" *-=#.:"))
+    return name.title() if name.isupper() else name
+
+
+def extract_receipt(text: str, today: date = None, matcher=None) -> dict:
+    """Parse one receipt's OCR text.
+
+    Returns {"enseigne", "date", "montant", "categorie", "type", "confidence", "clues"}.
+    enseigne/date/montant/categorie are None when not found; `clues` lists what was.
+    With a KeywordMatcher the category comes from the user's keywords, matched on the store
+    name only: item lines ("JUS ORANGE", "GAZOLE") say nothing about the shop.
+    """
+    today = today or date.today()
+    raw_lines = [line.strip() for line in text.splitlines() if line.strip()]
+    lines = [normalize(line) for line in raw_lines]
+    result = {"enseigne": None, "date": None, "montant": None, "categorie": None, "type": "depense",
+              "confidence": 0.0, "clues": []}
+    if not lines or _REFUND.search(" ".join(lines)):
+        return result
+
+    clues = []
+    totals = _total_candidates(lines)
+    if totals:
+        best = min(p for p, _, _ in totals)
+        values = {amount for p, _, amount in totals if p == best}
+        total_line = max(i for p, i, _ in totals if p == best)
+        montant = [amount for p, i, amount in totals if i == total_line][0]
+        # Two different amounts both called "TOTAL TTC": do not guess
+        if len(values) == 1 and montant > 0:
+            result["montant"] = montant
+            clues.append("total")
+            # Confirmed by the card slip ("CB 23,40") or by the item prices adding up
+            skip = {i for _, i, _ in totals}
+            paid = [a for line in lines[total_line + 1:] if _PAYMENT.search(line) for a in _amounts(line)]
+            items = sum(a for i, line in enumerate(lines[:total_line]) if i not in skip
+                        and not _NOT_TOTAL.search(line) and not _PAYMENT.search(line) for a in _amounts(line)[-1:])
+            if any(abs(a - montant) < 0.005 for a in paid) or abs(items - montant) < 0.005:
+                clues.append("confirmed")
+
+    result["date"] = _find_date(lines, today)
+    if result["date"]:
+        clues.append("date")
+    result["enseigne"] = _find_store(raw_lines, lines)
+    if result["enseigne"]:
+        clues.append("store")
+    if matcher is not None:
+        result["categorie"] = matcher.match(result["enseigne"] or "")
+    if result["categorie"]:
+        clues.append("category")
+
+    result["clues"] = clues
+    if "total" in clues:
+        result["confidence"] = round(sum(WEIGHTS[c] for c in clues), 2)
+    return result
+
+
+def local_transaction(text: str, default_date: str, matcher) -> dict | None:
+    """The receipt as a transaction when the local parse is confident enough, else None."""
+    found = extract_receipt(text, date.fromisoformat(default_date), matcher)
+    # No keyword in the store name: the category would be a guess, Gemini picks it
+    if found["confidence"] < LOCAL_MIN_CONFIDENCE or not found["categorie"]:
+        return None
+    return {
+        "enseigne": found["enseigne"] or "Inconnu",
+        "date": found["date"] or default_date,
+        "montant": found["montant"],
+        "categorie": found["categorie"],
+        "type": "depense",
+    }
@@ -0,0 +1,69 @@
+"""Daily materialisation of recurring transactions, off the page renders.
+
+A daemon thread applies the occurrences due for every user at startup, then a
+few minutes after each midnight. Each recurrence keeps a last_applied
+watermark, so a run only covers the days since the previous one and a process
+that was down catches up on its next start. Several processes may run the
+scheduler: runs take the write lock, so the second one finds nothing left to do.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import apply_due_recurring
+
+# Seconds after midnight (local time) of the daily run
+RECURRING_RUN_OFFSET = int(os.getenv("BUDGET_RECURRING_OFFSET", 300))
+# Wait before trying again after a failed run
+RECURRING_RETRY_SECONDS = 300
+
+_thread = None
+_thread_lock = threading.Lock()
+_status = {"last_run": None, "applied": 0, "error": None}
+
+
+def start_recurring_scheduler():
+    """Start the daily run in the background, running once right away. Idempotent."""
+    global _thread
+    if _thread is not None:
+        return _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name="recurring-scheduler", daemon=True)
+            _thread.start()
+    return _thread
+
+
+def seconds_until_next_run(now: datetime = None) -> float:
+    now = now or datetime.now()
+    next_run = datetime.combine(now.date(), datetime.min.time()) + timedelta(seconds=RECURRING_RUN_OFFSET)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def run_recurring_now() -> int:
+    """Apply every due occurrence now; returns how many transactions were added."""
+    try:
+        applied = apply_due_recurring()
+    except Exception as e:
+        _status.update(last_run=datetime.now().isoformat(timespec="seconds"), error=str(e) or type(e).__name__)
+        raise
+    _status.update(last_run=datetime.now().isoformat(timespec="seconds"), applied=applied, error=None)
+    return applied
+
+
+def get_scheduler_status() -> dict:
+    """{"last_run", "applied", "error"} of the latest run in this process."""
+    return dict(_status)
+
+
+def _loop():
+    while True:
+        try:
+            run_recurring_now()
+            delay = seconds_until_next_run()
+        except Exception:
+            delay = RECURRING_RETRY_SECONDS
+        time.sleep(delay)